@@ -0,0 +1,130 @@
+import numpy
+import scipy.sparse
+
+CONST_HAS_ATTRIBUTE_EDGE = 'has_attribute'
+CONST_ATTR_TYPE = 'attr'
+
+# Sparse boolean objects x attributes matrix of a scene graph, built from its SceneGraphIndex, for answering many
+# attribute(A,X) checks at once (QuestionHandling.attributeCheckQueries).  Rows are the object nodes and columns the
+# attribute nodes, with an entry wherever a has_attribute edge joins the two.  Rows are laid out so all the nodes sharing
+# a base name (bat, bat_2, ...) are contiguous, and columns likewise by attribute name, so each check is the block where
+# the rows of X meet the columns of A, and a whole list of checks is answered through one scipy sparse matrix product
+# (see checkAttributes).  The matrix is stored as plain CSR arrays.  Single attribute queries are answered from the
+# index lookup tables, which beat a matrix lookup when there is only one answer to find.
+class AttributeMatrix:
+    def __init__(self, objectNodes, objectGroups, attributeNodes, attributeGroups, rowOffsets, rowColumns):
+        # Row number -> object node, and object base name -> (first row, last row + 1)
+        self.objectNodes = objectNodes
+        self.objectGroups = objectGroups
+        # Column number -> attribute node, and attribute name -> (first column, last column + 1)
+        self.attributeNodes = attributeNodes
+        self.attributeGroups = attributeGroups
+        # CSR: the columns of the entries of row i are rowColumns[rowOffsets[i]:rowOffsets[i + 1]]
+        self.rowOffsets = rowOffsets
+        self.rowColumns = rowColumns
+        # Object rows x attribute names, built on first use by checkAttributes
+        self.objectAttributeNames = None
+
+    @classmethod
+    def fromIndex(cls, sceneGraphIndex):
+        attributeEdges = sceneGraphIndex.successorsByLabel.get(CONST_HAS_ATTRIBUTE_EDGE, {})
+        # Attribute nodes: the nodes typed as attributes, the same ones attributeCheckQuery looks at
+        attributeNodeSet = {nodeName for nodeName, nodeType in sceneGraphIndex.nodeTypes.items()
+                            if nodeType == CONST_ATTR_TYPE}
+
+        objectNodes, objectGroups = _groupNodes(sceneGraphIndex.nodesByBaseName, attributeNodeSet, False)
+        attributeNodes, attributeGroups = _groupNodes(sceneGraphIndex.nodesByAttributeName, attributeNodeSet, True)
+        rowNumbers = {nodeName: rowNumber for rowNumber, nodeName in enumerate(objectNodes)}
+        columnNumbers = {nodeName: columnNumber for columnNumber, nodeName in enumerate(attributeNodes)}
+
+        edgeRows = []
+        edgeColumns = []
+        for source, targets in attributeEdges.items():
+            rowNumber = rowNumbers.get(source)
+            if rowNumber is None:
+                # has_attribute coming out of an attribute node; not an object-attribute pair
+                continue
+            for target in targets:
+                columnNumber = columnNumbers.get(target)
+                # has_attribute pointing at a node not typed as an attribute is not an attribute either
+                if columnNumber is not None:
+                    edgeRows.append(rowNumber)
+                    edgeColumns.append(columnNumber)
+        edgeRows = numpy.array(edgeRows, dtype=numpy.int32)
+        edgeColumns = numpy.array(edgeColumns, dtype=numpy.int32)
+
+        # Entries sorted by row for the CSR arrays
+        rowOrder = numpy.argsort(edgeRows, kind='stable')
+        rowOffsets = numpy.zeros(len(objectNodes) + 1, dtype=numpy.int32)
+        numpy.cumsum(numpy.bincount(edgeRows, minlength=len(objectNodes)), out=rowOffsets[1:])
+        return cls(objectNodes, objectGroups, attributeNodes, attributeGroups, rowOffsets, edgeColumns[rowOrder])
+
+    @property
+    def shape(self):
+        return len(self.objectNodes), len(self.attributeNodes)
+
+    # The matrix as a scipy sparse boolean matrix (objects x attribute nodes)
+    def toSparse(self):
+        return scipy.sparse.csr_matrix((numpy.ones(len(self.rowColumns), dtype=bool), self.rowColumns,
+                                        self.rowOffsets), shape=self.shape)
+
+    # Answer many attribute(A,X) checks at once.  queryPairs is a list of (attribute name, object name); the result has,
+    # for each pair, the objects named X having an attribute named A (in graph order), or None if X or A is not in the
+    # graph.  The columns are first merged by attribute name with one sparse product (objects x attribute names), then
+    # the rows of every queried object are masked against the queried attribute's column in one elementwise product.
+    def checkAttributes(self, queryPairs):
+        queryAnswers = [None] * len(queryPairs)
+        knownQueries = [queryNumber for queryNumber, (attributeName, objectName) in enumerate(queryPairs)
+                        if objectName in self.objectGroups and attributeName in self.attributeGroups]
+        if not knownQueries:
+            return queryAnswers
+        attributeNames = list(self.attributeGroups)
+        if self.objectAttributeNames is None:
+            # Attribute node -> attribute name indicator, so the product says which names each object carries
+            nameColumns = numpy.empty(len(self.attributeNodes), dtype=numpy.int32)
+            for nameNumber, attributeName in enumerate(attributeNames):
+                firstColumn, lastColumn = self.attributeGroups[attributeName]
+                nameColumns[firstColumn:lastColumn] = nameNumber
+            nameIndicator = scipy.sparse.csr_matrix(
+                (numpy.ones(len(self.attributeNodes), dtype=bool), nameColumns,
+                 numpy.arange(len(self.attributeNodes) + 1)), shape=(len(self.attributeNodes), len(attributeNames)))
+            self.objectAttributeNames = (self.toSparse() @ nameIndicator).tocsc()
+        nameNumbers = {attributeName: nameNumber for nameNumber, attributeName in enumerate(attributeNames)}
+
+        # Queries x object rows, with each query's row block set
+        queryRowStarts = []
+        queryRowEnds = []
+        for queryNumber in knownQueries:
+            firstRow, lastRow = self.objectGroups[queryPairs[queryNumber][1]]
+            queryRowStarts.append(firstRow)
+            queryRowEnds.append(lastRow)
+        queryRowCounts = numpy.array(queryRowEnds) - numpy.array(queryRowStarts)
+        queryOffsets = numpy.zeros(len(knownQueries) + 1, dtype=numpy.int64)
+        numpy.cumsum(queryRowCounts, out=queryOffsets[1:])
+        queryRows = numpy.repeat(numpy.array(queryRowStarts) - queryOffsets[:-1], queryRowCounts) + \
+            numpy.arange(queryOffsets[-1])
+        queryBlocks = scipy.sparse.csr_matrix((numpy.ones(len(queryRows), dtype=bool), queryRows, queryOffsets),
+                                              shape=(len(knownQueries), len(self.objectNodes)))
+        queriedNames = self.objectAttributeNames[:, [nameNumbers[queryPairs[queryNumber][0]]
+                                                     for queryNumber in knownQueries]]
+        queryHits = queryBlocks.multiply(queriedNames.T).tocsr()
+        queryHits.eliminate_zeros()
+        queryHits.sort_indices()
+        for hitNumber, queryNumber in enumerate(knownQueries):
+            hitRows = queryHits.indices[queryHits.indptr[hitNumber]:queryHits.indptr[hitNumber + 1]]
+            queryAnswers[queryNumber] = tuple(self.objectNodes[rowNumber] for rowNumber in hitRows.tolist())
+        return queryAnswers
+
+
+# Lay out the nodes of a name -> nodes table contiguously, keeping only the attribute nodes (or only the others).
+# Returns the node list and name -> (first position, last position + 1).
+def _groupNodes(nodesByName, attributeNodeSet, keepAttributeNodes):
+    groupedNodes = []
+    nodeGroups = {}
+    for groupName, groupNodes in nodesByName.items():
+        groupStart = len(groupedNodes)
+        groupedNodes.extend(nodeName for nodeName in groupNodes
+                            if (nodeName in attributeNodeSet) == keepAttributeNodes)
+        if len(groupedNodes) > groupStart:
+            nodeGroups[groupName] = (groupStart, len(groupedNodes))
+    return groupedNodes, nodeGroups
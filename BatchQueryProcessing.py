@@ -0,0 +1,141 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from QuestionHandling import *
+import QueryInstrumentation
+from SceneGraphCache import loadSceneGraphIndex
+
+# Runs a fixed set of queries against every scene graph in a directory (or matching a glob) and streams one JSON line
+# per (graph, query) pair.  Work is split across a process pool one graph at a time, so each worker parses a given
+# GraphML file exactly once and then answers the whole query set against the index it built from it.
+#
+# Usage: python BatchQueryProcessing.py scene_graph_graphmls/ queries.txt -o results.jsonl
+#
+# The query file holds one query per line in the same syntax as the interactive prompt, e.g. exists(bat),
+# relation(?,pants,bat) or attribute(red,?).  Blank lines and lines starting with "#" are skipped.
+#
+# With --metrics, every worker records stage timings (see QueryInstrumentation.py) and sends them back with each
+# graph's results; they are merged and written out when the batch is done.
+
+# Set once per worker by the pool initializer so the query list is not re-pickled with every task
+_workerQueries = []
+_workerWritesCache = True
+
+
+# Expand a directory into the GraphML files it contains, or treat anything else as a glob pattern
+def findSceneGraphFiles(graphSource: str):
+    if os.path.isdir(graphSource):
+        graphSource = os.path.join(graphSource, '*.graphml')
+    return sorted(glob.glob(graphSource))
+
+
+# Read the query set (see QueryParsing.readQueries)
+def readQueryFile(queryFile: str):
+    with open(queryFile, encoding='utf-8') as queryStream:
+        return readQueries(queryStream)
+
+
+def _initWorker(queries, writeCache, recordMetrics=False):
+    global _workerQueries, _workerWritesCache
+    _workerQueries = queries
+    _workerWritesCache = writeCache
+    if recordMetrics:
+        QueryInstrumentation.enableInstrumentation()
+
+
+# Worker task: load one graph (from its compiled cache when there is a fresh one), build its index once and answer
+# every query against it.  Results are taken straight from the handlers' return values with printing turned off, so no
+# message text is ever formatted.  Returns the query records, plus the worker's measurements for this graph when it is
+# recording metrics (None otherwise).
+def _answerQueriesForGraph(graphFile: str):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return _answerQueries(graphFile), None
+    queryRecorder.currentGraph = graphFile
+    queryRecords = _answerQueries(graphFile)
+    # Hand this graph's measurements back to the parent process and start afresh for the next graph
+    QueryInstrumentation.enableInstrumentation()
+    return queryRecords, queryRecorder
+
+
+def _answerQueries(graphFile):
+    try:
+        sceneGraphIndex = loadSceneGraphIndex(graphFile, _workerWritesCache)
+    except Exception as loadError:
+        return [{'graph': graphFile, 'error': 'Could not load scene graph: ' + str(loadError)}]
+    queryRecords = []
+    for userQuery in _workerQueries:
+        queryRecord = {'graph': graphFile, 'query': userQuery}
+        try:
+            queryResult = answerQuery(userQuery, sceneGraphIndex, False)
+            if queryResult is None:
+                queryRecord['error'] = 'Unknown query type'
+            else:
+                queryRecord.update(queryResult.toDict())
+        except Exception as queryError:
+            queryRecord['error'] = str(queryError)
+        queryRecords.append(queryRecord)
+    return queryRecords
+
+
+# Answer every query against every graph and write the results to outputStream as JSON lines, in completion order.
+# chunkSize controls how many graphs are handed to a worker at once; by default it is sized so each worker gets
+# several chunks, which keeps all cores busy without paying the scheduling overhead once per graph.  Given a
+# QueryRecorder as metricsRecorder, the workers' measurements are merged into it.
+def runBatch(graphFiles, queries, outputStream, processes=None, chunkSize=None, writeCache=True, metricsRecorder=None):
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunkSize is None:
+        chunkSize = max(1, len(graphFiles) // (processes * 4))
+    with multiprocessing.Pool(processes, initializer=_initWorker,
+                              initargs=(queries, writeCache, metricsRecorder is not None)) as pool:
+        for queryRecords, workerRecorder in pool.imap_unordered(_answerQueriesForGraph, graphFiles, chunkSize):
+            for queryRecord in queryRecords:
+                outputStream.write(json.dumps(queryRecord) + '\n')
+            outputStream.flush()
+            if workerRecorder is not None:
+                metricsRecorder.merge(workerRecorder)
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Answer a set of queries against many scene graphs.')
+    argumentParser.add_argument('graphs', help='directory of .graphml files or a glob pattern matching them')
+    argumentParser.add_argument('queries', help='file with one query per line, e.g. exists(bat)')
+    argumentParser.add_argument('-o', '--output', help='JSONL file to write results to (default: stdout)')
+    argumentParser.add_argument('-j', '--processes', type=int, help='number of worker processes (default: all cores)')
+    argumentParser.add_argument('--chunk-size', type=int, help='number of graphs handed to a worker at a time')
+    argumentParser.add_argument('--no-write-cache', action='store_true',
+                                help='do not write compiled .sgc caches for graphs that have none')
+    argumentParser.add_argument('--metrics', metavar='FILE',
+                                help='record stage timings and write them to FILE (Prometheus text if it ends in '
+                                     '.prom, JSON otherwise)')
+    arguments = argumentParser.parse_args()
+
+    graphFiles = findSceneGraphFiles(arguments.graphs)
+    if not graphFiles:
+        argumentParser.error('no scene graphs found at ' + arguments.graphs)
+    queries = readQueryFile(arguments.queries)
+    # Check every query parses before starting any workers, so a typo fails fast instead of once per graph
+    for userQuery in queries:
+        try:
+            parseQuery(userQuery)
+        except QuerySyntaxError as syntaxError:
+            argumentParser.error(str(syntaxError))
+
+    metricsRecorder = QueryInstrumentation.QueryRecorder() if arguments.metrics is not None else None
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as outputStream:
+            runBatch(graphFiles, queries, outputStream, arguments.processes, arguments.chunk_size,
+                     not arguments.no_write_cache, metricsRecorder)
+    else:
+        runBatch(graphFiles, queries, sys.stdout, arguments.processes, arguments.chunk_size,
+                 not arguments.no_write_cache, metricsRecorder)
+    if metricsRecorder is not None:
+        metricsRecorder.writeTo(arguments.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Keeps track of which nodes have context gaps (no edges connected to them at all) as the graph changes.  Each node's
+# degree is kept as a running count and the nodes at degree zero are kept in a set, so adding or removing a node or an
+# edge costs O(1), checking a node is O(1) and listing the gaps is O(number of gaps), with no rescan of the graph.
+class ContextGapTracker:
+    def __init__(self):
+        # Node name -> number of edges touching it (a self loop counts twice, as in networkx)
+        self.nodeDegrees = {}
+        # Nodes with no edges, kept in a dict so they list in the order they became isolated
+        self.isolatedNodes = {}
+
+    # One-shot scan of an existing networkx graph.  Reads the degree view directly, so no per-node edge lists are built.
+    @classmethod
+    def fromGraph(cls, sceneGraph):
+        contextGapTracker = cls()
+        nodeDegrees = contextGapTracker.nodeDegrees
+        isolatedNodes = contextGapTracker.isolatedNodes
+        for currentNode, nodeDegree in sceneGraph.degree:
+            nodeDegrees[currentNode] = nodeDegree
+            if nodeDegree == 0:
+                isolatedNodes[currentNode] = None
+        return contextGapTracker
+
+    def __len__(self):
+        return len(self.isolatedNodes)
+
+    # A newly added node has no edges yet, so it starts out as a context gap
+    def addNode(self, nodeName):
+        if nodeName not in self.nodeDegrees:
+            self.nodeDegrees[nodeName] = 0
+            self.isolatedNodes[nodeName] = None
+
+    # Forget a node.  Its edges are expected to have been removed through removeEdge first.
+    def removeNode(self, nodeName):
+        del self.nodeDegrees[nodeName]
+        self.isolatedNodes.pop(nodeName, None)
+
+    def addEdge(self, source, target):
+        self.addNode(source)
+        self.addNode(target)
+        self.nodeDegrees[source] += 1
+        self.nodeDegrees[target] += 1
+        self.isolatedNodes.pop(source, None)
+        self.isolatedNodes.pop(target, None)
+
+    def removeEdge(self, source, target):
+        for currentNode in (source, target):
+            self.nodeDegrees[currentNode] -= 1
+            if self.nodeDegrees[currentNode] == 0:
+                self.isolatedNodes[currentNode] = None
+
+    def isContextGap(self, nodeName):
+        return nodeName in self.isolatedNodes
+
+    # The same list contextGapCheck reports: every node with no edges connected to it
+    def contextGappedNodes(self):
+        return list(self.isolatedNodes)
@@ -0,0 +1,338 @@
+import argparse
+import bisect
+import multiprocessing
+import os
+import struct
+import sys
+from array import array
+from BatchQueryProcessing import findSceneGraphFiles
+from QuestionHandling import *
+from SceneGraphCache import loadSceneGraphIndex
+
+# On-disk inverted index over a whole corpus of scene graphs, for questions such as "which images have a red shirt to
+# the left of a bat" without loading every GraphML file.  Each graph in the corpus gets a number (its position in the
+# sorted file list) and every term below maps to the sorted array of numbers of the graphs containing it:
+#   object      base name of any node (after stripOffUnderscoreNumber), as matched by exists(object)
+#   attribute   attribute name (after stripOffUnderscoreAttr) of any "_attr" node
+#   triple      (source, relation, target) base names of an edge, plus the (source, relation), (relation, target) and
+#               (source, target) parts of it and the relation on its own, so queries with a ? still narrow the search
+#   objectAttr  (object, attribute) pair of a has_attribute edge
+# A query is first turned into the terms it needs, their posting lists are intersected to get the candidate graphs, and
+# only those candidates are loaded and answered with the ordinary handlers.  The index decides which graphs can match;
+# the handlers still decide what the answer is, so corpus-wide answers agree exactly with per-graph ones.
+#
+# File layout (little-endian uint32 arrays after the header, as in SceneGraphCache):
+#   header          magic, format version, graph count, term count, total posting count, string blob size
+#   stringOffsets   [graph count + term count + 1]  start of each string in the blob: graph paths, then sorted terms
+#   postingOffsets  [term count + 1]                the postings of term i are postings[postingOffsets[i]:...[i + 1]]
+#   postings        [total posting count]           graph numbers, ascending within each term
+#   stringBlob      UTF-8 bytes of every string, back to back
+#
+# Usage: python CorpusIndex.py build scene_graph_graphmls/
+#        python CorpusIndex.py query scene_graph_graphmls/corpus.sgi "attribute(red,?s) & relation(?r,?s,bat)"
+
+CONST_INDEX_FILE_NAME = 'corpus.sgi'
+CONST_INDEX_MAGIC = b'SGCI'
+CONST_INDEX_VERSION = 1
+# Separates the kind of a term and its parts.  Unit separator, so it cannot clash with anything in a node name.
+CONST_TERM_SEPARATOR = '\x1f'
+_HEADER_FORMAT = '<4sIIIII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+_OBJECT_TERM = 'o'
+_ATTRIBUTE_TERM = 'a'
+_LABEL_TERM = 'l'
+_SOURCE_LABEL_TERM = 'sl'
+_LABEL_TARGET_TERM = 'lt'
+_SOURCE_TARGET_TERM = 'st'
+_TRIPLE_TERM = 'slt'
+_OBJECT_ATTRIBUTE_TERM = 'oa'
+
+# Results that mean the graph does contain what was asked about (a target gap is several matches, not none)
+_MATCHING_STATUSES = (CONST_STATUS_SUCCESS, CONST_STATUS_TARGET_GAP)
+
+
+def _term(termKind, *termParts):
+    return CONST_TERM_SEPARATOR.join((termKind,) + termParts)
+
+
+# Every term one graph contributes to the index
+def sceneGraphTerms(sceneGraphIndex: SceneGraphIndex):
+    graphTerms = set()
+    for baseName in sceneGraphIndex.nodesByBaseName:
+        graphTerms.add(_term(_OBJECT_TERM, baseName))
+    for attributeName, attributeNodes in sceneGraphIndex.nodesByAttributeName.items():
+        if any(attributeNode != attributeName for attributeNode in attributeNodes):
+            graphTerms.add(_term(_ATTRIBUTE_TERM, attributeName))
+    for sourceName, edgeLabel, targetName in sceneGraphIndex.triplesBySourceLabelTarget:
+        graphTerms.add(_term(_TRIPLE_TERM, sourceName, edgeLabel, targetName))
+        graphTerms.add(_term(_SOURCE_LABEL_TERM, sourceName, edgeLabel))
+        graphTerms.add(_term(_LABEL_TARGET_TERM, edgeLabel, targetName))
+        graphTerms.add(_term(_SOURCE_TARGET_TERM, sourceName, targetName))
+        graphTerms.add(_term(_LABEL_TERM, edgeLabel))
+    for objectName, attributeName in _attributeEdges(sceneGraphIndex):
+        graphTerms.add(_term(_OBJECT_ATTRIBUTE_TERM, objectName, attributeName))
+    return graphTerms
+
+
+# (object base name, attribute name) of every has_attribute edge
+def _attributeEdges(sceneGraphIndex):
+    for objectNode, attributeNodes in sceneGraphIndex.successorsByLabel.get(CONST_HAS_ATTRIBUTE_EDGE, {}).items():
+        for attributeNode in attributeNodes:
+            yield stripOffUnderscoreNumber(objectNode), stripOffUnderscoreAttr(attributeNode)
+
+
+# Intersect ascending posting lists.  Works from the shortest list, and looks each of its entries up in the longer ones
+# by binary search from where the previous lookup ended, so the cost follows the shortest list rather than the longest.
+def intersectPostings(postingLists):
+    if not postingLists:
+        return array('I')
+    postingLists = sorted(postingLists, key=len)
+    commonPostings = postingLists[0]
+    for otherPostings in postingLists[1:]:
+        if not commonPostings:
+            break
+        intersectedPostings = array('I')
+        searchStart = 0
+        for graphNumber in commonPostings:
+            searchStart = bisect.bisect_left(otherPostings, graphNumber, searchStart)
+            if searchStart == len(otherPostings):
+                break
+            if otherPostings[searchStart] == graphNumber:
+                intersectedPostings.append(graphNumber)
+        commonPostings = intersectedPostings
+    return array('I', commonPostings)
+
+
+class CorpusIndex:
+    def __init__(self, graphFiles, termNumbers, postingOffsets, postingView):
+        # Graph files, by graph number
+        self.graphFiles = graphFiles
+        # Term -> term number, for finding its slice of the postings
+        self.termNumbers = termNumbers
+        self.postingOffsets = postingOffsets
+        self.postingView = postingView
+
+    def __len__(self):
+        return len(self.graphFiles)
+
+    # Graph numbers of every graph containing the term, ascending
+    def postingsFor(self, indexTerm: str):
+        termNumber = self.termNumbers.get(indexTerm)
+        if termNumber is None:
+            return array('I')
+        return array('I', self.postingView[self.postingOffsets[termNumber]:self.postingOffsets[termNumber + 1]])
+
+    # Numbers of the graphs that can match a query: every graph holding all of the terms the query needs.  Exact for
+    # exists and for queries about whole triples; for the rest, a superset that the handlers then narrow down.
+    def candidateGraphs(self, queryPlan: QueryPlan):
+        queryTerms = queryPlanTerms(queryPlan)
+        if not queryTerms:
+            return array('I', range(len(self.graphFiles)))
+        return intersectPostings([self.postingsFor(queryTerm) for queryTerm in queryTerms])
+
+
+# Terms that every graph matching the query must contain
+def queryPlanTerms(queryPlan: QueryPlan):
+    if queryPlan.handlerName == CONST_PATTERN_HANDLER:
+        queryAtoms = queryPlan.arguments
+    else:
+        queryAtoms = (QueryAtom(queryPlan.keyword, queryPlan.arguments),)
+    queryTerms = set()
+    for queryAtom in queryAtoms:
+        # Unknowns, named or not, do not constrain which graphs can match
+        boundArguments = tuple(None if isinstance(queryArgument, QueryVariable) else queryArgument
+                               for queryArgument in queryAtom.arguments)
+        if queryAtom.keyword == CONST_EXISTENCE_KEYWORD:
+            queryTerms.add(_term(_OBJECT_TERM, boundArguments[0]))
+        elif queryAtom.keyword == CONST_RELATION_KEYWORD:
+            queryTerms.update(_relationTerms(*boundArguments))
+        elif queryAtom.keyword == CONST_ATTRIBUTE_KEYWORD:
+            queryTerms.update(_attributeTerms(*boundArguments))
+    return queryTerms
+
+
+def _relationTerms(queryRelation, querySource, queryTarget):
+    if queryRelation is not None and querySource is not None and queryTarget is not None:
+        return [_term(_TRIPLE_TERM, querySource, queryRelation, queryTarget)]
+    relationTerms = []
+    if querySource is not None and queryRelation is not None:
+        relationTerms.append(_term(_SOURCE_LABEL_TERM, querySource, queryRelation))
+    elif queryRelation is not None and queryTarget is not None:
+        relationTerms.append(_term(_LABEL_TARGET_TERM, queryRelation, queryTarget))
+    elif querySource is not None and queryTarget is not None:
+        relationTerms.append(_term(_SOURCE_TARGET_TERM, querySource, queryTarget))
+    elif queryRelation is not None:
+        relationTerms.append(_term(_LABEL_TERM, queryRelation))
+    else:
+        relationTerms.extend(_term(_OBJECT_TERM, queryObject) for queryObject in (querySource, queryTarget)
+                             if queryObject is not None)
+    return relationTerms
+
+
+def _attributeTerms(queryAttribute, queryObject):
+    if queryAttribute is not None and queryObject is not None:
+        return [_term(_OBJECT_ATTRIBUTE_TERM, queryObject, queryAttribute)]
+    if queryAttribute is not None:
+        return [_term(_ATTRIBUTE_TERM, queryAttribute)]
+    if queryObject is not None:
+        return [_term(_SOURCE_LABEL_TERM, queryObject, CONST_HAS_ATTRIBUTE_EDGE)]
+    return []
+
+
+# Worker task for building: the terms of one graph, loaded through the compiled cache like any other load
+def _graphTermsFor(graphFile: str):
+    return sorted(sceneGraphTerms(loadSceneGraphIndex(graphFile)))
+
+
+# Build the index over graphFiles and write it to indexFile.  Graph paths are stored relative to the index file, so the
+# corpus directory can be moved as a whole.
+def buildCorpusIndex(graphFiles, indexFile: str, processes=None):
+    graphFiles = sorted(graphFiles)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    postingsByTerm = {}
+    with multiprocessing.Pool(processes) as pool:
+        # imap hands the graphs back in file order, so appending keeps every posting list sorted
+        graphTermLists = pool.imap(_graphTermsFor, graphFiles, max(1, len(graphFiles) // (processes * 4)))
+        for graphNumber, graphTerms in enumerate(graphTermLists):
+            for graphTerm in graphTerms:
+                postingsByTerm.setdefault(graphTerm, array('I')).append(graphNumber)
+    writeCorpusIndex(graphFiles, postingsByTerm, indexFile)
+
+
+def writeCorpusIndex(graphFiles, postingsByTerm, indexFile: str):
+    indexDirectory = os.path.dirname(os.path.abspath(indexFile))
+    indexTerms = sorted(postingsByTerm)
+    storedStrings = [os.path.relpath(os.path.abspath(graphFile), indexDirectory) for graphFile in graphFiles] + \
+        indexTerms
+    encodedStrings = [storedString.encode('utf-8') for storedString in storedStrings]
+    stringOffsets = array('I', [0])
+    for encodedString in encodedStrings:
+        stringOffsets.append(stringOffsets[-1] + len(encodedString))
+    stringBlob = b''.join(encodedStrings)
+    postingOffsets = array('I', [0])
+    postings = array('I')
+    for indexTerm in indexTerms:
+        postings.extend(postingsByTerm[indexTerm])
+        postingOffsets.append(len(postings))
+
+    temporaryFile = indexFile + '.tmp' + str(os.getpid())
+    with open(temporaryFile, 'wb') as indexStream:
+        indexStream.write(struct.pack(_HEADER_FORMAT, CONST_INDEX_MAGIC, CONST_INDEX_VERSION, len(graphFiles),
+                                      len(indexTerms), len(postings), len(stringBlob)))
+        for integerArray in (stringOffsets, postingOffsets, postings):
+            if sys.byteorder != 'little':
+                integerArray.byteswap()
+            integerArray.tofile(indexStream)
+        indexStream.write(stringBlob)
+    os.replace(temporaryFile, indexFile)
+
+
+# Read an index written by buildCorpusIndex.  The term table is decoded up front; posting lists are only copied out of
+# the file when a query asks for them.  Raises ValueError if the file is not an index this version wrote.
+def readCorpusIndex(indexFile: str):
+    with open(indexFile, 'rb') as indexStream:
+        indexBytes = indexStream.read()
+    if len(indexBytes) < _HEADER_SIZE:
+        raise ValueError('Not a corpus index: ' + indexFile)
+    magic, version, graphCount, termCount, postingCount, blobSize = struct.unpack_from(_HEADER_FORMAT, indexBytes)
+    if magic != CONST_INDEX_MAGIC or version != CONST_INDEX_VERSION:
+        raise ValueError('Not a corpus index (or from another version): ' + indexFile)
+    arrayLengths = (graphCount + termCount + 1, termCount + 1, postingCount)
+    if len(indexBytes) != _HEADER_SIZE + 4 * sum(arrayLengths) + blobSize:
+        raise ValueError('Truncated corpus index: ' + indexFile)
+
+    integerArrays = []
+    arrayStart = _HEADER_SIZE
+    for arrayLength in arrayLengths:
+        integerArray = array('I', indexBytes[arrayStart:arrayStart + 4 * arrayLength])
+        if sys.byteorder != 'little':
+            integerArray.byteswap()
+        integerArrays.append(integerArray)
+        arrayStart += 4 * arrayLength
+    stringOffsets, postingOffsets, postings = integerArrays
+    stringBlob = indexBytes[arrayStart:arrayStart + blobSize]
+    storedStrings = [stringBlob[stringOffsets[stringNumber]:stringOffsets[stringNumber + 1]].decode('utf-8')
+                     for stringNumber in range(graphCount + termCount)]
+
+    indexDirectory = os.path.dirname(os.path.abspath(indexFile))
+    graphFiles = [os.path.normpath(os.path.join(indexDirectory, graphFile)) for graphFile in storedStrings[:graphCount]]
+    termNumbers = {indexTerm: termNumber for termNumber, indexTerm in enumerate(storedStrings[graphCount:])}
+    return CorpusIndex(graphFiles, termNumbers, postingOffsets, postings)
+
+
+# True if the index exists and no graph it covers has been modified since it was built
+def isCorpusIndexFresh(indexFile: str, graphFiles):
+    if not os.path.exists(indexFile):
+        return False
+    indexTime = os.path.getmtime(indexFile)
+    return all(os.path.exists(graphFile) and os.path.getmtime(graphFile) <= indexTime for graphFile in graphFiles)
+
+
+# Answer a query across the corpus.  Returns (graph file, QueryResult) for every graph in which the query matches,
+# loading only the candidate graphs the index picks out.  With outputResults set, each match is printed under its file.
+def answerCorpusQuery(userQuery: str, corpusIndex: CorpusIndex, outputResults = True, writeCache=True):
+    queryPlan = parseQuery(userQuery)
+    corpusMatches = []
+    for graphNumber in corpusIndex.candidateGraphs(queryPlan):
+        graphFile = corpusIndex.graphFiles[graphNumber]
+        queryResult = answerQueryPlan(queryPlan, loadSceneGraphIndex(graphFile, writeCache), False)
+        if queryResult.status in _MATCHING_STATUSES:
+            corpusMatches.append((graphFile, queryResult))
+            if outputResults == True:
+                print(graphFile + ":")
+                printQueryResult(queryResult)
+    if outputResults == True and not corpusMatches:
+        print("No scene graph in the corpus matches " + userQuery + ".")
+    return corpusMatches
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Build or query an inverted index over many scene graphs.')
+    subParsers = argumentParser.add_subparsers(dest='command', required=True)
+    buildParser = subParsers.add_parser('build', help='index every scene graph in a directory or glob')
+    buildParser.add_argument('graphs', help='directory of .graphml files or a glob pattern matching them')
+    buildParser.add_argument('-o', '--output', help='index file to write (default: ' + CONST_INDEX_FILE_NAME +
+                             ' in the graph directory)')
+    buildParser.add_argument('-j', '--processes', type=int, help='number of worker processes (default: all cores)')
+    queryParser = subParsers.add_parser('query', help='find the scene graphs matching each query')
+    queryParser.add_argument('index', help='index file, or the directory holding ' + CONST_INDEX_FILE_NAME)
+    queryParser.add_argument('queries', nargs='+', help='queries, e.g. "attribute(red,shirt)"')
+    queryParser.add_argument('--candidates-only', action='store_true',
+                             help='only list the candidate graphs from the index, without loading any of them')
+    arguments = argumentParser.parse_args()
+
+    if arguments.command == 'build':
+        graphFiles = findSceneGraphFiles(arguments.graphs)
+        if not graphFiles:
+            argumentParser.error('no scene graphs found at ' + arguments.graphs)
+        indexFile = arguments.output
+        if indexFile is None:
+            graphDirectory = arguments.graphs if os.path.isdir(arguments.graphs) else os.path.dirname(graphFiles[0])
+            indexFile = os.path.join(graphDirectory, CONST_INDEX_FILE_NAME)
+        buildCorpusIndex(graphFiles, indexFile, arguments.processes)
+        print("Indexed " + str(len(graphFiles)) + " scene graphs -> " + indexFile)
+        return
+
+    indexFile = arguments.index
+    if os.path.isdir(indexFile):
+        indexFile = os.path.join(indexFile, CONST_INDEX_FILE_NAME)
+    corpusIndex = readCorpusIndex(indexFile)
+    if not isCorpusIndexFresh(indexFile, corpusIndex.graphFiles):
+        print("WARNING: Some scene graphs changed after the index was built; rebuild it for up to date answers.")
+    for userQuery in arguments.queries:
+        try:
+            queryPlan = parseQuery(userQuery)
+        except QuerySyntaxError as syntaxError:
+            argumentParser.error(str(syntaxError))
+        print(">>> " + userQuery)
+        if arguments.candidates_only:
+            for graphNumber in corpusIndex.candidateGraphs(queryPlan):
+                print(corpusIndex.graphFiles[graphNumber])
+        else:
+            answerCorpusQuery(userQuery, corpusIndex)
+
+
+if __name__ == '__main__':
+    main()
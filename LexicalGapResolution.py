@@ -0,0 +1,236 @@
+import re
+from QueryResults import GapSuggestion
+from SceneGraphIndex import stripOffUnderscoreAttr
+
+# Gap resolution: when a query names an object or relation that does not appear in the graph (a lexical gap), suggest
+# names and labels that do appear and are probably what was meant.  Three kinds of suggestion are made, in this order:
+#   synonym    the queried word and a graph name are listed together in the synonym table, e.g. sneaker -> shoe
+#   spelling   a graph name within a small edit distance of the queried one, e.g. sheo -> shoe
+#   partial    a multi-word graph name containing every word of the query, e.g. left of -> to the left of
+#
+# Spelling candidates come from a symmetric-delete index: every string obtained by deleting up to
+# CONST_MAX_EDIT_DISTANCE characters from the first CONST_DELETE_PREFIX_LENGTH characters of a name maps back to that
+# name.  Two strings within edit distance d always share such a deletion, so a query only has to generate its own few
+# dozen deletions and look each one up, then check the handful of names found with a bounded edit distance.  The work
+# per query does not grow with the number of names in the graph.
+#
+# The synonym table is a plain dict (term -> set of terms) and can be swapped out with SceneGraphIndex.setSynonymTable;
+# readSynonymFile reads one from a text file with a comma-separated group of synonyms on each line.
+
+CONST_MAX_EDIT_DISTANCE = 2
+CONST_DELETE_PREFIX_LENGTH = 7
+CONST_MAX_SUGGESTIONS = 5
+CONST_SUGGESTION_SYNONYM = 'synonym'
+CONST_SUGGESTION_SPELLING = 'spelling'
+CONST_SUGGESTION_PARTIAL = 'partial'
+# Used when no synonym table is given.  Covers some of the common alternative names for objects and relations in the
+# scene graphs; a project-specific table can be loaded with readSynonymFile.
+CONST_DEFAULT_SYNONYM_GROUPS = (
+    ('shoe', 'sneaker', 'trainer', 'boot'),
+    ('shoes', 'sneakers', 'trainers', 'boots'),
+    ('hat', 'cap', 'helmet'),
+    ('shirt', 'jersey', 'top', 't-shirt', 'tshirt'),
+    ('pants', 'trousers', 'jeans', 'slacks'),
+    ('man', 'guy', 'male', 'gentleman'),
+    ('lady', 'woman', 'female'),
+    ('person', 'people', 'human'),
+    ('player', 'athlete', 'batter'),
+    ('spectator', 'fan', 'onlooker'),
+    ('cup', 'mug'),
+    ('coffee cup', 'coffee mug'),
+    ('cell phone', 'phone', 'mobile phone', 'cellphone'),
+    ('computer monitor', 'monitor', 'screen', 'display'),
+    ('computer mouse', 'mouse'),
+    ('grass', 'lawn', 'turf'),
+    ('gray', 'grey'),
+    ('on', 'on top of', 'atop'),
+    ('next to', 'near', 'beside', 'by'),
+    ('wearing', 'wears', 'dressed in'),
+    ('holding', 'holds', 'carrying'),
+    ('above', 'over'),
+    ('below', 'under', 'beneath', 'underneath'),
+)
+_WORD_SEPARATOR = re.compile(r'[\s_]+')
+
+
+# Turn groups of interchangeable terms into a lookup table: term -> every other term in any group it belongs to
+def buildSynonymTable(synonymGroups):
+    synonymTable = {}
+    for synonymGroup in synonymGroups:
+        synonymGroup = [synonymTerm.strip() for synonymTerm in synonymGroup if synonymTerm.strip()]
+        for synonymTerm in synonymGroup:
+            synonymTable.setdefault(synonymTerm, set()).update(otherTerm for otherTerm in synonymGroup
+                                                               if otherTerm != synonymTerm)
+    return synonymTable
+
+
+# Read a synonym table from a text file with one comma-separated group per line, e.g. "shoe, sneaker, trainer".
+# Blank lines and lines starting with "#" are skipped.
+def readSynonymFile(synonymFile: str):
+    synonymGroups = []
+    with open(synonymFile, encoding='utf-8') as synonymStream:
+        for synonymLine in synonymStream:
+            synonymLine = synonymLine.strip()
+            if synonymLine and not synonymLine.startswith('#'):
+                synonymGroups.append(synonymLine.split(','))
+    return buildSynonymTable(synonymGroups)
+
+
+# Largest edit distance a spelling suggestion may be from the queried term.  Short words get less slack, or nearly
+# every other short name in the graph would be suggested.
+def _maxEditDistance(queriedTerm):
+    if len(queriedTerm) <= 2:
+        return 0
+    if len(queriedTerm) <= 5:
+        return 1
+    return CONST_MAX_EDIT_DISTANCE
+
+
+# Every string made by deleting up to maxDistance characters from the start of a term
+def _deletions(queriedTerm, maxDistance):
+    termDeletions = {queriedTerm[:CONST_DELETE_PREFIX_LENGTH]}
+    for _ in range(maxDistance):
+        termDeletions |= {termDeletion[:characterNumber] + termDeletion[characterNumber + 1:]
+                          for termDeletion in termDeletions for characterNumber in range(len(termDeletion))}
+    return termDeletions
+
+
+# Edit distance (insertions, deletions, substitutions and swaps of adjacent characters) between two strings, or
+# maxDistance + 1 as soon as it is certain to be larger than maxDistance.  Only the diagonal band of cells that can stay
+# within maxDistance is filled in.
+def _boundedEditDistance(firstTerm, secondTerm, maxDistance):
+    secondLength = len(secondTerm)
+    if abs(len(firstTerm) - secondLength) > maxDistance:
+        return maxDistance + 1
+    tooFar = maxDistance + 1
+    twoRowsBack = None
+    previousRow = [min(secondNumber, tooFar) for secondNumber in range(secondLength + 1)]
+    for firstNumber in range(1, len(firstTerm) + 1):
+        firstCharacter = firstTerm[firstNumber - 1]
+        currentRow = [tooFar] * (secondLength + 1)
+        currentRow[0] = min(firstNumber, tooFar)
+        rowMinimum = currentRow[0]
+        for secondNumber in range(max(1, firstNumber - maxDistance), min(secondLength, firstNumber + maxDistance) + 1):
+            cellDistance = previousRow[secondNumber - 1]
+            if firstCharacter != secondTerm[secondNumber - 1]:
+                cellDistance += 1
+                if previousRow[secondNumber] + 1 < cellDistance:
+                    cellDistance = previousRow[secondNumber] + 1
+                if currentRow[secondNumber - 1] + 1 < cellDistance:
+                    cellDistance = currentRow[secondNumber - 1] + 1
+                if firstNumber > 1 and secondNumber > 1 and firstCharacter == secondTerm[secondNumber - 2] and \
+                        firstTerm[firstNumber - 2] == secondTerm[secondNumber - 1] and \
+                        twoRowsBack[secondNumber - 2] + 1 < cellDistance:
+                    cellDistance = twoRowsBack[secondNumber - 2] + 1
+            currentRow[secondNumber] = min(cellDistance, tooFar)
+            if cellDistance < rowMinimum:
+                rowMinimum = cellDistance
+        if rowMinimum > maxDistance:
+            return tooFar
+        twoRowsBack, previousRow = previousRow, currentRow
+    return previousRow[secondLength]
+
+
+# Fuzzy lookup over one vocabulary (the node base names or the edge labels of a graph)
+class TermIndex:
+    def __init__(self):
+        # Every term, and the index of each term in that list
+        self.terms = []
+        self.termNumbers = {}
+        # Deletion of a term prefix -> numbers of the terms it came from
+        self.termsByDeletion = {}
+        # Word -> numbers of the multi-word terms containing it
+        self.termsByWord = {}
+
+    def __contains__(self, queriedTerm):
+        return queriedTerm in self.termNumbers
+
+    def addTerm(self, newTerm):
+        if newTerm in self.termNumbers:
+            return
+        termNumber = len(self.terms)
+        self.terms.append(newTerm)
+        self.termNumbers[newTerm] = termNumber
+        for termDeletion in _deletions(newTerm, CONST_MAX_EDIT_DISTANCE):
+            self.termsByDeletion.setdefault(termDeletion, []).append(termNumber)
+        termWords = _WORD_SEPARATOR.split(newTerm)
+        if len(termWords) > 1:
+            for termWord in set(termWords):
+                self.termsByWord.setdefault(termWord, []).append(termNumber)
+
+    # Terms within maxDistance edits of queriedTerm, as (distance, term) pairs, closest first
+    def spellingMatches(self, queriedTerm, maxDistance):
+        if maxDistance == 0:
+            return []
+        candidateNumbers = set()
+        for termDeletion in _deletions(queriedTerm, maxDistance):
+            candidateNumbers.update(self.termsByDeletion.get(termDeletion, ()))
+        spellingMatches = []
+        for candidateNumber in candidateNumbers:
+            candidateTerm = self.terms[candidateNumber]
+            editDistance = _boundedEditDistance(queriedTerm, candidateTerm, maxDistance)
+            if 0 < editDistance <= maxDistance:
+                spellingMatches.append((editDistance, candidateTerm))
+        spellingMatches.sort()
+        return spellingMatches
+
+    # Multi-word terms containing every word of queriedTerm, shortest first
+    def partialMatches(self, queriedTerm):
+        queriedWords = set(_WORD_SEPARATOR.split(queriedTerm)) - {''}
+        if not queriedWords:
+            return []
+        wordPostings = sorted((self.termsByWord.get(queriedWord, ()) for queriedWord in queriedWords), key=len)
+        matchingNumbers = set(wordPostings[0])
+        for wordPosting in wordPostings[1:]:
+            matchingNumbers.intersection_update(wordPosting)
+        partialMatches = [self.terms[termNumber] for termNumber in matchingNumbers
+                          if self.terms[termNumber] != queriedTerm]
+        partialMatches.sort(key=lambda partialMatch: (len(partialMatch), partialMatch))
+        return partialMatches
+
+
+# Suggests replacements for the names and labels behind a lexical gap in one scene graph.  Built from a
+# SceneGraphIndex by SceneGraphIndex.getGapResolver, the first time a query runs into a lexical gap.
+class LexicalGapResolver:
+    def __init__(self, synonymTable=None):
+        self.synonymTable = buildSynonymTable(CONST_DEFAULT_SYNONYM_GROUPS) if synonymTable is None else synonymTable
+        self.nodeNames = TermIndex()
+        self.edgeLabels = TermIndex()
+
+    @classmethod
+    def fromIndex(cls, sceneGraphIndex, synonymTable=None):
+        gapResolver = cls(synonymTable)
+        for baseName in sceneGraphIndex.nodesByBaseName:
+            gapResolver.nodeNames.addTerm(baseName)
+        for edgeLabel in sceneGraphIndex.labelEdgeCounts:
+            gapResolver.edgeLabels.addTerm(edgeLabel)
+        return gapResolver
+
+    # Node base names that may be what a queried object (or "<attribute>_attr" name) not in the graph was meant to be
+    def suggestNodeNames(self, queriedName: str):
+        return self._suggest(queriedName, self.nodeNames)
+
+    # Edge labels that may be what a queried relation not in the graph was meant to be
+    def suggestEdgeLabels(self, queriedLabel: str):
+        return self._suggest(queriedLabel, self.edgeLabels)
+
+    def _suggest(self, queriedTerm, termIndex):
+        gapSuggestions = {}
+
+        def addSuggestion(suggestedTerm, suggestionReason, editDistance):
+            if len(gapSuggestions) < CONST_MAX_SUGGESTIONS and suggestedTerm not in gapSuggestions:
+                gapSuggestions[suggestedTerm] = GapSuggestion(queriedTerm, suggestedTerm, suggestionReason,
+                                                              editDistance)
+
+        # Attribute nodes are named "<attribute>_attr", so synonyms are looked up on the attribute name itself
+        lookupTerm = stripOffUnderscoreAttr(queriedTerm)
+        termSuffix = queriedTerm[len(lookupTerm):]
+        for synonymTerm in sorted(self.synonymTable.get(lookupTerm, ())):
+            if synonymTerm + termSuffix in termIndex:
+                addSuggestion(synonymTerm + termSuffix, CONST_SUGGESTION_SYNONYM, 0)
+        # The "_attr" suffix does not count towards the slack given to short words
+        for editDistance, spellingMatch in termIndex.spellingMatches(queriedTerm, _maxEditDistance(lookupTerm)):
+            addSuggestion(spellingMatch, CONST_SUGGESTION_SPELLING, editDistance)
+        for partialMatch in termIndex.partialMatches(queriedTerm):
+            addSuggestion(partialMatch, CONST_SUGGESTION_PARTIAL, None)
+        return tuple(gapSuggestions.values())
@@ -0,0 +1,162 @@
+from typing import NamedTuple
+from QueryParsing import QueryVariable
+from SceneGraphIndex import CONST_HAS_ATTRIBUTE_EDGE
+import QueryInstrumentation
+
+# Evaluates conjunctive relation patterns such as
+#     relation(to the left of,?x,?y) & relation(on,?y,bat)
+# against a SceneGraphIndex.  Each pattern is a (source, label, target) edge, laid out like the edge triples the handlers
+# return, where every slot is either a fixed name or a QueryVariable.  Patterns are joined one at a time: at each step
+# the pattern expected to match the fewest edges, given the variables bound so far, is evaluated next, and its edges are
+# found through the index (by source or target node, or through the label-partitioned adjacency) rather than by
+# scanning the graph.  Fixed node names match by base name, the same way the other handlers match them.  A variable in
+# the label slot stands for a relation, so it never matches has_attribute edges; those are only matched by attribute
+# parts (and by has_attribute written out as the label).
+
+
+class RelationPattern(NamedTuple):
+    source: object
+    label: object
+    target: object
+
+
+# Marks a slot that is not fixed by a name or a bound variable
+_UNBOUND = object()
+
+
+# One partial answer: the value of every variable bound so far and the edges that were used to bind them
+class _PatternMatch(NamedTuple):
+    bindings: dict
+    edgeTriples: tuple
+
+
+# Find every way of binding the variables so that all patterns hold.  Returns a list of (bindings, edge triples) pairs,
+# one per complete match, where bindings maps each variable to a node name (or a label for variables in the label slot).
+# While instrumentation is on, the partial matches expanded and the edges examined are recorded as the nodes and edges
+# the matcher touched.
+def matchRelationPatterns(relationPatterns, sceneGraphIndex):
+    partialMatches = [_PatternMatch({}, ())]
+    remainingPatterns = list(relationPatterns)
+    expandedMatchCount = 0
+    examinedEdgeCount = 0
+    while remainingPatterns and partialMatches:
+        boundVariables = partialMatches[0].bindings.keys()
+        nextPattern = min(remainingPatterns, key=lambda relationPattern: _estimateMatchCount(
+            relationPattern, boundVariables, len(partialMatches), sceneGraphIndex))
+        remainingPatterns.remove(nextPattern)
+        extendedMatches = []
+        expandedMatchCount += len(partialMatches)
+        for partialMatch in partialMatches:
+            for edgeTriple in _matchPattern(nextPattern, partialMatch.bindings, sceneGraphIndex):
+                examinedEdgeCount += 1
+                extendedBindings = _bindPattern(nextPattern, edgeTriple, partialMatch.bindings)
+                if extendedBindings is not None:
+                    extendedMatches.append(_PatternMatch(extendedBindings, partialMatch.edgeTriples + (edgeTriple,)))
+        partialMatches = extendedMatches
+    if QueryInstrumentation.activeRecorder is not None:
+        QueryInstrumentation.activeRecorder.recordWork('matchRelationPatterns', expandedMatchCount, examinedEdgeCount)
+    return partialMatches
+
+
+# Rough number of edges the pattern will produce per partial match.  A fixed or already bound node slot narrows the
+# search to that node's edges, a fixed label to the edges carrying that label; the narrowest available route wins.
+def _estimateMatchCount(relationPattern, boundVariables, matchCount, sceneGraphIndex):
+    # A label variable counts as free here even once bound, since its value differs from one partial match to the next
+    edgeLabel = relationPattern.label
+    if isinstance(edgeLabel, QueryVariable):
+        edgeCount = sceneGraphIndex.edgeCount - sceneGraphIndex.labelEdgeCounts.get(CONST_HAS_ATTRIBUTE_EDGE, 0)
+        connectedNodeCount = max(1, len(sceneGraphIndex))
+    else:
+        edgeCount = sceneGraphIndex.labelEdgeCounts.get(edgeLabel, 0)
+        connectedNodeCount = max(1, len(sceneGraphIndex.successorsByLabel.get(edgeLabel, ())))
+    averageDegree = edgeCount / connectedNodeCount
+    estimates = [edgeCount]
+    for nodeTerm in (relationPattern.source, relationPattern.target):
+        if isinstance(nodeTerm, QueryVariable):
+            if nodeTerm in boundVariables:
+                # One node per partial match; spread over all the matches, it is still a single node each
+                estimates.append(averageDegree)
+        else:
+            estimates.append(len(sceneGraphIndex.nodesWithBaseName(nodeTerm)) * averageDegree)
+    # A pattern sharing no variable with what has been bound so far multiplies every partial match
+    sharesVariable = any(isinstance(term, QueryVariable) and term in boundVariables for term in relationPattern)
+    return min(estimates) * (1 if sharesVariable else matchCount)
+
+
+# The value a slot is fixed to (a name, or the value a bound variable was given), or _UNBOUND
+def _fixedValue(patternTerm, bindings):
+    if isinstance(patternTerm, QueryVariable):
+        if patternTerm in bindings:
+            return bindings[patternTerm]
+        return _UNBOUND
+    return patternTerm
+
+
+# The nodes a node slot is restricted to, or None if it is free
+def _candidateNodes(patternTerm, bindings, sceneGraphIndex):
+    if isinstance(patternTerm, QueryVariable):
+        if patternTerm in bindings:
+            return (bindings[patternTerm],)
+        return None
+    return sceneGraphIndex.nodesWithBaseName(patternTerm)
+
+
+# All edges matching one pattern under the current bindings, leaving out attribute edges for a free label variable
+def _matchPattern(relationPattern, bindings, sceneGraphIndex):
+    edgeTriples = _patternEdges(relationPattern, bindings, sceneGraphIndex)
+    if _fixedValue(relationPattern.label, bindings) is _UNBOUND:
+        return (edgeTriple for edgeTriple in edgeTriples if edgeTriple[1] != CONST_HAS_ATTRIBUTE_EDGE)
+    return edgeTriples
+
+
+# All edges matching the slots of one pattern, found from the most restricted end of the pattern
+def _patternEdges(relationPattern, bindings, sceneGraphIndex):
+    edgeLabel = _fixedValue(relationPattern.label, bindings)
+    sourceNodes = _candidateNodes(relationPattern.source, bindings, sceneGraphIndex)
+    targetNodes = _candidateNodes(relationPattern.target, bindings, sceneGraphIndex)
+
+    if sourceNodes is not None and (targetNodes is None or len(sourceNodes) <= len(targetNodes)):
+        targetFilter = None if targetNodes is None else set(targetNodes)
+        for source in sourceNodes:
+            for target, edgeLabels in _neighboursOf(sceneGraphIndex.successors, sceneGraphIndex.successorsByLabel,
+                                                    source, edgeLabel):
+                if targetFilter is None or target in targetFilter:
+                    for matchedLabel in edgeLabels:
+                        yield source, matchedLabel, target
+    elif targetNodes is not None:
+        sourceFilter = None if sourceNodes is None else set(sourceNodes)
+        for target in targetNodes:
+            for source, edgeLabels in _neighboursOf(sceneGraphIndex.predecessors, sceneGraphIndex.predecessorsByLabel,
+                                                    target, edgeLabel):
+                if sourceFilter is None or source in sourceFilter:
+                    for matchedLabel in edgeLabels:
+                        yield source, matchedLabel, target
+    elif edgeLabel is not _UNBOUND:
+        for source, edgeTargets in sceneGraphIndex.successorsByLabel.get(edgeLabel, {}).items():
+            for target in edgeTargets:
+                yield source, edgeLabel, target
+    else:
+        # Nothing fixed at all, e.g. relation(?,?,?): every edge matches
+        for source, nodeSuccessors in sceneGraphIndex.successors.items():
+            for target, edgeLabels in nodeSuccessors.items():
+                for matchedLabel in edgeLabels:
+                    yield source, matchedLabel, target
+
+
+# Neighbours of a node as (neighbour, [labels]) pairs, restricted to one label through the label-partitioned adjacency
+# when the label is fixed
+def _neighboursOf(adjacency, adjacencyByLabel, currentNode, edgeLabel):
+    if edgeLabel is _UNBOUND:
+        return adjacency.get(currentNode, {}).items()
+    return ((neighbour, (edgeLabel,)) for neighbour in adjacencyByLabel.get(edgeLabel, {}).get(currentNode, ()))
+
+
+# Extend the bindings with the variables of a matched pattern, or None if the edge contradicts a variable already bound
+# (including the same variable appearing twice in one pattern)
+def _bindPattern(relationPattern, edgeTriple, bindings):
+    extendedBindings = dict(bindings)
+    for patternTerm, matchedValue in zip(relationPattern, edgeTriple):
+        if isinstance(patternTerm, QueryVariable):
+            if extendedBindings.setdefault(patternTerm, matchedValue) != matchedValue:
+                return None
+    return extendedBindings
@@ -0,0 +1,410 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import networkx
+from QuestionHandling import *
+from LexicalGapResolution import LexicalGapResolver
+from SceneGraphCache import writeCompiledSceneGraph, readCompiledSceneGraph, compiledToIndex
+from SceneGraphProcessing import contextGapCheck
+from StreamingGraphLoader import streamSceneGraphIndex
+from BatchQueryProcessing import findSceneGraphFiles
+
+# Performance harness for the query handlers and graph loading.  For each scene graph it times
+#   - loading: networkx.read_graphml, building the SceneGraphIndex, streaming the GraphML straight into the index, and
+#     reading the compiled cache
+#   - contextGapCheck
+#   - every handler in QuestionHandling.py, called directly with a prebuilt index and output turned off, plus
+#     answerQuery end to end (parse and dispatch included)
+#   - batches of attribute(A,X) checks through attributeCheckQueries, against the same checks one attributeQueryHandler
+#     call at a time.  Before timing, every answer of the batch path is checked against the single-query path.
+#   - lexical gap suggestions: building the gap resolver, and existence queries naming a misspelled object or relation
+#   - the query result cache: answerQueryPlan without the cache, on a cache miss and on a cache hit
+# and reports throughput and per-call latency percentiles.  Handler arguments are drawn from the graph itself (names,
+# edges and attribute edges picked at random with a fixed seed), so every call is a query the graph can answer.
+#
+# Besides the bundled graphs, synthetic scene graphs of any size are generated with the same schema: "obj" and "attr"
+# nodes named like the real ones (bat, bat_2, red_attr), relation edges between objects and has_attribute edges from
+# objects to attributes, with a few isolated objects so contextGapCheck has something to find.
+#
+# Results are written as JSON so runs can be kept and compared over time.
+#
+# Usage: python QueryBenchmarks.py -o benchmarks.json
+#        python QueryBenchmarks.py --sizes 10000 100000 1000000 --calls 5000
+
+CONST_DEFAULT_GRAPHS = ('2377804_with_attributes.graphml', 'scene_graph_graphmls/')
+CONST_DEFAULT_SIZES = (10000, 100000)
+CONST_DEFAULT_CALLS = 1000
+CONST_DEFAULT_LOAD_REPEATS = 3
+CONST_DEFAULT_SEED = 2020
+# attribute(A,X) checks per attributeCheckQueries call
+CONST_ATTRIBUTE_BATCH_SIZE = 1000
+# Most queries timed per gap suggestion benchmark (suggestions are slow on the synthetic graphs, whose generated names
+# all share the same first few characters)
+CONST_MAX_GAP_CALLS = 200
+# Latency percentiles reported for every benchmark
+CONST_PERCENTILES = (50, 90, 99)
+
+# Shape of the synthetic scene graphs, roughly following the bundled ones
+_SYNTHETIC_RELATIONS = ('to the left of', 'to the right of', 'on', 'in', 'wearing', 'holding', 'behind', 'near',
+                        'has', 'talking to')
+_SYNTHETIC_ATTRIBUTES = ('red', 'blue', 'green', 'white', 'black', 'gray', 'orange', 'pink', 'brick', 'wooden',
+                         'tall', 'small', 'open', 'striped', 'metal', 'shiny')
+_SYNTHETIC_ATTRIBUTE_SHARE = 0.25
+_SYNTHETIC_RELATIONS_PER_OBJECT = 2
+_SYNTHETIC_ISOLATED_SHARE = 0.01
+# Average number of copies of each object name (bat, bat_1, bat_2, ...)
+_SYNTHETIC_COPIES_PER_NAME = 3
+
+
+# Summary statistics for a list of per-call latencies in nanoseconds
+def _latencySummary(latencies):
+    sortedLatencies = sorted(latencies)
+    totalSeconds = sum(sortedLatencies) / 1e9
+    latencySummary = {'calls': len(sortedLatencies), 'totalSeconds': totalSeconds,
+                      'callsPerSecond': len(sortedLatencies) / totalSeconds if totalSeconds else None,
+                      'meanMicroseconds': sum(sortedLatencies) / len(sortedLatencies) / 1e3}
+    for percentile in CONST_PERCENTILES:
+        # Nearest-rank percentile
+        rank = max(0, -(-percentile * len(sortedLatencies) // 100) - 1)
+        latencySummary['p' + str(percentile) + 'Microseconds'] = sortedLatencies[rank] / 1e3
+    latencySummary['maxMicroseconds'] = sortedLatencies[-1] / 1e3
+    return latencySummary
+
+
+# Call benchmarkFunction callCount times, cycling through the argument tuples, and summarize the latencies
+def timeCalls(benchmarkFunction, argumentList, callCount):
+    latencies = []
+    clock = time.perf_counter_ns
+    for callNumber in range(callCount):
+        callArguments = argumentList[callNumber % len(argumentList)]
+        startTime = clock()
+        benchmarkFunction(*callArguments)
+        latencies.append(clock() - startTime)
+    return _latencySummary(latencies)
+
+
+# Build a synthetic scene graph with about nodeCount nodes, in the same form networkx.read_graphml returns
+def generateSceneGraph(nodeCount: int, seed=CONST_DEFAULT_SEED):
+    randomGenerator = random.Random(seed)
+    sceneGraph = networkx.DiGraph()
+    attributeCount = max(1, int(nodeCount * _SYNTHETIC_ATTRIBUTE_SHARE))
+    objectCount = max(1, nodeCount - attributeCount)
+
+    # Objects: names drawn from a vocabulary sized so each name has a few numbered copies, as in the real graphs
+    nameCount = max(1, objectCount // _SYNTHETIC_COPIES_PER_NAME)
+    copiesByName = {}
+    objectNodes = []
+    for objectNumber in range(objectCount):
+        baseName = 'object' + str(randomGenerator.randrange(nameCount))
+        copyNumber = copiesByName.get(baseName, 0)
+        copiesByName[baseName] = copyNumber + 1
+        objectNode = baseName if copyNumber == 0 else baseName + '_' + str(copyNumber)
+        sceneGraph.add_node(objectNode, id=objectNode, type='obj')
+        objectNodes.append(objectNode)
+
+    # Attributes: the usual adjectives first, then numbered ones once those run out
+    attributeNodes = []
+    for attributeNumber in range(attributeCount):
+        if attributeNumber < len(_SYNTHETIC_ATTRIBUTES):
+            attributeNode = _SYNTHETIC_ATTRIBUTES[attributeNumber] + '_attr'
+        else:
+            attributeNode = 'attribute' + str(attributeNumber) + '_attr'
+        sceneGraph.add_node(attributeNode, id=attributeNode, type='attr')
+        attributeNodes.append(attributeNode)
+
+    isolatedCount = int(objectCount * _SYNTHETIC_ISOLATED_SHARE)
+    connectedObjects = objectNodes[isolatedCount:]
+    for objectNode in connectedObjects:
+        for relationNumber in range(_SYNTHETIC_RELATIONS_PER_OBJECT):
+            targetNode = randomGenerator.choice(connectedObjects)
+            if targetNode != objectNode:
+                sceneGraph.add_edge(objectNode, targetNode, id='0',
+                                    label=randomGenerator.choice(_SYNTHETIC_RELATIONS))
+    # Every attribute is applied to at least one object, so none of them is a context gap
+    for attributeNode in attributeNodes:
+        sceneGraph.add_edge(randomGenerator.choice(connectedObjects), attributeNode, id='0',
+                            label=CONST_HAS_ATTRIBUTE_EDGE)
+    return sceneGraph
+
+
+# Arguments for each handler, drawn from what is actually in the graph
+def _handlerArguments(sceneGraphIndex: SceneGraphIndex, randomGenerator, sampleCount):
+    baseNames = [baseName for baseName, matchingNodes in sceneGraphIndex.nodesByBaseName.items()
+                 if sceneGraphIndex.nodeTypes[matchingNodes[0]] != CONST_ATTR_LABEL]
+    relationTriples = [triple for triple in sceneGraphIndex.triplesBySourceLabelTarget
+                       if triple[1] != CONST_HAS_ATTRIBUTE_EDGE]
+    attributePairs = [(stripOffUnderscoreAttr(targetName), sourceName) for sourceName, edgeLabel, targetName
+                      in sceneGraphIndex.triplesBySourceLabelTarget if edgeLabel == CONST_HAS_ATTRIBUTE_EDGE]
+
+    def sample(population):
+        return [randomGenerator.choice(population) for sampleNumber in range(sampleCount)] if population else []
+
+    sampledNames = sample(baseNames)
+    sampledTriples = sample(relationTriples)
+    sampledAttributes = sample(attributePairs)
+    handlerArguments = {
+        'itemExistenceQuery': [(QueryPlan(CONST_EXISTENCE_KEYWORD, (baseName,), (True,), 'itemExistenceQuery'),)
+                               for baseName in sampledNames],
+        'relationExistenceQuery': [(edgeLabel, sourceName, targetName)
+                                   for sourceName, edgeLabel, targetName in sampledTriples],
+        'findRelationOfItems': [(sourceName, targetName) for sourceName, edgeLabel, targetName in sampledTriples],
+        'findSourceOfRelation': [(edgeLabel, targetName) for sourceName, edgeLabel, targetName in sampledTriples],
+        'findTargetOfRelation': [(edgeLabel, sourceName) for sourceName, edgeLabel, targetName in sampledTriples],
+        'attributeCheckQuery': sampledAttributes,
+        'listAttributesOfObject': [(objectName,) for attributeName, objectName in sampledAttributes],
+        'listObjectsWithAttribute': [(attributeName,) for attributeName, objectName in sampledAttributes],
+        # Two hops: whatever has the sampled relation to something that has the sampled relation to the target
+        'relationPatternQuery': [(parseQuery(CONST_RELATION_KEYWORD + '(?,?x,?y) & ' + CONST_RELATION_KEYWORD + '(' +
+                                             edgeLabel + ',?y,' + targetName + ')').arguments,)
+                                 for sourceName, edgeLabel, targetName in sampledTriples],
+        'answerQuery': [(CONST_EXISTENCE_KEYWORD + '(' + baseName + ')',) for baseName in sampledNames] +
+                       [(CONST_RELATION_KEYWORD + '(?,' + sourceName + ',' + targetName + ')',)
+                        for sourceName, edgeLabel, targetName in sampledTriples] +
+                       [(CONST_ATTRIBUTE_KEYWORD + '(?,' + objectName + ')',)
+                        for attributeName, objectName in sampledAttributes],
+    }
+    return handlerArguments
+
+
+# attribute(A,X) pairs for the batch benchmark: pairs the graph has and attributes paired with arbitrary objects (mostly
+# not found).  With withGaps set, a quarter of the pairs also name an attribute, an object or both that are not in the
+# graph (lexical gaps).
+def _attributeCheckPairs(sceneGraphIndex: SceneGraphIndex, randomGenerator, pairCount, withGaps=False):
+    attributePairs = [(stripOffUnderscoreAttr(targetName), sourceName) for sourceName, edgeLabel, targetName
+                      in sceneGraphIndex.triplesBySourceLabelTarget if edgeLabel == CONST_HAS_ATTRIBUTE_EDGE]
+    if not attributePairs:
+        return []
+    baseNames = list(sceneGraphIndex.nodesByBaseName)
+    checkPairs = []
+    for pairNumber in range(pairCount):
+        attributeName, objectName = randomGenerator.choice(attributePairs)
+        pairKind = pairNumber % 4
+        if pairKind == 1:
+            objectName = randomGenerator.choice(baseNames)
+        elif pairKind == 2:
+            attributeName = randomGenerator.choice(attributePairs)[0]
+        elif pairKind == 3 and withGaps:
+            gapKind = pairNumber % 12
+            if gapKind != 7:
+                attributeName += 'x'
+            if gapKind != 3:
+                objectName += 'x'
+        checkPairs.append((attributeName, objectName))
+    return checkPairs
+
+
+# Raise AssertionError if attributeCheckQueries answers any pair differently from attributeQueryHandler
+def checkAttributeBatch(sceneGraphIndex: SceneGraphIndex, checkPairs):
+    batchResults = attributeCheckQueries(checkPairs, sceneGraphIndex, False)
+    for checkPair, batchResult in zip(checkPairs, batchResults):
+        singleResult = attributeQueryHandler(QueryPlan(CONST_ATTRIBUTE_KEYWORD, checkPair, (True, True),
+                                                       'attributeCheckQuery'), sceneGraphIndex, False)
+        if batchResult != singleResult:
+            raise AssertionError('attributeCheckQueries and attributeQueryHandler disagree on attribute(' +
+                                 ','.join(checkPair) + '): ' + repr(batchResult) + ' != ' + repr(singleResult))
+
+
+# Time one batch of attribute(A,X) checks answered by attributeCheckQueries and the same checks answered one at a time,
+# after checking that both give the same answers (lexical gaps included).  Latencies are per batch.  The timed batch
+# has no lexical gaps, which both paths answer with the same gap suggestion code.
+def benchmarkAttributeBatch(sceneGraphIndex: SceneGraphIndex, callCount, seed=CONST_DEFAULT_SEED):
+    randomGenerator = random.Random(seed)
+    checkPairs = _attributeCheckPairs(sceneGraphIndex, randomGenerator, CONST_ATTRIBUTE_BATCH_SIZE, True)
+    if not checkPairs:
+        return {}
+    checkAttributeBatch(sceneGraphIndex, checkPairs)
+    checkPairs = _attributeCheckPairs(sceneGraphIndex, randomGenerator, CONST_ATTRIBUTE_BATCH_SIZE)
+    checkPlans = [QueryPlan(CONST_ATTRIBUTE_KEYWORD, checkPair, (True, True), 'attributeCheckQuery')
+                  for checkPair in checkPairs]
+    batchCount = max(3, callCount // len(checkPairs))
+    return {'batchSize': len(checkPairs),
+            'attributeCheckQueries': timeCalls(lambda: attributeCheckQueries(checkPairs, sceneGraphIndex, False),
+                                               [()], batchCount),
+            'attributeQueryHandler': timeCalls(lambda: [attributeQueryHandler(checkPlan, sceneGraphIndex, False)
+                                                        for checkPlan in checkPlans], [()], batchCount)}
+
+
+# A misspelling of term (two neighbouring characters swapped, or the last one dropped from short terms) that is not
+# itself in vocabulary, or None if every misspelling tried is
+def _misspell(term, vocabulary, randomGenerator):
+    if len(term) < 3:
+        return None
+    misspellings = [term[:-1]] if len(term) < 5 else []
+    for swapPosition in randomGenerator.sample(range(len(term) - 1), len(term) - 1):
+        misspellings.append(term[:swapPosition] + term[swapPosition + 1] + term[swapPosition] + term[swapPosition + 2:])
+    for misspelling in misspellings:
+        if misspelling != term and misspelling not in vocabulary:
+            return misspelling
+    return None
+
+
+# Time gap suggestions: building the resolver (done once per graph, on the first gap) and existence queries for
+# misspelled object names and relation labels, whose answers carry the suggestions
+def benchmarkGapSuggestions(sceneGraphIndex: SceneGraphIndex, callCount, seed=CONST_DEFAULT_SEED):
+    randomGenerator = random.Random(seed)
+    callCount = min(callCount, CONST_MAX_GAP_CALLS)
+    relationTriples = [triple for triple in sceneGraphIndex.triplesBySourceLabelTarget
+                       if triple[1] != CONST_HAS_ATTRIBUTE_EDGE]
+    if not relationTriples:
+        return {}
+    sampledTriples = [randomGenerator.choice(relationTriples) for sampleNumber in range(callCount)]
+    misspelledNames = [(_misspell(sourceName, sceneGraphIndex.nodesByBaseName, randomGenerator),)
+                       for sourceName, edgeLabel, targetName in sampledTriples]
+    misspelledNames = [(QueryPlan(CONST_EXISTENCE_KEYWORD, (misspelledName,), (True,), 'itemExistenceQuery'),)
+                       for misspelledName, in misspelledNames if misspelledName is not None]
+    misspelledLabels = [(_misspell(edgeLabel, sceneGraphIndex.labelEdgeCounts, randomGenerator), sourceName, targetName)
+                        for sourceName, edgeLabel, targetName in sampledTriples]
+    gapResults = {'resolverBuild': timeCalls(lambda: LexicalGapResolver.fromIndex(sceneGraphIndex), [()], 3)}
+    sceneGraphIndex.getGapResolver()
+    for handlerName, argumentList in (('itemExistenceQuery', misspelledNames),
+                                      ('relationExistenceQuery', misspelledLabels)):
+        argumentList = [callArguments for callArguments in argumentList if callArguments[0] is not None]
+        if argumentList:
+            handlerFunction = globals()[handlerName]
+            gapResults[handlerName] = timeCalls(
+                lambda *callArguments: handlerFunction(*callArguments, sceneGraphIndex, False), argumentList,
+                callCount)
+    return gapResults
+
+
+# Time answerQueryPlan without the result cache, then with it on a miss (the cache emptied before every query) and on
+# a hit (the query answered just before).  The cache is switched off again afterwards.
+def benchmarkResultCache(sceneGraphIndex: SceneGraphIndex, callCount, seed=CONST_DEFAULT_SEED):
+    randomGenerator = random.Random(seed)
+    handlerArguments = _handlerArguments(sceneGraphIndex, randomGenerator, min(callCount, 1000))
+    # The queries come grouped by kind; shuffled, so every kind is among the ones timed
+    queryPlans = [(parseQuery(userQuery),) for userQuery, in handlerArguments['answerQuery']]
+    randomGenerator.shuffle(queryPlans)
+    queryPlans = queryPlans[:callCount]
+    if not queryPlans:
+        return {}
+    cacheResults = {'uncached': timeCalls(lambda queryPlan: answerQueryPlan(queryPlan, sceneGraphIndex, False),
+                                          queryPlans, callCount)}
+    resultCache = sceneGraphIndex.enableResultCache()
+    try:
+        def answerAfterClearing(queryPlan):
+            resultCache.clear()
+            return answerQueryPlan(queryPlan, sceneGraphIndex, False)
+
+        cacheResults['miss'] = timeCalls(answerAfterClearing, queryPlans, callCount)
+        for queryPlan, in queryPlans:
+            answerQueryPlan(queryPlan, sceneGraphIndex, False)
+        cacheResults['hit'] = timeCalls(lambda queryPlan: answerQueryPlan(queryPlan, sceneGraphIndex, False),
+                                        queryPlans, callCount)
+        cacheResults['statistics'] = resultCache.statistics()
+    finally:
+        sceneGraphIndex.disableResultCache()
+    return cacheResults
+
+
+# Time every handler against a prebuilt index.  Handlers whose arguments cannot be drawn from this graph (e.g. the
+# attribute handlers on a graph without attributes) are skipped.
+def benchmarkHandlers(sceneGraphIndex: SceneGraphIndex, callCount, seed=CONST_DEFAULT_SEED):
+    randomGenerator = random.Random(seed)
+    handlerArguments = _handlerArguments(sceneGraphIndex, randomGenerator, min(callCount, 1000))
+    handlerResults = {}
+    for handlerName, argumentList in handlerArguments.items():
+        if not argumentList:
+            continue
+        handlerFunction = globals()[handlerName]
+        handlerResults[handlerName] = timeCalls(
+            lambda *callArguments: handlerFunction(*callArguments, sceneGraphIndex, False), argumentList, callCount)
+    return handlerResults
+
+
+# Time the ways of getting a queryable graph from a GraphML file, plus contextGapCheck
+def benchmarkLoading(graphmlFile: str, loadRepeats):
+    loadResults = {}
+    loadResults['read_graphml'] = timeCalls(networkx.read_graphml, [(graphmlFile,)], loadRepeats)
+    sceneGraph = networkx.read_graphml(graphmlFile)
+    loadResults['SceneGraphIndex.fromGraph'] = timeCalls(SceneGraphIndex.fromGraph, [(sceneGraph,)], loadRepeats)
+    loadResults['streamSceneGraphIndex'] = timeCalls(streamSceneGraphIndex, [(graphmlFile,)], loadRepeats)
+    with tempfile.TemporaryDirectory() as cacheDirectory:
+        cacheFile = os.path.join(cacheDirectory, os.path.basename(graphmlFile) + '.sgc')
+        writeCompiledSceneGraph(sceneGraph, cacheFile)
+        loadResults['compiledCacheToIndex'] = timeCalls(lambda: compiledToIndex(readCompiledSceneGraph(cacheFile)),
+                                                        [()], loadRepeats)
+    # contextGapCheck prints a warning per gap; the printing is part of what it does, so it is timed too, into devnull
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        loadResults['contextGapCheck'] = timeCalls(contextGapCheck, [(sceneGraph,)], loadRepeats)
+    return sceneGraph, loadResults
+
+
+# Benchmark one GraphML file: loading, then the handlers against the index built from it
+def benchmarkGraphFile(graphmlFile: str, callCount, loadRepeats, seed=CONST_DEFAULT_SEED, graphName=None):
+    sceneGraph, loadResults = benchmarkLoading(graphmlFile, loadRepeats)
+    sceneGraphIndex = SceneGraphIndex.fromGraph(sceneGraph)
+    return {'graph': graphName or graphmlFile, 'nodes': sceneGraph.number_of_nodes(),
+            'edges': sceneGraph.number_of_edges(), 'loading': loadResults,
+            'handlers': benchmarkHandlers(sceneGraphIndex, callCount, seed),
+            'attributeBatches': benchmarkAttributeBatch(sceneGraphIndex, callCount, seed),
+            'gapSuggestions': benchmarkGapSuggestions(sceneGraphIndex, callCount, seed),
+            'resultCache': benchmarkResultCache(sceneGraphIndex, callCount, seed)}
+
+
+# Generate a synthetic graph, round-trip it through GraphML so read_graphml is measured on it too, and benchmark it
+def benchmarkSyntheticGraph(nodeCount: int, callCount, loadRepeats, seed=CONST_DEFAULT_SEED):
+    sceneGraph = generateSceneGraph(nodeCount, seed)
+    with tempfile.TemporaryDirectory() as graphDirectory:
+        graphmlFile = os.path.join(graphDirectory, 'synthetic_' + str(nodeCount) + '.graphml')
+        networkx.write_graphml(sceneGraph, graphmlFile)
+        return benchmarkGraphFile(graphmlFile, callCount, loadRepeats, seed, 'synthetic:' + str(nodeCount))
+
+
+# Where and with what the benchmarks ran, so results from different machines or checkouts are not mixed up
+def _environmentInfo():
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+            'implementation': platform.python_implementation(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'networkx': networkx.__version__}
+
+
+def runBenchmarks(graphFiles, syntheticSizes, callCount=CONST_DEFAULT_CALLS, loadRepeats=CONST_DEFAULT_LOAD_REPEATS,
+                  seed=CONST_DEFAULT_SEED):
+    benchmarkReport = {'environment': _environmentInfo(),
+                       'settings': {'calls': callCount, 'loadRepeats': loadRepeats, 'seed': seed},
+                       'graphs': []}
+    for graphFile in graphFiles:
+        print("Benchmarking " + graphFile, file=sys.stderr)
+        benchmarkReport['graphs'].append(benchmarkGraphFile(graphFile, callCount, loadRepeats, seed))
+    for nodeCount in syntheticSizes:
+        print("Benchmarking synthetic graph with " + str(nodeCount) + " nodes", file=sys.stderr)
+        # The large graphs take a while to parse, so they are loaded once rather than loadRepeats times
+        benchmarkReport['graphs'].append(benchmarkSyntheticGraph(nodeCount, callCount, 1, seed))
+    return benchmarkReport
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Benchmark graph loading and the query handlers.')
+    argumentParser.add_argument('graphs', nargs='*', default=list(CONST_DEFAULT_GRAPHS),
+                                help='GraphML files or directories to benchmark (default: the bundled graphs)')
+    argumentParser.add_argument('--sizes', nargs='*', type=int, default=list(CONST_DEFAULT_SIZES),
+                                help='node counts of the synthetic graphs to benchmark (none to skip them)')
+    argumentParser.add_argument('--calls', type=int, default=CONST_DEFAULT_CALLS,
+                                help='number of timed calls per handler')
+    argumentParser.add_argument('--load-repeats', type=int, default=CONST_DEFAULT_LOAD_REPEATS,
+                                help='number of timed loads of each bundled graph')
+    argumentParser.add_argument('--seed', type=int, default=CONST_DEFAULT_SEED)
+    argumentParser.add_argument('-o', '--output', help='JSON file to write results to (default: stdout)')
+    arguments = argumentParser.parse_args()
+
+    graphFiles = []
+    for graphSource in arguments.graphs:
+        graphFiles.extend(findSceneGraphFiles(graphSource))
+    benchmarkReport = runBenchmarks(graphFiles, arguments.sizes, arguments.calls, arguments.load_repeats,
+                                    arguments.seed)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as outputStream:
+            json.dump(benchmarkReport, outputStream, indent=2)
+    else:
+        json.dump(benchmarkReport, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import bisect
+import heapq
+import json
+import threading
+import time
+
+# Instrumentation for the query path: graph loading, contextGapCheck, query parsing, dispatch and every query handler.
+# While a QueryRecorder is active it collects
+#   - a latency histogram per stage (seconds)
+#   - histograms of the work done by the stages that walk the graph: the nodes and edges loaded, the nodes checked for
+#     context gaps, and the partial matches the pattern matcher expanded and the edges it examined
+#   - histograms of the size of each handler's answer (its nodes and edge triples).  The handlers read their answer
+#     straight out of the index tables, so this is the output size, not a count of the index entries visited.
+#   - a count of query outcomes by handler and status (success, lexical_gap, target_gap, ...)
+#   - the slowest graph loads and queries seen, with the graph file or query they were for
+# Stage times are inclusive, so a dispatch stage such as relationQueryHandler includes the handler it routed to.
+#
+# Instrumentation is off unless enableInstrumentation is called.  Instrumented code checks activeRecorder first and does
+# nothing else while it is None, so leaving it off costs one global lookup per stage.
+#
+# Usage:
+#     queryRecorder = enableInstrumentation()
+#     ... load graphs, answer queries ...
+#     print(queryRecorder.toPrometheus())      # or json.dumps(queryRecorder.toDict())
+
+# Bucket upper bounds for the stage latency histograms, in seconds
+CONST_TIME_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                      0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bucket upper bounds for the node and edge count histograms
+CONST_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 1000000)
+CONST_SLOWEST_KEPT = 20
+CONST_METRIC_PREFIX = 'scenegraph_'
+
+# The recorder collecting measurements, or None while instrumentation is off
+activeRecorder = None
+clock = time.perf_counter
+
+
+# Start collecting into queryRecorder (a new QueryRecorder if none is given) and return it
+def enableInstrumentation(queryRecorder=None):
+    global activeRecorder
+    activeRecorder = QueryRecorder() if queryRecorder is None else queryRecorder
+    return activeRecorder
+
+
+# Stop collecting, returning the recorder that was active (None if there was none)
+def disableInstrumentation():
+    global activeRecorder
+    finishedRecorder, activeRecorder = activeRecorder, None
+    return finishedRecorder
+
+
+# Fixed-bucket histogram: counts of observations at or below each bound, plus the overflow, sum and maximum
+class Histogram:
+    def __init__(self, bucketBounds):
+        self.bucketBounds = bucketBounds
+        self.bucketCounts = [0] * (len(bucketBounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def observe(self, observedValue):
+        self.bucketCounts[bisect.bisect_left(self.bucketBounds, observedValue)] += 1
+        self.count += 1
+        self.total += observedValue
+        if observedValue > self.maximum:
+            self.maximum = observedValue
+
+    def merge(self, otherHistogram):
+        for bucketNumber, bucketCount in enumerate(otherHistogram.bucketCounts):
+            self.bucketCounts[bucketNumber] += bucketCount
+        self.count += otherHistogram.count
+        self.total += otherHistogram.total
+        self.maximum = max(self.maximum, otherHistogram.maximum)
+
+    # Smallest bucket bound with at least the given share of the observations at or below it (the maximum if it falls
+    # in the overflow bucket)
+    def quantile(self, quantileShare):
+        if not self.count:
+            return None
+        neededCount = quantileShare * self.count
+        runningCount = 0
+        for bucketBound, bucketCount in zip(self.bucketBounds, self.bucketCounts):
+            runningCount += bucketCount
+            if runningCount >= neededCount:
+                return bucketBound
+        return self.maximum
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.total, 'max': self.maximum,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': {str(bucketBound): bucketCount
+                            for bucketBound, bucketCount in zip(self.bucketBounds, self.bucketCounts)},
+                'overflow': self.bucketCounts[-1]}
+
+
+class QueryRecorder:
+    def __init__(self, slowestKept=CONST_SLOWEST_KEPT):
+        self.slowestKept = slowestKept
+        # Stage name -> Histogram of seconds spent in it
+        self.stageTimes = {}
+        # Stage name -> Histogram of the nodes / edges it touched
+        self.nodeCounts = {}
+        self.edgeCounts = {}
+        # Handler name -> Histogram of the nodes / edge triples in its answers
+        self.answerNodeCounts = {}
+        self.answerEdgeCounts = {}
+        # (handler name, status) -> number of queries
+        self.queryOutcomes = {}
+        # Min-heap of (seconds, stage, label) for the slowest graph loads and queries
+        self.slowestCalls = []
+        # Set by callers answering queries against one graph at a time, and attached to the slow queries recorded
+        self.currentGraph = None
+        # Stages can be recorded from graph loading threads (QueryServer) as well as the main thread
+        self.recordLock = threading.Lock()
+
+    # The lock cannot be pickled; BatchQueryProcessing sends recorders back from its worker processes
+    def __getstate__(self):
+        recorderState = dict(self.__dict__)
+        del recorderState['recordLock']
+        return recorderState
+
+    def __setstate__(self, recorderState):
+        self.__dict__.update(recorderState)
+        self.recordLock = threading.Lock()
+
+    # Time spent in one run of a stage.  label (a graph file or query) makes the call eligible for the slowest list.
+    def recordStage(self, stageName, elapsedSeconds, label=None):
+        with self.recordLock:
+            stageHistogram = self.stageTimes.get(stageName)
+            if stageHistogram is None:
+                stageHistogram = self.stageTimes[stageName] = Histogram(CONST_TIME_BUCKETS)
+            stageHistogram.observe(elapsedSeconds)
+            if label is not None:
+                if self.currentGraph is not None and stageName != 'load':
+                    label = label + ' on ' + self.currentGraph
+                slowCall = (elapsedSeconds, stageName, label)
+                if len(self.slowestCalls) < self.slowestKept:
+                    heapq.heappush(self.slowestCalls, slowCall)
+                elif slowCall > self.slowestCalls[0]:
+                    heapq.heapreplace(self.slowestCalls, slowCall)
+
+    # Nodes and edges one run of a stage touched (None for a count the stage does not measure)
+    def recordWork(self, stageName, nodeCount, edgeCount):
+        self._observeCounts(stageName, ((self.nodeCounts, nodeCount), (self.edgeCounts, edgeCount)))
+
+    # Nodes and edge triples in the answer of one run of a query handler
+    def recordAnswerSize(self, handlerName, nodeCount, edgeCount):
+        self._observeCounts(handlerName, ((self.answerNodeCounts, nodeCount), (self.answerEdgeCounts, edgeCount)))
+
+    def _observeCounts(self, stageName, countTables):
+        with self.recordLock:
+            for workCounts, workCount in countTables:
+                if workCount is None:
+                    continue
+                workHistogram = workCounts.get(stageName)
+                if workHistogram is None:
+                    workHistogram = workCounts[stageName] = Histogram(CONST_COUNT_BUCKETS)
+                workHistogram.observe(workCount)
+
+    # Outcome of one answered query
+    def recordOutcome(self, queryType, queryStatus):
+        with self.recordLock:
+            outcomeKey = (queryType, queryStatus)
+            self.queryOutcomes[outcomeKey] = self.queryOutcomes.get(outcomeKey, 0) + 1
+
+    # Add another recorder's measurements to this one
+    def merge(self, otherRecorder):
+        with self.recordLock:
+            for ownTable, otherTable in ((self.stageTimes, otherRecorder.stageTimes),
+                                         (self.nodeCounts, otherRecorder.nodeCounts),
+                                         (self.edgeCounts, otherRecorder.edgeCounts),
+                                         (self.answerNodeCounts, otherRecorder.answerNodeCounts),
+                                         (self.answerEdgeCounts, otherRecorder.answerEdgeCounts)):
+                for stageName, otherHistogram in otherTable.items():
+                    if stageName not in ownTable:
+                        ownTable[stageName] = Histogram(otherHistogram.bucketBounds)
+                    ownTable[stageName].merge(otherHistogram)
+            for outcomeKey, outcomeCount in otherRecorder.queryOutcomes.items():
+                self.queryOutcomes[outcomeKey] = self.queryOutcomes.get(outcomeKey, 0) + outcomeCount
+            self.slowestCalls = heapq.nlargest(self.slowestKept, self.slowestCalls + otherRecorder.slowestCalls)
+            heapq.heapify(self.slowestCalls)
+
+    def toDict(self):
+        with self.recordLock:
+            return {
+                'stageSeconds': {stageName: stageHistogram.toDict()
+                                 for stageName, stageHistogram in sorted(self.stageTimes.items())},
+                'nodeCounts': {stageName: workHistogram.toDict()
+                               for stageName, workHistogram in sorted(self.nodeCounts.items())},
+                'edgeCounts': {stageName: workHistogram.toDict()
+                               for stageName, workHistogram in sorted(self.edgeCounts.items())},
+                'answerNodeCounts': {handlerName: answerHistogram.toDict()
+                                     for handlerName, answerHistogram in sorted(self.answerNodeCounts.items())},
+                'answerEdgeCounts': {handlerName: answerHistogram.toDict()
+                                     for handlerName, answerHistogram in sorted(self.answerEdgeCounts.items())},
+                'queryOutcomes': [{'queryType': queryType, 'status': queryStatus, 'count': outcomeCount}
+                                  for (queryType, queryStatus), outcomeCount in sorted(self.queryOutcomes.items())],
+                'slowest': [{'seconds': elapsedSeconds, 'stage': stageName, 'label': label}
+                            for elapsedSeconds, stageName, label in sorted(self.slowestCalls, reverse=True)]}
+
+    def toJson(self):
+        return json.dumps(self.toDict(), indent=2)
+
+    # Prometheus text exposition format: one histogram family per measurement, labelled by stage, and a counter of
+    # query outcomes
+    def toPrometheus(self):
+        metricLines = []
+        with self.recordLock:
+            for metricName, metricHelp, metricTable in (
+                    ('stage_seconds', 'Time spent in each query stage', self.stageTimes),
+                    ('stage_nodes', 'Nodes touched by each run of a query stage', self.nodeCounts),
+                    ('stage_edges', 'Edges touched by each run of a query stage', self.edgeCounts),
+                    ('answer_nodes', 'Nodes in the answer of each run of a query handler', self.answerNodeCounts),
+                    ('answer_edges', 'Edge triples in the answer of each run of a query handler',
+                     self.answerEdgeCounts)):
+                metricName = CONST_METRIC_PREFIX + metricName
+                metricLines.append('# HELP ' + metricName + ' ' + metricHelp)
+                metricLines.append('# TYPE ' + metricName + ' histogram')
+                for stageName, stageHistogram in sorted(metricTable.items()):
+                    stageLabel = 'stage="' + _escapeLabel(stageName) + '"'
+                    runningCount = 0
+                    for bucketBound, bucketCount in zip(stageHistogram.bucketBounds, stageHistogram.bucketCounts):
+                        runningCount += bucketCount
+                        metricLines.append(metricName + '_bucket{' + stageLabel + ',le="' + repr(bucketBound) + '"} ' +
+                                           str(runningCount))
+                    metricLines.append(metricName + '_bucket{' + stageLabel + ',le="+Inf"} ' +
+                                       str(stageHistogram.count))
+                    metricLines.append(metricName + '_sum{' + stageLabel + '} ' + repr(stageHistogram.total))
+                    metricLines.append(metricName + '_count{' + stageLabel + '} ' + str(stageHistogram.count))
+            metricName = CONST_METRIC_PREFIX + 'query_outcomes_total'
+            metricLines.append('# HELP ' + metricName + ' Queries answered, by handler and outcome')
+            metricLines.append('# TYPE ' + metricName + ' counter')
+            for (queryType, queryStatus), outcomeCount in sorted(self.queryOutcomes.items()):
+                metricLines.append(metricName + '{handler="' + _escapeLabel(queryType) + '",status="' +
+                                   _escapeLabel(queryStatus) + '"} ' + str(outcomeCount))
+        return '\n'.join(metricLines) + '\n'
+
+    # Write the measurements to a file, as Prometheus text if the name ends in ".prom" and as JSON otherwise
+    def writeTo(self, metricsFile: str):
+        with open(metricsFile, 'w', encoding='utf-8') as metricsStream:
+            metricsStream.write(self.toPrometheus() if metricsFile.endswith('.prom') else self.toJson())
+
+
+def _escapeLabel(labelValue):
+    return str(labelValue).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
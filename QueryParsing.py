@@ -0,0 +1,237 @@
+import functools
+import re
+from typing import NamedTuple
+
+CONST_EXISTENCE_KEYWORD = 'exists'
+CONST_RELATION_KEYWORD = 'relation'
+CONST_ATTRIBUTE_KEYWORD = 'attribute'
+CONST_UNKNOWN_ARGUMENT = '?'
+# Number of parsed queries kept by parseQuery.  Plans are tiny, so this is sized for a full batch query set.
+CONST_PLAN_CACHE_SIZE = 4096
+# Lines that end a list of queries, as they end the interactive prompt
+CONST_QUIT_COMMANDS = ('q', 'exit', 'quit')
+
+# Tokenizer and parser for the query language: KEYWORD(argument,argument,...).  Arguments are taken verbatim apart from
+# surrounding whitespace, so multi-word labels such as "to the left of" need no quoting.  An argument that itself
+# contains a comma, a parenthesis or a double quote can be written in double quotes, with \" and \\ as escapes, e.g.
+#     relation("next to, touching",cup,plate)
+# A lone ? marks the slot the query asks about.
+#
+# Relation and attribute queries can also be written as patterns: a ? followed by a name (?x, ?thing) is a named
+# variable, and several queries joined with & must all hold with each variable standing for the same thing throughout.
+# "What is to the left of something that is on the bat" is
+#     relation(to the left of,?x,?y) & relation(on,?y,bat)
+# A query with two or three unknowns, such as relation(?,?,bat), is a single-pattern query of the same kind.  Names
+# containing & have to be quoted.
+
+# Number of arguments each keyword takes
+_QUERY_ARITIES = {CONST_EXISTENCE_KEYWORD: 1, CONST_RELATION_KEYWORD: 3, CONST_ATTRIBUTE_KEYWORD: 2}
+
+# Handler that answers each combination of bound (True) and '?' (False) slots.  Combinations missing here are answered
+# as patterns by CONST_PATTERN_HANDLER.
+_QUERY_HANDLERS = {
+    (CONST_EXISTENCE_KEYWORD, (True,)): 'itemExistenceQuery',
+    (CONST_RELATION_KEYWORD, (True, True, True)): 'relationExistenceQuery',
+    (CONST_RELATION_KEYWORD, (False, True, True)): 'findRelationOfItems',
+    (CONST_RELATION_KEYWORD, (True, False, True)): 'findSourceOfRelation',
+    (CONST_RELATION_KEYWORD, (True, True, False)): 'findTargetOfRelation',
+    (CONST_ATTRIBUTE_KEYWORD, (True, True)): 'attributeCheckQuery',
+    (CONST_ATTRIBUTE_KEYWORD, (False, True)): 'listAttributesOfObject',
+    (CONST_ATTRIBUTE_KEYWORD, (True, False)): 'listObjectsWithAttribute',
+}
+# Handler for every query that is not one of the single-unknown shapes above
+CONST_PATTERN_HANDLER = 'relationPatternQuery'
+
+_TOKEN_PATTERN = re.compile(r'''
+    (?P<quoted>"(?:[^"\\]|\\.)*")
+  | (?P<punctuation>[(),&])
+  | (?P<text>[^(),&"]+)
+''', re.VERBOSE)
+_ESCAPE_PATTERN = re.compile(r'\\(.)')
+_VARIABLE_PATTERN = re.compile(r'\?\w+')
+
+
+# Raised for a query that does not follow the KEYWORD(arguments) format.  position is the character offset in the
+# query where parsing stopped, for pointing the user at the problem.
+class QuerySyntaxError(ValueError):
+    def __init__(self, message, queryText, position):
+        super().__init__(message + " (at character " + str(position) + " of " + repr(queryText) + ")")
+        self.queryText = queryText
+        self.position = position
+
+
+# A parsed query: the keyword, its arguments (None in the '?' slots), which slots are bound, and the name of the
+# handler that answers this shape of query.  Plans only depend on the query text, so they are shared between graphs.
+# For pattern queries (handlerName CONST_PATTERN_HANDLER) arguments holds one QueryAtom per &-joined query and
+# boundSlots the bound slots of each atom in turn.
+class QueryPlan(NamedTuple):
+    keyword: str
+    arguments: tuple
+    boundSlots: tuple
+    handlerName: str
+
+
+# An unknown in a pattern query.  Each bare ? becomes its own anonymous variable, which is matched like a named one
+# but left out of the reported bindings.
+class QueryVariable(NamedTuple):
+    name: str
+    isAnonymous: bool = False
+
+    def __str__(self):
+        return CONST_UNKNOWN_ARGUMENT if self.isAnonymous else self.name
+
+
+# One keyword(arguments) part of a pattern query, each argument either a name or a QueryVariable
+class QueryAtom(NamedTuple):
+    keyword: str
+    arguments: tuple
+
+    def __str__(self):
+        return self.keyword + '(' + ','.join(str(queryArgument) for queryArgument in self.arguments) + ')'
+
+
+class _Token(NamedTuple):
+    kind: str
+    value: str
+    position: int
+
+
+# Split the query into quoted arguments, punctuation and bare text.  Whitespace-only text between tokens is dropped.
+def tokenizeQuery(queryText: str):
+    queryTokens = []
+    position = 0
+    while position < len(queryText):
+        tokenMatch = _TOKEN_PATTERN.match(queryText, position)
+        if tokenMatch is None:
+            raise QuerySyntaxError("Unterminated quoted argument", queryText, position)
+        tokenKind = tokenMatch.lastgroup
+        tokenValue = tokenMatch.group()
+        if tokenKind == 'quoted':
+            queryTokens.append(_Token(tokenKind, _ESCAPE_PATTERN.sub(r'\1', tokenValue[1:-1]), position))
+        elif tokenKind == 'text':
+            if tokenValue.strip():
+                queryTokens.append(_Token(tokenKind, tokenValue.strip(), position))
+        else:
+            queryTokens.append(_Token(tokenKind, tokenValue, position))
+        position = tokenMatch.end()
+    return queryTokens
+
+
+# Parse a query into a QueryPlan.  Results are memoized by query text, so a query repeated across a corpus (or typed
+# again at the prompt) is only ever parsed once.  Malformed queries raise QuerySyntaxError.
+@functools.lru_cache(maxsize=CONST_PLAN_CACHE_SIZE)
+def parseQuery(queryText: str):
+    queryTokens = tokenizeQuery(queryText)
+    if not queryTokens:
+        raise QuerySyntaxError("Empty query", queryText, 0)
+
+    # One or more keyword(arguments) atoms joined by &
+    parsedAtoms = []
+    tokenNumber = 0
+    while True:
+        keywordToken, argumentTokens, tokenNumber = _parseAtom(queryTokens, tokenNumber, queryText)
+        parsedAtoms.append((keywordToken, argumentTokens))
+        if tokenNumber >= len(queryTokens):
+            break
+        if queryTokens[tokenNumber][:2] != ('punctuation', '&'):
+            raise QuerySyntaxError("Unexpected text after the query", queryText, queryTokens[tokenNumber].position)
+        tokenNumber += 1
+        if tokenNumber >= len(queryTokens):
+            raise QuerySyntaxError("Expected another query after '&'", queryText, len(queryText))
+
+    # A lone query without named variables goes to its dedicated handler when there is one for its shape
+    if len(parsedAtoms) == 1:
+        keywordToken, argumentTokens = parsedAtoms[0]
+        if not any(_isNamedVariable(argumentToken) for argumentToken in argumentTokens):
+            boundSlots = tuple(not _isUnknown(argumentToken) for argumentToken in argumentTokens)
+            handlerName = _QUERY_HANDLERS.get((keywordToken.value, boundSlots))
+            if handlerName is not None:
+                queryArguments = tuple(argumentToken.value if bound else None
+                                       for argumentToken, bound in zip(argumentTokens, boundSlots))
+                return QueryPlan(keywordToken.value, queryArguments, boundSlots, handlerName)
+
+    # Everything else is a pattern over relation and attribute edges
+    queryAtoms = []
+    anonymousCount = 0
+    for keywordToken, argumentTokens in parsedAtoms:
+        if keywordToken.value == CONST_EXISTENCE_KEYWORD:
+            raise QuerySyntaxError(CONST_EXISTENCE_KEYWORD + " cannot take unknowns or be combined with other queries",
+                                   queryText, keywordToken.position)
+        atomArguments = []
+        for argumentToken in argumentTokens:
+            if _isNamedVariable(argumentToken):
+                atomArguments.append(QueryVariable(argumentToken.value))
+            elif _isUnknown(argumentToken):
+                anonymousCount += 1
+                atomArguments.append(QueryVariable(CONST_UNKNOWN_ARGUMENT + '#' + str(anonymousCount), True))
+            else:
+                atomArguments.append(argumentToken.value)
+        queryAtoms.append(QueryAtom(keywordToken.value, tuple(atomArguments)))
+    boundSlots = tuple(tuple(not isinstance(atomArgument, QueryVariable) for atomArgument in queryAtom.arguments)
+                       for queryAtom in queryAtoms)
+    return QueryPlan(CONST_RELATION_KEYWORD, tuple(queryAtoms), boundSlots, CONST_PATTERN_HANDLER)
+
+
+# Read queries one per line, skipping blank lines and lines starting with "#".  A line holding just q, exit or quit
+# ends the list, so input written for the interactive prompt can be piped in as it is.
+def readQueries(queryStream):
+    queries = []
+    for queryLine in queryStream:
+        queryLine = queryLine.strip()
+        if queryLine in CONST_QUIT_COMMANDS:
+            break
+        if queryLine and not queryLine.startswith('#'):
+            queries.append(queryLine)
+    return queries
+
+
+# Parse one keyword(argument,...) starting at tokenNumber.  Returns the keyword token, the argument tokens and the
+# number of the token following the closing parenthesis.
+def _parseAtom(queryTokens, tokenNumber, queryText):
+    keywordToken = queryTokens[tokenNumber]
+    if keywordToken.kind != 'text' or keywordToken.value not in _QUERY_ARITIES:
+        raise QuerySyntaxError("Unknown query type " + repr(keywordToken.value) + ", expected one of " +
+                               ", ".join(_QUERY_ARITIES), queryText, keywordToken.position)
+    _expectPunctuation(queryTokens, tokenNumber + 1, '(', queryText)
+
+    # Arguments alternate with commas until the closing parenthesis
+    argumentTokens = []
+    tokenNumber += 2
+    while True:
+        if tokenNumber >= len(queryTokens):
+            raise QuerySyntaxError("Missing closing parenthesis", queryText, len(queryText))
+        argumentToken = queryTokens[tokenNumber]
+        if argumentToken.kind == 'punctuation':
+            raise QuerySyntaxError("Missing argument", queryText, argumentToken.position)
+        argumentTokens.append(argumentToken)
+        tokenNumber += 1
+        if tokenNumber < len(queryTokens) and queryTokens[tokenNumber][:2] == ('punctuation', ','):
+            tokenNumber += 1
+            continue
+        _expectPunctuation(queryTokens, tokenNumber, ')', queryText)
+        tokenNumber += 1
+        break
+
+    queryArity = _QUERY_ARITIES[keywordToken.value]
+    if len(argumentTokens) != queryArity:
+        raise QuerySyntaxError(keywordToken.value + " takes " + str(queryArity) + " argument(s) but " +
+                               str(len(argumentTokens)) + " were given", queryText, keywordToken.position)
+    return keywordToken, argumentTokens, tokenNumber
+
+
+# A quoted "?" or "?x" is an ordinary name, only bare ones are unknowns
+def _isUnknown(argumentToken):
+    return argumentToken.kind == 'text' and argumentToken.value == CONST_UNKNOWN_ARGUMENT
+
+
+def _isNamedVariable(argumentToken):
+    return argumentToken.kind == 'text' and _VARIABLE_PATTERN.fullmatch(argumentToken.value) is not None
+
+
+def _expectPunctuation(queryTokens, tokenNumber, punctuation, queryText):
+    if tokenNumber >= len(queryTokens):
+        raise QuerySyntaxError("Expected " + repr(punctuation) + " but the query ended", queryText, len(queryText))
+    queryToken = queryTokens[tokenNumber]
+    if queryToken.kind != 'punctuation' or queryToken.value != punctuation:
+        raise QuerySyntaxError("Expected " + repr(punctuation) + " but found " + repr(queryToken.value), queryText,
+                               queryToken.position)
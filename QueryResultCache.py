@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from QueryParsing import CONST_EXISTENCE_KEYWORD, CONST_ATTRIBUTE_KEYWORD, CONST_PATTERN_HANDLER, QueryAtom
+from QueryResults import CONST_STATUS_LEXICAL_GAP
+from SceneGraphIndex import stripOffUnderscoreNumber, stripOffUnderscoreAttr, CONST_ATTRIBUTE_TYPE, \
+    CONST_HAS_ATTRIBUTE_EDGE
+
+# Memoized query results for one SceneGraphIndex (see SceneGraphIndex.enableResultCache).  Results are kept per query
+# plan, in a bounded LRU table, together with the parts of the graph they were computed from:
+#   ('name', base name)             the nodes with that base name and every edge touching them
+#   ('attribute', attribute name)   the same for the nodes with that name once "_attr" is stripped off
+#   ('label', label)                every edge carrying that label
+#   ('graph',)                      anything at all, for patterns with nothing fixed such as relation(?,?,?)
+#   ('vocabulary',)                 the set of base names and labels, which lexical gap suggestions are drawn from
+# The index reports every node and edge it adds or removes, and each report bumps a version counter for the parts it
+# touches.  A cached result is served only while all of the versions it was stored with are unchanged, so a change to
+# the graph invalidates just the results that depend on the names and labels involved, and repeated queries about the
+# rest of a slowly changing graph keep being answered from the cache.
+
+# Number of results kept per graph
+CONST_DEFAULT_CAPACITY = 4096
+
+_GRAPH_DEPENDENCY = ('graph',)
+_VOCABULARY_DEPENDENCY = ('vocabulary',)
+
+
+# The parts of the graph (as above) the answer to a query plan depends on.  Each keyword(arguments) part depends on
+# its fixed names and label; a part with none fixed depends on the whole graph, or on every attribute edge for
+# attribute(?,?).
+def queryDependencies(queryPlan):
+    if queryPlan.handlerName == CONST_PATTERN_HANDLER:
+        queryAtoms = queryPlan.arguments
+    else:
+        queryAtoms = (QueryAtom(queryPlan.keyword, queryPlan.arguments),)
+    queryDependencies = set()
+    for queryAtom in queryAtoms:
+        # The '?' slots are None in single queries and QueryVariables in patterns
+        fixedTerms = [queryArgument if isinstance(queryArgument, str) else None
+                      for queryArgument in queryAtom.arguments]
+        if queryAtom.keyword == CONST_EXISTENCE_KEYWORD:
+            atomDependencies = [('name', fixedTerms[0])]
+        elif queryAtom.keyword == CONST_ATTRIBUTE_KEYWORD:
+            queryAttribute, queryObject = fixedTerms
+            atomDependencies = [('name', queryObject)]
+            if queryAttribute is not None:
+                atomDependencies += [('attribute', queryAttribute),
+                                     ('name', queryAttribute + '_' + CONST_ATTRIBUTE_TYPE)]
+            elif queryObject is None:
+                atomDependencies = [('label', CONST_HAS_ATTRIBUTE_EDGE)]
+        else:
+            queryRelation, querySource, queryTarget = fixedTerms
+            atomDependencies = [('label', queryRelation), ('name', querySource), ('name', queryTarget)]
+        atomDependencies = [atomDependency for atomDependency in atomDependencies if atomDependency[1] is not None]
+        queryDependencies.update(atomDependencies or (_GRAPH_DEPENDENCY,))
+    return queryDependencies
+
+
+class QueryResultCache:
+    def __init__(self, capacity=CONST_DEFAULT_CAPACITY):
+        self.capacity = capacity
+        # Query plan -> (((dependency, version), ...), QueryResult), least recently used first
+        self.cachedResults = OrderedDict()
+        # Dependency -> number of changes to it so far (0 if never changed)
+        self.dependencyVersions = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.cachedResults)
+
+    # The cached result for a query plan, or None if there is none or the graph has changed under it
+    def lookup(self, queryPlan):
+        cachedEntry = self.cachedResults.get(queryPlan)
+        if cachedEntry is not None:
+            storedVersions, queryResult = cachedEntry
+            dependencyVersions = self.dependencyVersions
+            if all(dependencyVersions.get(queryDependency, 0) == storedVersion
+                   for queryDependency, storedVersion in storedVersions):
+                self.cachedResults.move_to_end(queryPlan)
+                self.hits += 1
+                return queryResult
+            del self.cachedResults[queryPlan]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    # Remember the result just computed for a query plan, against the current versions of what it depends on
+    def store(self, queryPlan, queryResult):
+        resultDependencies = queryDependencies(queryPlan)
+        if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+            resultDependencies.add(_VOCABULARY_DEPENDENCY)
+        self.cachedResults[queryPlan] = (tuple((queryDependency, self.dependencyVersions.get(queryDependency, 0))
+                                               for queryDependency in resultDependencies), queryResult)
+        self.cachedResults.move_to_end(queryPlan)
+        if len(self.cachedResults) > self.capacity:
+            self.cachedResults.popitem(last=False)
+
+    def clear(self):
+        self.cachedResults.clear()
+
+    # Called by the index when a node is added or removed or its type changes
+    def nodeChanged(self, nodeName):
+        self._bump(('name', stripOffUnderscoreNumber(nodeName)), ('attribute', stripOffUnderscoreAttr(nodeName)))
+
+    # Called by the index when an edge is added or removed
+    def edgeChanged(self, source, edgeLabel, target):
+        self._bump(('label', edgeLabel),
+                   ('name', stripOffUnderscoreNumber(source)), ('attribute', stripOffUnderscoreAttr(source)),
+                   ('name', stripOffUnderscoreNumber(target)), ('attribute', stripOffUnderscoreAttr(target)))
+
+    # Called by the index when a base name or label appears or goes away, or the synonym table is replaced
+    def vocabularyChanged(self):
+        self._bump(_VOCABULARY_DEPENDENCY)
+
+    def statistics(self):
+        return {'size': len(self.cachedResults), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'invalidations': self.invalidations}
+
+    def _bump(self, *changedDependencies):
+        dependencyVersions = self.dependencyVersions
+        for changedDependency in set(changedDependencies + (_GRAPH_DEPENDENCY,)):
+            dependencyVersions[changedDependency] = dependencyVersions.get(changedDependency, 0) + 1
@@ -0,0 +1,220 @@
+from typing import NamedTuple
+
+# Outcome of a query.  Gaps follow the terminology used throughout the project: a lexical gap means a queried name
+# does not appear in the graph, a target gap means more than one node matches so the answer is ambiguous, and a
+# context gap means the queried object exists but has no edges connected to it.  "Not found" is the plain negative
+# answer (e.g. the object exists but does not have the queried attribute), which is not treated as a gap.
+CONST_STATUS_SUCCESS = 'success'
+CONST_STATUS_LEXICAL_GAP = 'lexical_gap'
+CONST_STATUS_TARGET_GAP = 'target_gap'
+CONST_STATUS_CONTEXT_GAP = 'context_gap'
+CONST_STATUS_NOT_FOUND = 'not_found'
+
+
+# A name or label that may be what the user meant by a queried term that is not in the graph.  reason is how it was
+# found: 'synonym', 'spelling' (distance is then the edit distance) or 'partial' (see LexicalGapResolution.py).
+class GapSuggestion(NamedTuple):
+    queriedTerm: str
+    suggestedTerm: str
+    reason: str
+    distance: int = None
+
+
+# What a query handler returns.  queryType is the name of the handler that produced the result and queryArguments the
+# names it was asked about, which is all printQueryResult needs to rebuild the message shown to the user.  triples
+# holds the matching (source, label, target) edges and nodes the ids of the graph nodes the answer is about.  Pattern
+# queries with named variables also fill in bindings: one tuple of (variable, value) pairs per distinct match.  A
+# lexical gap comes with suggestions: GapSuggestions for the queried terms that are not in the graph.
+class QueryResult(NamedTuple):
+    queryType: str
+    queryArguments: tuple
+    status: str
+    triples: tuple = ()
+    nodes: tuple = ()
+    bindings: tuple = ()
+    suggestions: tuple = ()
+
+    @property
+    def isGap(self):
+        return self.status in (CONST_STATUS_LEXICAL_GAP, CONST_STATUS_TARGET_GAP, CONST_STATUS_CONTEXT_GAP)
+
+    # Plain-dict form for JSON output
+    def toDict(self):
+        return {'queryType': self.queryType, 'queryArguments': list(self.queryArguments), 'status': self.status,
+                'triples': [list(edgeTriple) for edgeTriple in self.triples], 'nodes': list(self.nodes),
+                'bindings': [dict(queryBinding) for queryBinding in self.bindings],
+                'suggestions': [gapSuggestion._asdict() for gapSuggestion in self.suggestions]}
+
+
+# Presentation layer: print a result the way the interactive prompt reports it.  Nothing is formatted until this is
+# called, so callers that only need the result (batch runs, other code) never pay for building the messages.
+def printQueryResult(queryResult: QueryResult):
+    _RESULT_PRINTERS[queryResult.queryType](queryResult)
+
+
+def _printItemExistence(queryResult):
+    queriedObject, = queryResult.queryArguments
+    for currentNode in queryResult.nodes:
+        print("Queried object found: " + currentNode)
+    # If nothing matching found, raise a lexical gap
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        print("WARNING: Lexical Gap identified - the object queried " + queriedObject +
+              " does not appear in the graph.")
+        _printSuggestions(queryResult)
+    # If multiple nodes found that match the queried term, raise a target gap
+    elif queryResult.status == CONST_STATUS_TARGET_GAP:
+        print("WARNING: Potential Target Gap identified.  Multiple nodes match the queried object.  The list of these "
+              "objects is as follows: " + str(list(queryResult.nodes)))
+    else:
+        print("SUCCESS! " + queriedObject + " exists in the graph!")
+
+
+def _printRelationOfItems(queryResult):
+    querySource, queryTarget = queryResult.queryArguments
+    if not queryResult.triples:
+        print("WARNING: There is no relation found in the graph between " + querySource + " and "
+              + queryTarget + ".")
+        _printContextGap(queryResult)
+    else:
+        print("SUCCESS: Relation(s) found between the requested nodes!  The list is as follow: "
+              + str(list(queryResult.triples)))
+
+
+def _printSourceOfRelation(queryResult):
+    queryRelation, queryTarget = queryResult.queryArguments
+    if not queryResult.triples:
+        print("WARNING: There is no source node found in the graph which has an edge of " + queryRelation +
+              " and a target of " + queryTarget + ".")
+        _printContextGap(queryResult)
+    else:
+        print("SUCCESS: Source(s) found with the requested relation and target!  The list is as follow: "
+              + str(list(queryResult.triples)))
+
+
+def _printTargetOfRelation(queryResult):
+    queryRelation, querySource = queryResult.queryArguments
+    if not queryResult.triples:
+        print("WARNING: There is no target node found in the graph which has an edge of " + queryRelation +
+              " and a source of " + querySource + ".")
+        _printContextGap(queryResult)
+    else:
+        print("SUCCESS: Target(s) found with the requested relation and source!  The list is as follow: "
+              + str(list(queryResult.triples)))
+
+
+def _printRelationExistence(queryResult):
+    queryRelation, querySource, queryTarget = queryResult.queryArguments
+    for source, edgeLabel, target in queryResult.triples:
+        print(source + " " + edgeLabel + " " + target)
+    # If nothing matching found, raise a lexical gap
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        print("WARNING: Lexical Gap identified - the relation queried " + querySource + " " + queryRelation + " "
+              + queryTarget + " does not appear in the graph.")
+        _printSuggestions(queryResult)
+    # If multiple nodes found that match the queried term, raise a target gap
+    elif queryResult.status == CONST_STATUS_TARGET_GAP:
+        print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
+              "The list of these relations is as follows: " + str(list(queryResult.triples)))
+
+
+def _printAttributeCheck(queryResult):
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        _printAttributeLexicalGap(queryResult)
+        return
+    queryAttribute, queryObject = queryResult.queryArguments
+    # If nothing matching found, inform user that the given attribute is not applied to the object
+    if queryResult.status == CONST_STATUS_NOT_FOUND:
+        print("The object " + queryObject + " does not have the attribute " + queryAttribute + " in the scene graph.")
+    # If multiple nodes found that match the queried term, raise a target gap
+    elif queryResult.status == CONST_STATUS_TARGET_GAP:
+        print("WARNING: Potential Target Gap identified.  Multiple objects named " + queryObject + " have the queried "
+              "attribute " + queryAttribute + ". The list of these objects is as follows: " +
+              str(list(queryResult.nodes)))
+    else:
+        print("SUCCESS! " + queryObject + " exists in the graph and has attribute " + queryAttribute + "!")
+
+
+def _printAttributesOfObject(queryResult):
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        _printAttributeLexicalGap(queryResult)
+        return
+    queryObject, = queryResult.queryArguments
+    if not queryResult.triples:
+        print("WARNING: There is no attribute found in the graph that is attached to the object  " + queryObject + ".")
+        _printContextGap(queryResult)
+    elif queryResult.status == CONST_STATUS_TARGET_GAP:
+        print("WARNING: Potential Target Gap identified.  Multiple objects match the queried object.\n" +
+              "The list of these objects and their attributes is as follows: " + str(list(queryResult.triples)))
+    else:
+        print("SUCCESS: The following attributes were found associated with the queried object!  The list is: "
+              + str(list(queryResult.triples)))
+
+
+def _printObjectsWithAttribute(queryResult):
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        _printAttributeLexicalGap(queryResult)
+        return
+    queryAttribute, = queryResult.queryArguments
+    if not queryResult.triples:
+        print("WARNING: There is no object found in the graph that is attached to the attribute "
+              + queryAttribute + ".")
+    elif queryResult.status == CONST_STATUS_TARGET_GAP:
+        print("WARNING: Potential Target Gap identified.  Multiple attributes match the queried attribute.\n" +
+              "The list of these attributes and the objects they affect is as follows: "
+              + str(list(queryResult.triples)))
+    else:
+        print("SUCCESS: The following objects were found associated with the queried attribute!  The list is: "
+              + str(list(queryResult.triples)))
+
+
+def _printRelationPattern(queryResult):
+    queryPattern = ' & '.join(queryResult.queryArguments)
+    if queryResult.status == CONST_STATUS_LEXICAL_GAP:
+        print("WARNING: Lexical Gap identified - the pattern " + queryPattern + " names an object or relation that "
+              "does not appear in the graph.")
+        _printSuggestions(queryResult)
+    elif not queryResult.triples:
+        print("WARNING: There is nothing in the graph matching the pattern " + queryPattern + ".")
+    elif queryResult.bindings:
+        print("SUCCESS: Match(es) found for the pattern!  The variable bindings are: "
+              + str([dict(queryBinding) for queryBinding in queryResult.bindings]) +
+              "\nThe edges involved are: " + str(list(queryResult.triples)))
+    else:
+        print("SUCCESS: Edge(s) found matching the pattern!  The list is as follow: " + str(list(queryResult.triples)))
+
+
+# An attribute query naming an object or attribute that is not in the graph.  Its arguments are the attribute and
+# object slots of the query, '?' included.
+def _printAttributeLexicalGap(queryResult):
+    print("WARNING: Lexical Gap identified - the object or attribute queried in attribute(" +
+          ",".join(queryResult.queryArguments) + ") does not appear in the graph.")
+    _printSuggestions(queryResult)
+
+
+# A query that came back empty because every node it was anchored on has no edges at all
+def _printContextGap(queryResult):
+    if queryResult.status == CONST_STATUS_CONTEXT_GAP:
+        print("WARNING: Potential context gap identified!  The queried node(s) " + str(list(queryResult.nodes)) +
+              " have no edges connected to them!")
+
+
+# Gap resolution for a lexical gap: what each missing term might have been meant to be
+def _printSuggestions(queryResult):
+    suggestionsByTerm = {}
+    for gapSuggestion in queryResult.suggestions:
+        suggestionsByTerm.setdefault(gapSuggestion.queriedTerm, []).append(gapSuggestion.suggestedTerm)
+    for queriedTerm, suggestedTerms in suggestionsByTerm.items():
+        print("SUGGESTION: " + queriedTerm + " is not in the graph.  Did you mean: " + ", ".join(suggestedTerms) + "?")
+
+
+_RESULT_PRINTERS = {
+    'itemExistenceQuery': _printItemExistence,
+    'findRelationOfItems': _printRelationOfItems,
+    'findSourceOfRelation': _printSourceOfRelation,
+    'findTargetOfRelation': _printTargetOfRelation,
+    'relationExistenceQuery': _printRelationExistence,
+    'attributeCheckQuery': _printAttributeCheck,
+    'listAttributesOfObject': _printAttributesOfObject,
+    'listObjectsWithAttribute': _printObjectsWithAttribute,
+    'relationPatternQuery': _printRelationPattern,
+}
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+from QuestionHandling import *
+import QueryInstrumentation
+from SceneGraphCache import loadSceneGraphIndex
+
+# Query service for running the gap detector behind another pipeline.  Clients connect over TCP or a Unix socket and
+# send one JSON request per line:
+#     {"id": 7, "graph": "2377804_with_attributes", "query": "relation(?,pants,bat)"}
+# and get one JSON line back per request, carrying the same id and the QueryResult fields (see QueryResults.toDict):
+#     {"id": 7, "graph": "2377804_with_attributes", "query": "relation(?,pants,bat)", "status": "success", ...}
+# or {"id": 7, "error": "..."} if the request could not be answered.  Requests on a connection are pipelined: a client
+# can send as many as it likes without waiting, each is answered as soon as its graph is available, and responses may
+# come back in a different order than the requests were sent (match them up by id).
+#
+# Graph ids are file names under the graph directory, with or without the ".graphml" extension.  Loaded graphs are kept
+# in a bounded pool shared by every connection, least recently used out first.  Loading a graph that is not in the pool
+# runs in a worker thread, so it never holds up clients whose graphs are already loaded, and concurrent requests for
+# the same cold graph wait on a single load.
+#
+# Started with --instrument, the server records stage timings (see QueryInstrumentation.py).  A request of the form
+# {"id": 8, "metrics": "json"} (or "prometheus") is answered with {"id": 8, "metrics": ...} holding what has been
+# recorded so far, as a JSON object or as Prometheus text.
+#
+# Each pooled graph keeps a cache of the results it has answered (see QueryResultCache.py), so a query repeated against
+# the same graph is answered without running its handler again.  --result-cache-size sets the results kept per graph.
+#
+# Usage: python QueryServer.py scene_graph_graphmls/ --port 8765
+#        python QueryServer.py scene_graph_graphmls/ --unix /tmp/scenegraphs.sock
+
+CONST_DEFAULT_HOST = '127.0.0.1'
+CONST_DEFAULT_PORT = 8765
+CONST_DEFAULT_POOL_SIZE = 256
+CONST_DEFAULT_LOAD_WORKERS = 4
+CONST_DEFAULT_RESULT_CACHE_SIZE = 256
+# Requests a single connection may have in flight before the server stops reading from it
+CONST_MAX_PIPELINED_REQUESTS = 1024
+# Longest request line accepted
+CONST_MAX_REQUEST_BYTES = 1 << 20
+_GRAPH_SUFFIX = '.graphml'
+
+
+# Bounded LRU pool of loaded scene graph indexes, keyed by GraphML path so every id naming the same file ("2328415",
+# "2328415.graphml", "./2328415") shares one load and one pool entry
+class SceneGraphPool:
+    def __init__(self, graphDirectory: str, capacity=CONST_DEFAULT_POOL_SIZE, loadExecutor=None, writeCache=True,
+                 resultCacheSize=CONST_DEFAULT_RESULT_CACHE_SIZE):
+        self.graphDirectory = os.path.realpath(graphDirectory)
+        self.capacity = capacity
+        self.loadExecutor = loadExecutor
+        self.writeCache = writeCache
+        # Query results cached per loaded graph (0 for none)
+        self.resultCacheSize = resultCacheSize
+        # GraphML path -> SceneGraphIndex, least recently used first
+        self.loadedGraphs = collections.OrderedDict()
+        # GraphML path -> future of a load that is under way, so concurrent requests share it
+        self.pendingLoads = {}
+
+    def __len__(self):
+        return len(self.loadedGraphs)
+
+    # The GraphML file for a graph id.  Ids are confined to the graph directory.
+    def graphFileFor(self, graphId: str):
+        graphFile = os.path.realpath(os.path.join(self.graphDirectory, graphId))
+        if not graphFile.endswith(_GRAPH_SUFFIX):
+            graphFile += _GRAPH_SUFFIX
+        if os.path.commonpath((graphFile, self.graphDirectory)) != self.graphDirectory:
+            raise ValueError('Graph id outside the graph directory: ' + graphId)
+        if not os.path.isfile(graphFile):
+            raise ValueError('No such scene graph: ' + graphId)
+        return graphFile
+
+    # The index for a graph id, loading it in the executor if it is not pooled yet
+    async def getIndex(self, graphId: str):
+        graphFile = self.graphFileFor(graphId)
+        sceneGraphIndex = self.loadedGraphs.get(graphFile)
+        if sceneGraphIndex is not None:
+            self.loadedGraphs.move_to_end(graphFile)
+            return sceneGraphIndex
+        pendingLoad = self.pendingLoads.get(graphFile)
+        if pendingLoad is None:
+            pendingLoad = asyncio.get_running_loop().run_in_executor(self.loadExecutor, loadSceneGraphIndex,
+                                                                     graphFile, self.writeCache)
+            self.pendingLoads[graphFile] = pendingLoad
+            pendingLoad.add_done_callback(lambda finishedLoad: self._finishLoad(graphFile, finishedLoad))
+        # shield, so a client disconnecting while it waits does not cancel the load for everyone else
+        return await asyncio.shield(pendingLoad)
+
+    # Pool a graph once its load completes, evicting the least recently used graphs beyond capacity.  Failed loads are
+    # not remembered, so the next request for the graph tries again.
+    def _finishLoad(self, graphFile, finishedLoad):
+        del self.pendingLoads[graphFile]
+        if finishedLoad.cancelled() or finishedLoad.exception() is not None:
+            return
+        sceneGraphIndex = self.loadedGraphs[graphFile] = finishedLoad.result()
+        if self.resultCacheSize > 0:
+            sceneGraphIndex.enableResultCache(self.resultCacheSize)
+        while len(self.loadedGraphs) > self.capacity:
+            self.loadedGraphs.popitem(last=False)
+
+
+class QueryServer:
+    def __init__(self, sceneGraphPool: SceneGraphPool, maxPipelinedRequests=CONST_MAX_PIPELINED_REQUESTS):
+        self.sceneGraphPool = sceneGraphPool
+        self.maxPipelinedRequests = maxPipelinedRequests
+
+    # Answer one request line, returning the response as a dict
+    async def answerRequest(self, requestLine: bytes):
+        try:
+            queryRequest = json.loads(requestLine)
+        except ValueError as decodeError:
+            return {'error': 'Request is not valid JSON: ' + str(decodeError)}
+        if not isinstance(queryRequest, dict):
+            return {'error': 'Request must be a JSON object'}
+        queryResponse = {'id': queryRequest.get('id')}
+        if 'metrics' in queryRequest:
+            return self.answerMetricsRequest(queryRequest['metrics'], queryResponse)
+        graphId = queryRequest.get('graph')
+        userQuery = queryRequest.get('query')
+        if not isinstance(graphId, str) or not isinstance(userQuery, str):
+            queryResponse['error'] = 'Request needs a "graph" and a "query" string'
+            return queryResponse
+        queryResponse.update({'graph': graphId, 'query': userQuery})
+        try:
+            # Parse before loading, so a malformed query does not pull a graph into the pool
+            queryPlan = parseUserQuery(userQuery)
+            sceneGraphIndex = await self.sceneGraphPool.getIndex(graphId)
+            # Answering is microseconds against a loaded index, so it runs right on the event loop
+            queryResponse.update(answerQueryPlan(queryPlan, sceneGraphIndex, False).toDict())
+        except (QuerySyntaxError, ValueError) as queryError:
+            queryResponse['error'] = str(queryError)
+        except Exception as queryError:
+            queryResponse['error'] = 'Could not answer query: ' + repr(queryError)
+        return queryResponse
+
+    # Dump the instrumentation recorded so far, in the requested format
+    def answerMetricsRequest(self, metricsFormat, queryResponse):
+        queryRecorder = QueryInstrumentation.activeRecorder
+        if queryRecorder is None:
+            queryResponse['error'] = 'Instrumentation is off; start the server with --instrument'
+        elif metricsFormat == 'json':
+            queryResponse['metrics'] = queryRecorder.toDict()
+        elif metricsFormat == 'prometheus':
+            queryResponse['metrics'] = queryRecorder.toPrometheus()
+        else:
+            queryResponse['error'] = 'Unknown metrics format, expected "json" or "prometheus"'
+        return queryResponse
+
+    # Serve one connection: read requests as they arrive and answer each in its own task
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pipelineSlots = asyncio.Semaphore(self.maxPipelinedRequests)
+        requestTasks = set()
+
+        async def answerAndReply(requestLine):
+            try:
+                queryResponse = await self.answerRequest(requestLine)
+                writer.write(json.dumps(queryResponse).encode('utf-8') + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                pipelineSlots.release()
+
+        try:
+            while True:
+                try:
+                    requestLine = await reader.readline()
+                except ValueError:
+                    # Line longer than the reader's limit
+                    writer.write(json.dumps({'error': 'Request line too long'}).encode('utf-8') + b'\n')
+                    break
+                if not requestLine:
+                    break
+                if not requestLine.strip():
+                    continue
+                await pipelineSlots.acquire()
+                requestTask = asyncio.create_task(answerAndReply(requestLine))
+                requestTasks.add(requestTask)
+                requestTask.add_done_callback(requestTasks.discard)
+            # Client finished sending; answer whatever is still in flight before closing
+            if requestTasks:
+                await asyncio.gather(*requestTasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for requestTask in requestTasks:
+                requestTask.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def startTcp(self, host=CONST_DEFAULT_HOST, port=CONST_DEFAULT_PORT):
+        return await asyncio.start_server(self.handleConnection, host, port, limit=CONST_MAX_REQUEST_BYTES)
+
+    async def startUnix(self, socketPath: str):
+        return await asyncio.start_unix_server(self.handleConnection, socketPath, limit=CONST_MAX_REQUEST_BYTES)
+
+
+async def serve(graphDirectory, host=CONST_DEFAULT_HOST, port=CONST_DEFAULT_PORT, socketPath=None,
+                poolSize=CONST_DEFAULT_POOL_SIZE, loadWorkers=CONST_DEFAULT_LOAD_WORKERS, writeCache=True,
+                resultCacheSize=CONST_DEFAULT_RESULT_CACHE_SIZE):
+    with concurrent.futures.ThreadPoolExecutor(loadWorkers) as loadExecutor:
+        queryServer = QueryServer(SceneGraphPool(graphDirectory, poolSize, loadExecutor, writeCache, resultCacheSize))
+        if socketPath is not None:
+            server = await queryServer.startUnix(socketPath)
+        else:
+            server = await queryServer.startTcp(host, port)
+        for serverSocket in server.sockets:
+            print("Serving scene graphs from " + graphDirectory + " on " + str(serverSocket.getsockname()))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Serve scene graph queries as line-delimited JSON.')
+    argumentParser.add_argument('graphs', help='directory holding the .graphml files clients can query')
+    argumentParser.add_argument('--host', default=CONST_DEFAULT_HOST)
+    argumentParser.add_argument('--port', type=int, default=CONST_DEFAULT_PORT)
+    argumentParser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of TCP')
+    argumentParser.add_argument('--pool-size', type=int, default=CONST_DEFAULT_POOL_SIZE,
+                                help='number of loaded graphs kept in memory')
+    argumentParser.add_argument('--load-workers', type=int, default=CONST_DEFAULT_LOAD_WORKERS,
+                                help='number of threads loading graphs')
+    argumentParser.add_argument('--result-cache-size', type=int, default=CONST_DEFAULT_RESULT_CACHE_SIZE,
+                                help='number of query results cached per loaded graph (0 to turn the cache off)')
+    argumentParser.add_argument('--no-write-cache', action='store_true',
+                                help='do not write compiled .sgc caches for graphs that have none')
+    argumentParser.add_argument('--instrument', action='store_true',
+                                help='record stage timings, served to {"metrics": "json"|"prometheus"} requests')
+    arguments = argumentParser.parse_args()
+    if not os.path.isdir(arguments.graphs):
+        argumentParser.error('not a directory: ' + arguments.graphs)
+    if arguments.instrument:
+        QueryInstrumentation.enableInstrumentation()
+    try:
+        asyncio.run(serve(arguments.graphs, arguments.host, arguments.port, arguments.unix, arguments.pool_size,
+                          arguments.load_workers, not arguments.no_write_cache, arguments.result_cache_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,331 +1,448 @@
-import re
-import networkx
+from SceneGraphIndex import SceneGraphIndex, getSceneGraphIndex, \
+    stripOffUnderscoreNumber, stripOffUnderscoreAttr
+from QueryResults import *
+from QueryParsing import *
+from PatternQueryHandling import RelationPattern, matchRelationPatterns
+import QueryInstrumentation
 
 CONST_TYPE_LABEL = 'type'
 CONST_ATTR_LABEL = 'attr'
 CONST_HAS_ATTRIBUTE_EDGE = 'has_attribute'
 
-# Handles queries asking about the existence of some item: exists(object).  Currently just scans the graph and detects
-# lexical gaps if the object is not found and target gaps if multiple copies of the object are found.
-# No gap resolution yet, just getting detection out the door for now.
-def itemExistenceQuery(queryContents: str, sceneGraph, outputResults = True):
-    # Set a flag for if the object queried was found in the node
-    objectFound = False
-    listOfMatchingNodes = []
-    # Get the target of the query
-    queriedObject = queryContents.split(')')[0]
-    # Again, not particularly efficient but hey.
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the target of the query, flag as such and set the flag to true
-        if nodeObjectName == queriedObject:
-            print("Queried object found: " + currentNode)
-            objectFound = True
-            # Also append the node to the list of matching nodes for target gap detection
-            listOfMatchingNodes.append(currentNode)
+# Every handler returns a QueryResult (see QueryResults.py).  With outputResults set, the handler also prints the
+# result for the user through printQueryResult; programmatic callers pass outputResults=False and skip the formatting.
+# While instrumentation is on (see QueryInstrumentation.py), parsing, dispatch and every handler called through
+# answerQuery/answerQueryPlan are timed and their outcomes counted.
+
+# Parse a query in the format KEYWORD(arguments) (see QueryParsing.py) and route it to the appropriate handler.
+# Shared by the interactive loop in SceneGraphProcessing and the batch runner so both accept exactly the same syntax.
+# Malformed queries raise QuerySyntaxError before any handler runs.
+def answerQuery(userQuery: str, sceneGraph, outputResults = True):
+    return answerQueryPlan(parseUserQuery(userQuery), sceneGraph, outputResults)
+
+
+# parseQuery, timed and with syntax errors counted while instrumentation is on
+def parseUserQuery(userQuery: str):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return parseQuery(userQuery)
+    startTime = QueryInstrumentation.clock()
+    try:
+        queryPlan = parseQuery(userQuery)
+    except QuerySyntaxError:
+        queryRecorder.recordOutcome('parseQuery', 'syntax_error')
+        raise
+    queryRecorder.recordStage('parse', QueryInstrumentation.clock() - startTime)
+    return queryPlan
+
+
+# Route an already parsed query to the appropriate handler
+def answerQueryPlan(queryPlan: QueryPlan, sceneGraph, outputResults = True):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return _cachedQueryPlan(queryPlan, sceneGraph, outputResults)
+    startTime = QueryInstrumentation.clock()
+    queryResult = _cachedQueryPlan(queryPlan, sceneGraph, outputResults)
+    if queryResult is not None:
+        # Filed under the handler the plan was routed to, whatever kind of result it came back with
+        queryRecorder.recordStage('answerQueryPlan', QueryInstrumentation.clock() - startTime,
+                                  queryPlan.handlerName + '(' + ','.join(queryResult.queryArguments) + ')')
+        queryRecorder.recordOutcome(queryPlan.handlerName, queryResult.status)
+    return queryResult
+
+
+# Serve the query from the index's result cache when it has one (see SceneGraphIndex.enableResultCache) and the answer
+# is still current, and otherwise answer it and cache the result
+def _cachedQueryPlan(queryPlan: QueryPlan, sceneGraph, outputResults):
+    resultCache = sceneGraph.resultCache if isinstance(sceneGraph, SceneGraphIndex) else None
+    if resultCache is None:
+        return _routeQueryPlan(queryPlan, sceneGraph, outputResults)
+    queryResult = resultCache.lookup(queryPlan)
+    if queryResult is not None:
+        return _finishQuery(queryResult, outputResults)
+    queryResult = _routeQueryPlan(queryPlan, sceneGraph, outputResults)
+    if queryResult is not None:
+        resultCache.store(queryPlan, queryResult)
+    return queryResult
+
+
+def _routeQueryPlan(queryPlan: QueryPlan, sceneGraph, outputResults):
+    # Handle the exists(object) case
+    if queryPlan.keyword == CONST_EXISTENCE_KEYWORD:
+        return _runHandler(itemExistenceQuery, queryPlan, sceneGraph, outputResults)
+    # Handle the relation(object1,object2) case
+    elif queryPlan.keyword == CONST_RELATION_KEYWORD:
+        return _runHandler(relationQueryHandler, queryPlan, sceneGraph, outputResults)
+    # Handle the attribute case
+    elif queryPlan.keyword == CONST_ATTRIBUTE_KEYWORD:
+        return _runHandler(attributeQueryHandler, queryPlan, sceneGraph, outputResults)
+
+
+# Handles queries asking about the existence of some item: exists(object).  Looks the object up by base name in the
+# index and detects lexical gaps if the object is not found and target gaps if multiple copies of the object are found.
+# A lexical gap comes with suggestions of names in the graph the object may have been meant as (see
+# LexicalGapResolution.py).  Like relationQueryHandler, also accepts the query contents as text (e.g. "bat)").
+def itemExistenceQuery(queryPlan, sceneGraph, outputResults = True):
+    if isinstance(queryPlan, str):
+        queryPlan = parseQuery(CONST_EXISTENCE_KEYWORD + '(' + queryPlan)
+    queryResult = _itemExistenceResult(queryPlan.arguments[0], getSceneGraphIndex(sceneGraph))
+    return _finishQuery(queryResult, outputResults)
+
+
+def _itemExistenceResult(queriedObject, sceneGraphIndex):
+    # Look up every node whose name, with the "_#" stripped off, matches the target of the query
+    listOfMatchingNodes = tuple(sceneGraphIndex.nodesWithBaseName(queriedObject))
+    gapSuggestions = ()
     # If nothing matching found, raise a lexical gap
-    if objectFound == False:
-        print("WARNING: Lexical Gap identified - the object queried " + queriedObject +
-              " does not appear in the graph.")
+    if len(listOfMatchingNodes) == 0:
+        queryStatus = CONST_STATUS_LEXICAL_GAP
+        gapSuggestions = _gapSuggestions(sceneGraphIndex, None, (queriedObject,))
     # If multiple nodes found that match the queried term, raise a target gap
-    if len(listOfMatchingNodes) > 1:
-        print("WARNING: Potential Target Gap identified.  Multiple nodes match the queried object.  The list of these "
-              "objects is as follows: " + str(listOfMatchingNodes))
-    if objectFound == True and len(listOfMatchingNodes) == 1 and outputResults == True:
-        print("SUCCESS! " + queriedObject + " exists in the graph!")
+    elif len(listOfMatchingNodes) > 1:
+        queryStatus = CONST_STATUS_TARGET_GAP
+    else:
+        queryStatus = CONST_STATUS_SUCCESS
 
-    # Return objectFound for attribute check
-    return objectFound
+    return QueryResult('itemExistenceQuery', (queriedObject,), queryStatus, nodes=listOfMatchingNodes,
+                       suggestions=gapSuggestions)
 
 
-# Parse out relation query and see if it's about the existence of a relation or if it's a query about what items
-# have a relation applied to them/what objects are on a relation with some object.
-def relationQueryHandler(queryContents: str, sceneGraph):
-    # Split out the query contents
-    queryElements = queryContents.split(',')
-    queryRelation = queryElements[0]
-    querySource = queryElements[1]
-    queryTarget = queryElements[2].split(')')[0]
+# Route a relation query to the handler its plan picked: an existence query if no slot is '?', a query about what
+# items have a relation applied to them/what objects are on a relation with some object, or a pattern query with
+# several unknowns or several &-joined parts.  Also accepts the contents of a relation query as text
+# (e.g. "?,pants,bat)"), which is parsed first.
+def relationQueryHandler(queryPlan, sceneGraph, outputResults = True):
+    if isinstance(queryPlan, str):
+        queryPlan = parseQuery(CONST_RELATION_KEYWORD + '(' + queryPlan)
+    sceneGraph = getSceneGraphIndex(sceneGraph)
+    if queryPlan.handlerName == CONST_PATTERN_HANDLER:
+        return _runHandler(relationPatternQuery, queryPlan.arguments, sceneGraph, outputResults)
+    queryRelation, querySource, queryTarget = queryPlan.arguments
 
     # If no question marks at any point in the query, it's a relation existence query.
-    if queryRelation != '?' and querySource != '?' and queryTarget != '?':
-        relationExistenceQuery(queryRelation, querySource, queryTarget, sceneGraph)
-    # If there are question marks in one of the query slots, then the user is asking for a report on what items/
+    if queryPlan.handlerName == 'relationExistenceQuery':
+        return _runHandler(relationExistenceQuery, queryRelation, querySource, queryTarget, sceneGraph, outputResults)
+    # If there is a question mark in one of the query slots, then the user is asking for a report on what items/
     # relations are associated with the provided items/relation
-    else:
-        # For now only allowing one unknown in the query.  Could expand this out to two question marks down the line
-        # TODO
-        if queryRelation == '?':
-            findRelationOfItems(querySource, queryTarget, sceneGraph)
-        elif querySource == '?':
-            findSourceOfRelation(queryRelation, queryTarget, sceneGraph)
-        elif queryTarget == '?':
-            findTargetOfRelation(queryRelation, querySource, sceneGraph)
+    elif queryPlan.handlerName == 'findRelationOfItems':
+        return _runHandler(findRelationOfItems, querySource, queryTarget, sceneGraph, outputResults)
+    elif queryPlan.handlerName == 'findSourceOfRelation':
+        return _runHandler(findSourceOfRelation, queryRelation, queryTarget, sceneGraph, outputResults)
+    elif queryPlan.handlerName == 'findTargetOfRelation':
+        return _runHandler(findTargetOfRelation, queryRelation, querySource, sceneGraph, outputResults)
 
 
 # If the query is in the format relation(?,o1,o2) - search through the graph for edges connecting o1 and o2.
-def findRelationOfItems(querySource: str, queryTarget: str, sceneGraph):
-    relationsMatchingQuery = []
-    # Iterate through the scene graph to find the source node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the source object in the query, see if the desired relationship is found
-        if nodeObjectName == querySource:
-            # Get the successors of the source node (successor = a node that receives a directed edge from the source)
-            nodeSuccessors = sceneGraph.successors(currentNode)
-            # Go through all of the successors found and check if any of them match the requested target
-            for successor in nodeSuccessors:
-                strippedSuccessor = stripOffUnderscoreNumber(successor)
-                # If the successor matches the target, add the relation between them to the list of relations matching
-                # the query
-                if strippedSuccessor == queryTarget:
-                    relationsMatchingQuery.append((currentNode,
-                                                   sceneGraph.get_edge_data(currentNode, successor)['label'],
-                                                   successor))
-    if len(relationsMatchingQuery) == 0:
-        print("WARNING: There is no relation found in the graph between " + querySource + " and "
-              + queryTarget + ".")
+def findRelationOfItems(querySource: str, queryTarget: str, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Every edge going from a node named querySource to a node named queryTarget, whatever its label
+    relationsMatchingQuery = tuple(sceneGraphIndex.triplesBySourceTarget.get((querySource, queryTarget), ()))
     # If multiple nodes found that match the queried term, raise a target gap
     #if len(relationsMatchingQuery) > 1:
     #    print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
     #          "The list of these relations is as follows: " + str(relationsMatchingQuery))
-    else:
-        print("SUCCESS: Relation(s) found between the requested nodes!  The list is as follow: "
-              + str(relationsMatchingQuery))
+    queryResult = _relationListingResult('findRelationOfItems', (querySource, queryTarget), relationsMatchingQuery,
+                                         sceneGraphIndex, (querySource, queryTarget))
+    return _finishQuery(queryResult, outputResults)
 
 
 # If the query is in the format relation(r1,?,o2) - search the graph for a list of source nodes which have an edge
 # r1 going to a target node o2.
-def findSourceOfRelation(queryRelation: str, queryTarget: str, sceneGraph):
-    queryMatches = []
-    # Iterate through the scene graph to find the source node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the target object in the query, see if the desired relationship is found
-        if nodeObjectName == queryTarget:
-            # Get the edges going in to the target node
-            nodeInEdges = sceneGraph.in_edges(currentNode, data="label")
-            # Go through all of the edges found and get the edge and target nodes as well as the source
-            for source, target, edgeLabel in nodeInEdges:
-                # If the edge matches the queried relation, add the triple to the list of matches
-                if edgeLabel == queryRelation:
-                    queryMatches.append((source, edgeLabel, currentNode))
-
-    if len(queryMatches) == 0:
-        print("WARNING: There is no source node found in the graph which has an edge of " + queryRelation +
-              " and a target of " + queryTarget + ".")
-    # If multiple nodes found that match the queried term, raise a target gap
-    #if len(relationsMatchingQuery) > 1:
-    #    print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
-    #          "The list of these relations is as follows: " + str(relationsMatchingQuery))
-    else:
-        print("SUCCESS: Source(s) found with the requested relation and target!  The list is as follow: "
-              + str(queryMatches))
+def findSourceOfRelation(queryRelation: str, queryTarget: str, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Every edge with the queried relation going in to a node named queryTarget
+    queryMatches = tuple(sceneGraphIndex.triplesByLabelTarget.get((queryRelation, queryTarget), ()))
+    queryResult = _relationListingResult('findSourceOfRelation', (queryRelation, queryTarget), queryMatches,
+                                         sceneGraphIndex, (queryTarget,))
+    return _finishQuery(queryResult, outputResults)
 
 
 # If the query is in the format relation(r1,o1,?) - search the graph for a list of target nodes which have an edge
 # r1 coming from a source node o1.
-def findTargetOfRelation(queryRelation: str, querySource: str, sceneGraph):
-    queryMatches = []
-    # Iterate through the scene graph to find the target node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the source object in the query, see if the desired relationship is found
-        if nodeObjectName == querySource:
-            # Get the edges going out of the source node
-            nodeOutEdges = sceneGraph.out_edges(currentNode, data="label")
-            # Go through all of the edges found and get the edge and source nodes as well as the target
-            for source, target, edgeLabel in nodeOutEdges:
-                # If the edge matches the queried relation, add the triple to the list of matches
-                if edgeLabel == queryRelation:
-                    queryMatches.append((currentNode, edgeLabel, target))
-
-    if len(queryMatches) == 0:
-        print("WARNING: There is no target node found in the graph which has an edge of " + queryRelation +
-              " and a source of " + querySource + ".")
-    # If multiple nodes found that match the queried term, raise a target gap
-    # if len(relationsMatchingQuery) > 1:
-    #    print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
-    #          "The list of these relations is as follows: " + str(relationsMatchingQuery))
-    else:
-        print("SUCCESS: Target(s) found with the requested relation and source!  The list is as follow: "
-              + str(queryMatches))
+def findTargetOfRelation(queryRelation: str, querySource: str, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Every edge with the queried relation coming out of a node named querySource
+    queryMatches = tuple(sceneGraphIndex.triplesBySourceLabel.get((querySource, queryRelation), ()))
+    queryResult = _relationListingResult('findTargetOfRelation', (queryRelation, querySource), queryMatches,
+                                         sceneGraphIndex, (querySource,))
+    return _finishQuery(queryResult, outputResults)
 
 
 # Take in a query about a relation (ex: relation(to the left of,pants,bat)) and return whether or not that relation
 # exists in the graph
-def relationExistenceQuery(queryRelation: str, querySource: str, queryTarget: str, sceneGraph):
-    # Set a flag if the relation is found, and a list to store all of the found relations
-    relationFound = False
-    relationsMatchingQuery = []
-    # Iterate through the scene graph to find the source node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the source object in the query, see if the desired relationship is found
-        if nodeObjectName == querySource:
-            # Get the edges going out of the source node
-            nodeOutEdges = sceneGraph.out_edges(currentNode, data="label")
-            # Go through all of the edges found and get the source and target nodes as well as the edge label
-            for source, target, edgeLabel in nodeOutEdges:
-                strippedTarget = stripOffUnderscoreNumber(target)
-                # the source equivalence should always be true because of the prior check
-                if strippedTarget == queryTarget and edgeLabel == queryRelation:
-                    relationFound = True
-                    relationsMatchingQuery.append((source, edgeLabel, target))
-                    print(source + " " + edgeLabel + " " + target)
+def relationExistenceQuery(queryRelation: str, querySource: str, queryTarget: str, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Look up the edges whose source, label and target all match the query
+    relationsMatchingQuery = tuple(
+        sceneGraphIndex.triplesBySourceLabelTarget.get((querySource, queryRelation, queryTarget), ()))
+    gapSuggestions = ()
     # If nothing matching found, raise a lexical gap
-    if relationFound == False:
-        print("WARNING: Lexical Gap identified - the relation queried " + querySource + " " + queryRelation + " "
-              + queryTarget + " does not appear in the graph.")
+    if len(relationsMatchingQuery) == 0:
+        queryStatus = CONST_STATUS_LEXICAL_GAP
+        gapSuggestions = _gapSuggestions(sceneGraphIndex, queryRelation, (querySource, queryTarget))
     # If multiple nodes found that match the queried term, raise a target gap
-    if len(relationsMatchingQuery) > 1:
-        print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
-              "The list of these relations is as follows: " + str(relationsMatchingQuery))
+    elif len(relationsMatchingQuery) > 1:
+        queryStatus = CONST_STATUS_TARGET_GAP
+    else:
+        queryStatus = CONST_STATUS_SUCCESS
+    queryResult = QueryResult('relationExistenceQuery', (queryRelation, querySource, queryTarget), queryStatus,
+                              relationsMatchingQuery, _nodesOfTriples(relationsMatchingQuery),
+                              suggestions=gapSuggestions)
+    return _finishQuery(queryResult, outputResults)
 
 
-# Parse out the query and route to the appropriate function
-def attributeQueryHandler(queryContents: str, sceneGraph):
-    queryElements = queryContents.split(',')
-    queryAttribute = queryElements[0]
-    queryObject = queryElements[1].split(')')[0]
+# Queries with two or three unknowns, named variables (?x) or several parts joined with &, e.g.
+# relation(to the left of,?x,?y) & relation(on,?y,bat).  Attribute parts are matched as has_attribute edges to the
+# attribute node.  The answer lists every consistent binding of the named variables, plus the edges that produced them;
+# a variable in the attribute slot is reported as the attribute name (white, not the white_attr node).
+def relationPatternQuery(queryAtoms, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    relationPatterns = []
+    attributeVariables = set()
+    for queryAtom in queryAtoms:
+        if queryAtom.keyword == CONST_ATTRIBUTE_KEYWORD:
+            queryAttribute, queryObject = queryAtom.arguments
+            if isinstance(queryAttribute, QueryVariable):
+                attributeVariables.add(queryAttribute)
+            else:
+                queryAttribute = queryAttribute + '_' + CONST_ATTR_LABEL
+            relationPatterns.append(RelationPattern(queryObject, CONST_HAS_ATTRIBUTE_EDGE, queryAttribute))
+        else:
+            queryRelation, querySource, queryTarget = queryAtom.arguments
+            relationPatterns.append(RelationPattern(querySource, queryRelation, queryTarget))
+    queryArguments = tuple(str(queryAtom) for queryAtom in queryAtoms)
+
+    # A name or relation the pattern mentions that is nowhere in the graph is a lexical gap, as for the other queries
+    patternHasGap = False
+    gapSuggestions = ()
+    for relationPattern in relationPatterns:
+        patternLabel = None if isinstance(relationPattern.label, QueryVariable) else relationPattern.label
+        patternObjects = tuple(nodeTerm for nodeTerm in (relationPattern.source, relationPattern.target)
+                               if not isinstance(nodeTerm, QueryVariable))
+        if (patternLabel is not None and patternLabel not in sceneGraphIndex.labelEdgeCounts) or \
+                not all(sceneGraphIndex.nodesWithBaseName(patternObject) for patternObject in patternObjects):
+            patternHasGap = True
+            gapSuggestions += _gapSuggestions(sceneGraphIndex, patternLabel, patternObjects)
+    if patternHasGap:
+        queryResult = QueryResult('relationPatternQuery', queryArguments, CONST_STATUS_LEXICAL_GAP,
+                                  suggestions=tuple(dict.fromkeys(gapSuggestions)))
+        return _finishQuery(queryResult, outputResults)
+
+    patternMatches = matchRelationPatterns(relationPatterns, sceneGraphIndex)
+    # Report each distinct binding of the named variables once, and each edge used by any match once
+    nodeAttributeNames = sceneGraphIndex.nodeAttributeNames
+    queryBindings = tuple(dict.fromkeys(
+        tuple((patternVariable.name,
+               nodeAttributeNames[boundValue] if patternVariable in attributeVariables else boundValue)
+              for patternVariable, boundValue in patternMatch.bindings.items() if not patternVariable.isAnonymous)
+        for patternMatch in patternMatches))
+    matchedTriples = tuple(dict.fromkeys(edgeTriple for patternMatch in patternMatches
+                                         for edgeTriple in patternMatch.edgeTriples))
+    queryStatus = CONST_STATUS_SUCCESS if patternMatches else CONST_STATUS_NOT_FOUND
+    queryResult = QueryResult('relationPatternQuery', queryArguments, queryStatus, matchedTriples,
+                              _nodesOfTriples(matchedTriples), queryBindings if any(queryBindings) else ())
+    return _finishQuery(queryResult, outputResults)
+
+
+# Route an attribute query to the appropriate function.  Like relationQueryHandler, also accepts the query contents
+# as text (e.g. "red,?)").
+def attributeQueryHandler(queryPlan, sceneGraph, outputResults = True):
+    if isinstance(queryPlan, str):
+        queryPlan = parseQuery(CONST_ATTRIBUTE_KEYWORD + '(' + queryPlan)
+    sceneGraph = getSceneGraphIndex(sceneGraph)
+    if queryPlan.handlerName == CONST_PATTERN_HANDLER:
+        return _runHandler(relationPatternQuery, queryPlan.arguments, sceneGraph, outputResults)
+    queryAttribute, queryObject = queryPlan.arguments
+
+    # Before checking for the attribute, check for existence of the object and/or the attribute.  If either is missing
+    # the query is answered with a lexical gap instead of running the attribute query.
+    lexicalGap = _attributeLexicalGap(queryPlan.handlerName, queryAttribute, queryObject, sceneGraph)
+    if lexicalGap is not None:
+        return _finishQuery(lexicalGap, outputResults)
 
     # If there are no question marks in the query, we just check flatly if the queried object has the queried attribute.
-    if queryAttribute != '?' and queryObject != '?':
-        # Before checking for attribute, check for existence of the object.
-        objectExists = itemExistenceQuery(queryElements[1], sceneGraph, False)
-        attributeExists = itemExistenceQuery(queryElements[0] + '_attr)', sceneGraph, False)
-        if objectExists == True and attributeExists == True:
-            attributeCheckQuery(queryAttribute, queryObject, sceneGraph)
-    elif queryAttribute == '?':
-        # Before checking for attribute, check for existence of the object.
-        objectExists = itemExistenceQuery(queryElements[1], sceneGraph, False)
-        if objectExists == True:
-            listAttributesOfObject(queryObject, sceneGraph)
-    elif queryObject == '?':
-        # Before checking for attribute, check for existence of the object.
-        attributeExists = itemExistenceQuery(queryElements[0] + '_attr)', sceneGraph, False)
-        if attributeExists == True:
-            listObjectsWithAttribute(queryAttribute, sceneGraph)
+    if queryPlan.handlerName == 'attributeCheckQuery':
+        return _runHandler(attributeCheckQuery, queryAttribute, queryObject, sceneGraph, outputResults)
+    elif queryPlan.handlerName == 'listAttributesOfObject':
+        return _runHandler(listAttributesOfObject, queryObject, sceneGraph, outputResults)
+    elif queryPlan.handlerName == 'listObjectsWithAttribute':
+        return _runHandler(listObjectsWithAttribute, queryAttribute, sceneGraph, outputResults)
 
 # Check if given attribute is applied to the given object.
 # This could probably be incredibly improved, if tree is gross
 # TODO: Could do something interesting with checking if the requested attribute exists in the graph at all or not
-def attributeCheckQuery(queryAttribute: str, queryObject: str, sceneGraph):
+def attributeCheckQuery(queryAttribute: str, queryObject: str, sceneGraph, outputResults = True):
     objectsWithAttribute = []
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Only the attribute nodes whose name matches the queried attribute can satisfy the query
+    attributeNodes = [potentialAttribute for potentialAttribute in
+                      sceneGraphIndex.nodesWithAttributeName(queryAttribute)
+                      if sceneGraphIndex.nodeTypes[potentialAttribute] == CONST_ATTR_LABEL]
+
+    # Check each object matching the query for an edge to one of those attribute nodes
+    for currentNode in sceneGraphIndex.nodesWithBaseName(queryObject):
+        nodeSuccessors = sceneGraphIndex.successors[currentNode]
+        for potentialAttribute in attributeNodes:
+            if potentialAttribute in nodeSuccessors:
+                # Append the node to the list of matching nodes for target gap detection
+                objectsWithAttribute.append(currentNode)
+    return _finishQuery(_attributeCheckResult(queryAttribute, queryObject, objectsWithAttribute), outputResults)
+
+
+# Answer many attribute(A,X) checks against one graph at once, returning one result per (attribute, object) pair in the
+# same form attributeQueryHandler would.  With NumPy/SciPy installed, every check is answered by the same sparse matrix
+# product on the graph's AttributeMatrix rather than one lookup per pair.  Missing objects and attributes go through the
+# same _attributeLexicalGap check as attributeQueryHandler, so both give the same lexical gaps.  Single
+# queries stay on the lookup tables, which beat a matrix lookup when there is only one answer to find.
+def attributeCheckQueries(queryPairs, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    attributeMatrix = sceneGraphIndex.getAttributeMatrix()
+    if attributeMatrix is None:
+        return [attributeQueryHandler(QueryPlan(CONST_ATTRIBUTE_KEYWORD, tuple(queryPair), (True, True),
+                                                'attributeCheckQuery'), sceneGraphIndex, outputResults)
+                for queryPair in queryPairs]
+    queryResults = []
+    for (queryAttribute, queryObject), objectsWithAttribute in zip(queryPairs,
+                                                                   attributeMatrix.checkAttributes(queryPairs)):
+        queryResult = _attributeLexicalGap('attributeCheckQuery', queryAttribute, queryObject, sceneGraphIndex)
+        if queryResult is None:
+            if objectsWithAttribute is None:
+                # The matrix only has rows for objects and columns for attributes; anything else goes the long way round
+                queryResult = attributeCheckQuery(queryAttribute, queryObject, sceneGraphIndex, False)
+            else:
+                queryResult = _attributeCheckResult(queryAttribute, queryObject, objectsWithAttribute)
+        queryResults.append(_finishQuery(queryResult, outputResults))
+    return queryResults
+
 
-    # If the object does exist then move on
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the target of the query, flag as such and set the flag to true
-        if nodeObjectName == queryObject:
-            # Check if the node has the requested attribute attached
-            for potentialAttribute in sceneGraph.neighbors(currentNode):
-                # If the type of the neighbor is "attr" then it's an attribute
-                if sceneGraph.nodes[potentialAttribute][CONST_TYPE_LABEL] == CONST_ATTR_LABEL:
-                    # if the value of the node is the same as the queried attribute, then the queried object has the
-                    # queried attribute
-                    attributeName = stripOffUnderscoreAttr(potentialAttribute)
-                    if attributeName == queryAttribute:
-                        # Append the node to the list of matching nodes for target gap detection
-                        objectsWithAttribute.append(currentNode)
-    # If nothing matching found, inform user that the given attribute is not applied to the object
+def _attributeCheckResult(queryAttribute, queryObject, objectsWithAttribute):
+    # If nothing matching found, the given attribute is not applied to the object
     if len(objectsWithAttribute) == 0:
-        print("The object " + queryObject + " does not have the attribute " + queryAttribute + " in the scene graph.")
+        queryStatus = CONST_STATUS_NOT_FOUND
     # If multiple nodes found that match the queried term, raise a target gap
     elif len(objectsWithAttribute) > 1:
-        print("WARNING: Potential Target Gap identified.  Multiple objects named " + queryObject + " have the queried "
-                    "attribute " + queryAttribute + ". The list of these objects is as follows: " +
-              str(objectsWithAttribute))
-    elif len(objectsWithAttribute) == 1:
-        print("SUCCESS! " + queryObject + " exists in the graph and has attribute " + queryAttribute + "!")
+        queryStatus = CONST_STATUS_TARGET_GAP
+    else:
+        queryStatus = CONST_STATUS_SUCCESS
+    return QueryResult('attributeCheckQuery', (queryAttribute, queryObject), queryStatus,
+                       nodes=tuple(objectsWithAttribute))
 
 
 # Get list of objects which have a given attribute
-def listAttributesOfObject(queryObject: str, sceneGraph):
-    queryMatches = []
-    objectCount = 0
-    # Iterate through the scene graph to find the object node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_#" if present - see assumptions at top of file
-        nodeObjectName = stripOffUnderscoreNumber(currentNode)
-        # If the name of the object matches the object in the query, get its list of attributes
-        if nodeObjectName == queryObject:
-            # Count how many objects matching the queried object are found.
-            objectCount = objectCount + 1
-            # Get the edges going out of the object node
-            nodeOutEdges = sceneGraph.out_edges(currentNode, data="label")
-            # Go through all of the edges found and get the object, edge, and target of the edge
-            for objectNode, attribute, edgeLabel in nodeOutEdges:
-                # If the edge is the attribute edge, add the triple to the list of matches
-                if edgeLabel == CONST_HAS_ATTRIBUTE_EDGE:
-                    queryMatches.append((currentNode, CONST_HAS_ATTRIBUTE_EDGE, attribute))
+def listAttributesOfObject(queryObject: str, sceneGraph, outputResults = True):
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    objectNodes = tuple(sceneGraphIndex.nodesWithBaseName(queryObject))
+    # Every attribute edge coming out of a node named queryObject
+    queryMatches = tuple(sceneGraphIndex.triplesBySourceLabel.get((queryObject, CONST_HAS_ATTRIBUTE_EDGE), ()))
 
     if len(queryMatches) == 0:
-        print("WARNING: There is no attribute found in the graph that is attached to the object  " + queryObject + ".")
-    # If multiple nodes found that match the queried term, raise a target gap
-    # if len(relationsMatchingQuery) > 1:
-    #    print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
-    #          "The list of these relations is as follows: " + str(relationsMatchingQuery))
+        queryStatus = _noMatchStatus(sceneGraphIndex, objectNodes)
+    # If multiple objects match the queried object, the attributes found may belong to different objects
+    elif len(objectNodes) > 1:
+        queryStatus = CONST_STATUS_TARGET_GAP
     else:
-        if objectCount == 1:
-            print("SUCCESS: The following attributes were found associated with the queried object!  The list is: "
-                  + str(queryMatches))
-        elif objectCount > 1:
-            print("WARNING: Potential Target Gap identified.  Multiple objects match the queried object.\n" +
-                  "The list of these objects and their attributes is as follows: " + str(queryMatches))
+        queryStatus = CONST_STATUS_SUCCESS
+    return _finishQuery(QueryResult('listAttributesOfObject', (queryObject,), queryStatus, queryMatches, objectNodes),
+                        outputResults)
 
 
 #Get list of attributes applied to given object.
-def listObjectsWithAttribute(queryAttribute: str, sceneGraph):
+def listObjectsWithAttribute(queryAttribute: str, sceneGraph, outputResults = True):
     queryMatches = []
-    attributeCount = 0
-    # Iterate through the scene graph to find the queried attribute node
-    for currentNode in sceneGraph:
-        # For each node, strip off the "_attr" if present - see assumptions at top of file
-        nodeAttributeName = stripOffUnderscoreAttr(currentNode)
-        # If the name of the node matches the attribute in the query, see if the desired relationship is found
-        if nodeAttributeName == queryAttribute:
-            attributeCount = attributeCount + 1
-            # Get the edges going in to the attribute node
-            nodeInEdges = sceneGraph.in_edges(currentNode, data="label")
-            # Go through all of the edges found and get the edge and target nodes as well as the source
-            for objectNode, attribute, edgeLabel in nodeInEdges:
-                # If the edge matches the queried relation, add the triple to the list of matches
+    sceneGraphIndex = getSceneGraphIndex(sceneGraph)
+    # Look up the nodes whose name, with the "_attr" stripped off, matches the attribute in the query
+    attributeNodes = tuple(sceneGraphIndex.nodesWithAttributeName(queryAttribute))
+    for currentNode in attributeNodes:
+        # Go through the edges going in to the attribute node and keep the attribute edges
+        for objectNode, edgeLabels in sceneGraphIndex.predecessors[currentNode].items():
+            for edgeLabel in edgeLabels:
                 if edgeLabel == CONST_HAS_ATTRIBUTE_EDGE:
                     queryMatches.append((objectNode, CONST_HAS_ATTRIBUTE_EDGE, currentNode))
+
     if len(queryMatches) == 0:
-        print("WARNING: There is no object found in the graph that is attached to the attribute "
-              + queryAttribute + ".")
-    # If multiple nodes found that match the queried term, raise a target gap
-    # if len(relationsMatchingQuery) > 1:
-    #    print("WARNING: Potential Target Gap identified.  Multiple node-edges sets match the queried relation.\n" +
-    #          "The list of these relations is as follows: " + str(relationsMatchingQuery))
+        queryStatus = CONST_STATUS_NOT_FOUND
+    # If multiple attribute nodes match the queried attribute, raise a target gap
+    elif len(attributeNodes) > 1:
+        queryStatus = CONST_STATUS_TARGET_GAP
     else:
-        if attributeCount == 1:
-            print("SUCCESS: The following objects were found associated with the queried attribute!  The list is: "
-                  + str(queryMatches))
-        elif attributeCount > 1:
-            print("WARNING: Potential Target Gap identified.  Multiple attributes match the queried attribute.\n" +
-                  "The list of these attributes and the objects they affect is as follows: " + str(queryMatches))
-
-
-# Strip off the "_#" at the end of an object name
-def stripOffUnderscoreNumber(textToStrip):
-    # For each node, strip off the "_#" if present - see assumptions at top of file
-    regexPattern = r'_\d+'
-    strippedText = re.sub(regexPattern, '', textToStrip)
-    return strippedText
-
-
-# Strip off the "_attr" at the end of an attribute name
-def stripOffUnderscoreAttr(textToStrip):
-    # For each node, strip off the "_attr" if present - see assumptions at top of file
-    regexPattern = r'_attr$'
-    strippedText = re.sub(regexPattern, '', textToStrip)
-    return strippedText
+        queryStatus = CONST_STATUS_SUCCESS
+    queryResult = QueryResult('listObjectsWithAttribute', (queryAttribute,), queryStatus, tuple(queryMatches),
+                              attributeNodes)
+    return _finishQuery(queryResult, outputResults)
+
+
+# The lexical gap to report for an attribute query whose object or attribute is not in the graph, or None if both are
+# (a None argument is the '?' slot and is not checked).  The result has the type of the handler the query was meant
+# for, and carries the suggestions for every missing term.  The attribute is looked up as its "<attribute>_attr" node,
+# but reported (suggestions included) under the attribute name the user asked about.
+def _attributeLexicalGap(queryType, queryAttribute, queryObject, sceneGraphIndex):
+    gapSuggestions = ()
+    objectMissing = queryObject is not None and not sceneGraphIndex.nodesWithBaseName(queryObject)
+    if objectMissing:
+        gapSuggestions += sceneGraphIndex.getGapResolver().suggestNodeNames(queryObject)
+    attributeName = None if queryAttribute is None else queryAttribute + '_' + CONST_ATTR_LABEL
+    attributeMissing = attributeName is not None and not sceneGraphIndex.nodesWithBaseName(attributeName)
+    if attributeMissing:
+        for gapSuggestion in sceneGraphIndex.getGapResolver().suggestNodeNames(attributeName):
+            suggestedAttribute = stripOffUnderscoreAttr(gapSuggestion.suggestedTerm)
+            gapSuggestions += (gapSuggestion._replace(queriedTerm=queryAttribute, suggestedTerm=suggestedAttribute),)
+    if not objectMissing and not attributeMissing:
+        return None
+    queryArguments = tuple(CONST_UNKNOWN_ARGUMENT if queryArgument is None else queryArgument
+                           for queryArgument in (queryAttribute, queryObject))
+    return QueryResult(queryType, queryArguments, CONST_STATUS_LEXICAL_GAP,
+                       suggestions=tuple(dict.fromkeys(gapSuggestions)))
+
+
+# Suggested replacements for the terms of a lexical gap query that are not in the graph: the relation label (None if
+# it is not fixed) and the object names
+def _gapSuggestions(sceneGraphIndex, queryRelation, queryObjects):
+    gapResolver = sceneGraphIndex.getGapResolver()
+    gapSuggestions = ()
+    if queryRelation is not None and queryRelation not in sceneGraphIndex.labelEdgeCounts:
+        gapSuggestions += gapResolver.suggestEdgeLabels(queryRelation)
+    for queryObject in queryObjects:
+        if not sceneGraphIndex.nodesWithBaseName(queryObject):
+            gapSuggestions += gapResolver.suggestNodeNames(queryObject)
+    return gapSuggestions
+
+
+# Call a query handler.  While instrumentation is on, its time and the size of its answer are recorded under its name.
+def _runHandler(queryHandler, *handlerArguments):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return queryHandler(*handlerArguments)
+    startTime = QueryInstrumentation.clock()
+    queryResult = queryHandler(*handlerArguments)
+    queryRecorder.recordStage(queryHandler.__name__, QueryInstrumentation.clock() - startTime)
+    if queryResult is not None:
+        queryRecorder.recordAnswerSize(queryHandler.__name__, len(queryResult.nodes), len(queryResult.triples))
+    return queryResult
+
+
+# Print the result if the caller asked for output, and hand it back either way
+def _finishQuery(queryResult: QueryResult, outputResults):
+    if outputResults == True:
+        printQueryResult(queryResult)
+    return queryResult
+
+
+# Result for the relation(?...) listing queries.  An empty answer is reported as a context gap rather than a plain
+# "not found" when the objects the query was anchored on do exist but none of them has any edge at all.
+def _relationListingResult(queryType, queryArguments, queryMatches, sceneGraphIndex, anchorObjects):
+    if queryMatches:
+        return QueryResult(queryType, queryArguments, CONST_STATUS_SUCCESS, queryMatches, _nodesOfTriples(queryMatches))
+    anchorNodes = tuple(anchorNode for anchorObject in anchorObjects
+                        for anchorNode in sceneGraphIndex.nodesWithBaseName(anchorObject))
+    return QueryResult(queryType, queryArguments, _noMatchStatus(sceneGraphIndex, anchorNodes), nodes=anchorNodes)
+
+
+def _noMatchStatus(sceneGraphIndex, anchorNodes):
+    if anchorNodes and all(sceneGraphIndex.contextGaps.isContextGap(anchorNode) for anchorNode in anchorNodes):
+        return CONST_STATUS_CONTEXT_GAP
+    return CONST_STATUS_NOT_FOUND
+
+
+# Distinct nodes appearing in a list of edge triples, in order of first appearance
+def _nodesOfTriples(edgeTriples):
+    return tuple(dict.fromkeys(node for source, edgeLabel, target in edgeTriples for node in (source, target)))
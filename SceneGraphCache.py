@@ -0,0 +1,345 @@
+import gc
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import NamedTuple
+import QueryInstrumentation
+from SceneGraphIndex import SceneGraphIndex, stripOffUnderscoreNumber, stripOffUnderscoreAttr
+from StreamingGraphLoader import streamSceneGraphIndex
+
+# Compiled binary form of the GraphML scene graphs.  Parsing the XML dominates load time, so each .graphml file can be
+# compiled once into a ".sgc" file next to it, which later loads are read from instead whenever it is newer than the
+# source.  Only the schema used by this project is kept: the "id" and "type" data of each node and the "label" of each
+# edge (the GraphML edge ids are all "0" in these files and are not stored).  The base and attribute name of every node
+# (see SceneGraphIndex.py) are stored as well, so building the index from the cache never runs the name regexes.
+#
+# networkx is only imported by the functions that build or parse a networkx graph, since importing it takes longer than
+# loading a compiled graph.  loadSceneGraphIndex never needs it: a fresh cache is read directly, and otherwise the
+# GraphML is streamed straight into the index (see StreamingGraphLoader.py) and the cache written from the index.
+#
+# File layout (all integers are little-endian uint32, so every array can be read straight out of an mmap):
+#   header          magic, format version, node count, edge count, string count, string blob size
+#   stringOffsets   [string count + 1]  start of each interned string in the blob
+#   nodeNames       [node count]        string number of each node name
+#   nodeTypes       [node count]        string number of the node's "type", or CONST_NO_STRING
+#   nodeIds         [node count]        string number of the node's "id", or CONST_NO_STRING
+#   nodeBaseNames   [node count]        string number of the node name with "_<number>" stripped off
+#   nodeAttrNames   [node count]        string number of the node name with "_attr" stripped off
+#   rowOffsets      [node count + 1]    CSR offsets: the out edges of node i are rowOffsets[i]:rowOffsets[i + 1]
+#   edgeTargets     [edge count]        node number of each edge's target
+#   edgeLabels      [edge count]        string number of each edge's "label", or CONST_NO_STRING
+#   stringBlob      UTF-8 bytes of every interned string, back to back
+#
+# Usage: python SceneGraphCache.py scene_graph_graphmls/ 2377804_with_attributes.graphml
+
+CONST_CACHE_SUFFIX = '.sgc'
+CONST_CACHE_MAGIC = b'SGKG'
+CONST_CACHE_VERSION = 2
+CONST_NO_STRING = 0xFFFFFFFF
+_HEADER_FORMAT = '<4sIIIII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+
+# Decoded contents of a compiled scene graph, with every name already turned back into a string.  The offsets and
+# node numbers are left as the uint32 arrays read from the file.
+class CompiledSceneGraph(NamedTuple):
+    nodeNames: list
+    nodeTypes: list
+    nodeIds: list
+    nodeBaseNames: list
+    nodeAttributeNames: list
+    rowOffsets: array
+    edgeTargets: array
+    edgeLabels: list
+
+    # Edges as (source, target, label) names, in the order they were compiled
+    def iterEdges(self):
+        nodeNames = self.nodeNames
+        for sourceNumber in range(len(nodeNames)):
+            source = nodeNames[sourceNumber]
+            for edgeNumber in range(self.rowOffsets[sourceNumber], self.rowOffsets[sourceNumber + 1]):
+                yield source, nodeNames[self.edgeTargets[edgeNumber]], self.edgeLabels[edgeNumber]
+
+
+# The cache file used for a given GraphML file
+def cachePathFor(graphmlFile: str):
+    return graphmlFile + CONST_CACHE_SUFFIX
+
+
+# True if the cache file exists and is at least as new as the GraphML it was compiled from
+def isCacheFresh(graphmlFile: str, cacheFile: str = None):
+    cacheFile = cacheFile or cachePathFor(graphmlFile)
+    try:
+        return os.path.getmtime(cacheFile) >= os.path.getmtime(graphmlFile)
+    except OSError:
+        return False
+
+
+# Write a scene graph out in the compiled form.  sceneGraph is a networkx graph or a SceneGraphIndex; an index does not
+# keep the "id" data of its nodes, so nodeIds (node name -> id, as filled in by streamSceneGraphIndex) supplies them.
+# The file is written to a temporary name and moved into place so a concurrent reader never sees a half-written cache;
+# if writing fails the temporary file is removed and the OSError raised.
+def writeCompiledSceneGraph(sceneGraph, cacheFile: str, nodeIds=None):
+    stringNumbers = {}
+    stringList = []
+
+    def intern(text):
+        if text is None:
+            return CONST_NO_STRING
+        text = str(text)
+        stringNumber = stringNumbers.get(text)
+        if stringNumber is None:
+            stringNumber = stringNumbers[text] = len(stringList)
+            stringList.append(text)
+        return stringNumber
+
+    if isinstance(sceneGraph, SceneGraphIndex):
+        nodeIds = nodeIds or {}
+        nodeRecords = [(currentNode, nodeType, nodeIds.get(currentNode), sceneGraph.nodeBaseNames[currentNode],
+                        sceneGraph.nodeAttributeNames[currentNode])
+                       for currentNode, nodeType in sceneGraph.nodeTypes.items()]
+
+        # The index groups parallel edges under their target in the order they were added, as networkx does
+        def outEdges(currentNode):
+            return ((target, edgeLabel) for target, targetLabels in sceneGraph.successors[currentNode].items()
+                    for edgeLabel in targetLabels)
+    else:
+        nodeRecords = [(currentNode, nodeData.get('type'), nodeData.get('id'), stripOffUnderscoreNumber(currentNode),
+                        stripOffUnderscoreAttr(currentNode))
+                       for currentNode, nodeData in sceneGraph.nodes(data=True)]
+
+        # out_edges yields every parallel edge when read_graphml produced a MultiDiGraph
+        def outEdges(currentNode):
+            return ((target, edgeLabel)
+                    for source, target, edgeLabel in sceneGraph.out_edges(currentNode, data='label'))
+
+    nodeNumbers = {}
+    nodeNames = array('I')
+    nodeTypes = array('I')
+    compiledIds = array('I')
+    nodeBaseNames = array('I')
+    nodeAttributeNames = array('I')
+    for currentNode, nodeType, nodeId, baseName, attributeName in nodeRecords:
+        nodeNumbers[currentNode] = len(nodeNames)
+        nodeNames.append(intern(currentNode))
+        nodeTypes.append(intern(nodeType))
+        compiledIds.append(intern(nodeId))
+        nodeBaseNames.append(intern(baseName))
+        nodeAttributeNames.append(intern(attributeName))
+
+    rowOffsets = array('I', [0])
+    edgeTargets = array('I')
+    edgeLabels = array('I')
+    for currentNode in nodeNumbers:
+        for target, edgeLabel in outEdges(currentNode):
+            edgeTargets.append(nodeNumbers[target])
+            edgeLabels.append(intern(edgeLabel))
+        rowOffsets.append(len(edgeTargets))
+
+    encodedStrings = [text.encode('utf-8') for text in stringList]
+    stringOffsets = array('I', [0])
+    for encodedString in encodedStrings:
+        stringOffsets.append(stringOffsets[-1] + len(encodedString))
+    stringBlob = b''.join(encodedStrings)
+
+    temporaryFile = cacheFile + '.tmp' + str(os.getpid())
+    try:
+        with open(temporaryFile, 'wb') as cacheStream:
+            cacheStream.write(struct.pack(_HEADER_FORMAT, CONST_CACHE_MAGIC, CONST_CACHE_VERSION, len(nodeNames),
+                                          len(edgeTargets), len(stringList), len(stringBlob)))
+            for integerArray in (stringOffsets, nodeNames, nodeTypes, compiledIds, nodeBaseNames, nodeAttributeNames,
+                                 rowOffsets, edgeTargets, edgeLabels):
+                if sys.byteorder != 'little':
+                    integerArray.byteswap()
+                integerArray.tofile(cacheStream)
+            cacheStream.write(stringBlob)
+        os.replace(temporaryFile, cacheFile)
+    except OSError:
+        try:
+            os.remove(temporaryFile)
+        except OSError:
+            pass
+        raise
+
+
+# Memory-map a compiled scene graph and decode it.  Raises ValueError if the file is not a cache this version wrote.
+def readCompiledSceneGraph(cacheFile: str):
+    with open(cacheFile, 'rb') as cacheStream, \
+            mmap.mmap(cacheStream.fileno(), 0, access=mmap.ACCESS_READ) as mappedCache:
+        if len(mappedCache) < _HEADER_SIZE:
+            raise ValueError('Not a compiled scene graph: ' + cacheFile)
+        magic, version, nodeCount, edgeCount, stringCount, blobSize = struct.unpack_from(_HEADER_FORMAT, mappedCache)
+        if magic != CONST_CACHE_MAGIC or version != CONST_CACHE_VERSION:
+            raise ValueError('Not a compiled scene graph (or from another version): ' + cacheFile)
+        arrayLengths = (stringCount + 1, nodeCount, nodeCount, nodeCount, nodeCount, nodeCount, nodeCount + 1,
+                        edgeCount, edgeCount)
+        if len(mappedCache) != _HEADER_SIZE + 4 * sum(arrayLengths) + blobSize:
+            raise ValueError('Truncated compiled scene graph: ' + cacheFile)
+
+        integerArrays = []
+        arrayStart = _HEADER_SIZE
+        with memoryview(mappedCache) as cacheView:
+            # Each array is copied out of the mmap in one block, rather than as a list of Python ints
+            for arrayLength in arrayLengths:
+                arrayEnd = arrayStart + 4 * arrayLength
+                integerArray = array('I')
+                integerArray.frombytes(cacheView[arrayStart:arrayEnd])
+                if sys.byteorder != 'little':
+                    integerArray.byteswap()
+                integerArrays.append(integerArray)
+                arrayStart = arrayEnd
+            stringBlob = cacheView[arrayStart:arrayStart + blobSize].tobytes()
+
+    (stringOffsets, nodeNames, nodeTypes, nodeIds, nodeBaseNames, nodeAttributeNames, rowOffsets, edgeTargets,
+     edgeLabels) = integerArrays
+    # Decode each interned string once, then swap every string number for the string itself
+    stringList = [stringBlob[stringOffsets[stringNumber]:stringOffsets[stringNumber + 1]].decode('utf-8')
+                  for stringNumber in range(stringCount)]
+    stringTable = dict(enumerate(stringList))
+    stringTable[CONST_NO_STRING] = None
+    return CompiledSceneGraph([stringTable[stringNumber] for stringNumber in nodeNames],
+                              [stringTable[stringNumber] for stringNumber in nodeTypes],
+                              [stringTable[stringNumber] for stringNumber in nodeIds],
+                              [stringTable[stringNumber] for stringNumber in nodeBaseNames],
+                              [stringTable[stringNumber] for stringNumber in nodeAttributeNames], rowOffsets,
+                              edgeTargets, [stringTable[stringNumber] for stringNumber in edgeLabels])
+
+
+# Stream a GraphML file into a SceneGraphIndex and write its compiled form, returning the index
+def compileSceneGraph(graphmlFile: str, cacheFile: str = None):
+    nodeIds = {}
+    sceneGraphIndex = streamSceneGraphIndex(graphmlFile, nodeIds=nodeIds)
+    writeCompiledSceneGraph(sceneGraphIndex, cacheFile or cachePathFor(graphmlFile), nodeIds)
+    return sceneGraphIndex
+
+
+# Write the cache for a graph that was just loaded.  The cache only speeds up later loads, so failing to write it (a
+# read-only directory, a full disk, something else in the way) is reported and otherwise ignored.
+def _writeCacheIfPossible(sceneGraph, graphmlFile, nodeIds=None):
+    cacheFile = cachePathFor(graphmlFile)
+    try:
+        writeCompiledSceneGraph(sceneGraph, cacheFile, nodeIds)
+    except OSError as writeError:
+        print("WARNING: Could not write the scene graph cache " + cacheFile + ": " + str(writeError), file=sys.stderr)
+
+
+# Rebuild the networkx graph read_graphml would have produced: a MultiDiGraph if any pair of nodes has parallel edges,
+# a DiGraph otherwise
+def compiledToGraph(compiledGraph: CompiledSceneGraph):
+    import networkx
+    edgeList = list(compiledGraph.iterEdges())
+    if len({(source, target) for source, target, edgeLabel in edgeList}) < len(edgeList):
+        sceneGraph = networkx.MultiDiGraph()
+    else:
+        sceneGraph = networkx.DiGraph()
+    for nodeName, nodeType, nodeId in zip(compiledGraph.nodeNames, compiledGraph.nodeTypes, compiledGraph.nodeIds):
+        nodeData = {}
+        if nodeId is not None:
+            nodeData['id'] = nodeId
+        if nodeType is not None:
+            nodeData['type'] = nodeType
+        sceneGraph.add_node(nodeName, **nodeData)
+    sceneGraph.add_edges_from((source, target, {} if edgeLabel is None else {'label': edgeLabel})
+                              for source, target, edgeLabel in edgeList)
+    return sceneGraph
+
+
+# Build the query index straight from the compiled arrays, without going through networkx or the name regexes.  The
+# index is made of plain dicts, lists and tuples with no reference cycles, so the cyclic garbage collector is held off
+# while they are created; otherwise its repeated passes over the growing index take about as long as building it.
+def compiledToIndex(compiledGraph: CompiledSceneGraph):
+    sceneGraphIndex = SceneGraphIndex()
+    collectorWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for nodeName, nodeType, baseName, attributeName in zip(compiledGraph.nodeNames, compiledGraph.nodeTypes,
+                                                               compiledGraph.nodeBaseNames,
+                                                               compiledGraph.nodeAttributeNames):
+            sceneGraphIndex.addNode(nodeName, nodeType, baseName, attributeName)
+        for source, target, edgeLabel in compiledGraph.iterEdges():
+            sceneGraphIndex.addEdge(source, target, edgeLabel)
+    finally:
+        if collectorWasEnabled:
+            gc.enable()
+    return sceneGraphIndex
+
+
+# Read the compiled form if a fresh one exists.  Returns None when the GraphML has to be parsed instead.
+def _readFreshCache(graphmlFile: str):
+    cacheFile = cachePathFor(graphmlFile)
+    if not isCacheFresh(graphmlFile, cacheFile):
+        return None
+    try:
+        return readCompiledSceneGraph(cacheFile)
+    except (OSError, ValueError):
+        # A stale format or damaged cache is simply ignored and rewritten from the GraphML
+        return None
+
+
+# Load a scene graph as a networkx graph, using the compiled cache when it is newer than the GraphML file and
+# otherwise parsing the XML (and, with writeCache set, compiling it for next time).
+def loadSceneGraph(graphmlFile: str, writeCache=True):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return _loadSceneGraph(graphmlFile, writeCache)
+    startTime = QueryInstrumentation.clock()
+    sceneGraph = _loadSceneGraph(graphmlFile, writeCache)
+    queryRecorder.recordStage('load', QueryInstrumentation.clock() - startTime, graphmlFile)
+    queryRecorder.recordWork('load', sceneGraph.number_of_nodes(), sceneGraph.number_of_edges())
+    return sceneGraph
+
+
+def _loadSceneGraph(graphmlFile, writeCache):
+    compiledGraph = _readFreshCache(graphmlFile)
+    if compiledGraph is not None:
+        return compiledToGraph(compiledGraph)
+    import networkx
+    sceneGraph = networkx.read_graphml(graphmlFile)
+    if writeCache:
+        _writeCacheIfPossible(sceneGraph, graphmlFile)
+    return sceneGraph
+
+
+# Same as loadSceneGraph, but hands back the query index directly, without involving networkx: a cache hit builds the
+# index from the compiled arrays, and a cache miss streams the GraphML straight into the index (then, with writeCache
+# set, compiles the index for next time).
+def loadSceneGraphIndex(graphmlFile: str, writeCache=True):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is None:
+        return _loadSceneGraphIndex(graphmlFile, writeCache)
+    startTime = QueryInstrumentation.clock()
+    sceneGraphIndex = _loadSceneGraphIndex(graphmlFile, writeCache)
+    queryRecorder.recordStage('load', QueryInstrumentation.clock() - startTime, graphmlFile)
+    queryRecorder.recordWork('load', len(sceneGraphIndex), sceneGraphIndex.edgeCount)
+    return sceneGraphIndex
+
+
+def _loadSceneGraphIndex(graphmlFile, writeCache):
+    compiledGraph = _readFreshCache(graphmlFile)
+    if compiledGraph is not None:
+        return compiledToIndex(compiledGraph)
+    if not writeCache:
+        return streamSceneGraphIndex(graphmlFile)
+    nodeIds = {}
+    sceneGraphIndex = streamSceneGraphIndex(graphmlFile, nodeIds=nodeIds)
+    _writeCacheIfPossible(sceneGraphIndex, graphmlFile, nodeIds)
+    return sceneGraphIndex
+
+
+# Compile every GraphML file named on the command line (directories are searched for *.graphml)
+def main():
+    for commandArgument in sys.argv[1:]:
+        if os.path.isdir(commandArgument):
+            graphmlFiles = sorted(os.path.join(commandArgument, fileName) for fileName in os.listdir(commandArgument)
+                                  if fileName.endswith('.graphml'))
+        else:
+            graphmlFiles = [commandArgument]
+        for graphmlFile in graphmlFiles:
+            compileSceneGraph(graphmlFile)
+            print("Compiled " + graphmlFile + " -> " + cachePathFor(graphmlFile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import re
+from ContextGapTracking import ContextGapTracker
+
+# Name of the edge data key holding the relation label in the GraphML files
+CONST_EDGE_LABEL_KEY = 'label'
+# Node types and the attribute edge label used by the graphs with attributes, as given to the mutation methods
+CONST_OBJECT_TYPE = 'obj'
+CONST_ATTRIBUTE_TYPE = 'attr'
+CONST_HAS_ATTRIBUTE_EDGE = 'has_attribute'
+_UNDERSCORE_NUMBER_PATTERN = re.compile(r'_\d+')
+_UNDERSCORE_ATTR_PATTERN = re.compile(r'_attr$')
+
+
+# Strip off the "_#" at the end of an object name
+def stripOffUnderscoreNumber(textToStrip):
+    # For each node, strip off the "_#" if present - see assumptions at top of file
+    strippedText = _UNDERSCORE_NUMBER_PATTERN.sub('', textToStrip)
+    return strippedText
+
+
+# Strip off the "_attr" at the end of an attribute name
+def stripOffUnderscoreAttr(textToStrip):
+    # For each node, strip off the "_attr" if present - see assumptions at top of file
+    strippedText = _UNDERSCORE_ATTR_PATTERN.sub('', textToStrip)
+    return strippedText
+
+
+# Precomputed lookup tables over a scene graph, built once when the graph is loaded.  Every node name is run through
+# stripOffUnderscoreNumber/stripOffUnderscoreAttr exactly once here, so the query handlers can resolve a queried name
+# with a dictionary lookup instead of rescanning (and re-running the regexes on) the whole graph for every query.
+# The index keeps its own copy of the adjacency and node types, so it does not need the networkx graph after building.
+#
+# The index can also be changed in place as a scene graph is refined, through addObject/removeObject,
+# addAttribute/removeAttribute and addRelation/removeRelation (arguments in the same order as in the queries, e.g.
+# addRelation('on', 'hat', 'man') for relation(on,hat,man)).  Every lookup table and the context gaps are updated for
+# just the nodes and edges involved, so there is no need to re-read the GraphML.  With enableResultCache, query results
+# are memoized on the index and only recomputed once a name or label they depend on changes (see QueryResultCache.py).
+class SceneGraphIndex:
+    def __init__(self):
+        # Node name -> value of its "type" data (None if the node has no type, as in the plain scene graphs)
+        self.nodeTypes = {}
+        # Base name (node name with the "_#" stripped off) -> list of node names, in graph order
+        self.nodesByBaseName = {}
+        # Attribute name (node name with the "_attr" stripped off) -> list of node names, in graph order
+        self.nodesByAttributeName = {}
+        # Node name -> its base name and its attribute name, so the edges of a node never re-run the regexes
+        self.nodeBaseNames = {}
+        self.nodeAttributeNames = {}
+        # Node name -> {neighbour name: [edge labels]} for the outgoing and incoming edges of the node.  read_graphml
+        # returns a MultiDiGraph when a pair of objects has more than one relation, so a pair can carry several labels.
+        self.successors = {}
+        self.predecessors = {}
+        # (source, label, target) lookup tables keyed on base names, each holding the matching edge triples
+        self.triplesBySourceTarget = {}
+        self.triplesBySourceLabel = {}
+        self.triplesByLabelTarget = {}
+        self.triplesBySourceLabelTarget = {}
+        # Label-partitioned adjacency: label -> {source: [targets]} and label -> {target: [sources]}, so pattern queries
+        # can walk only the edges carrying a given relation
+        self.successorsByLabel = {}
+        self.predecessorsByLabel = {}
+        # Number of edges carrying each label, and in total, for estimating how selective a pattern is
+        self.labelEdgeCounts = {}
+        self.edgeCount = 0
+        # Nodes with no edges connected to them, kept up to date as edges are added and removed
+        self.contextGaps = ContextGapTracker()
+        # Sparse objects x attributes matrix for batched attribute checks, built on first use by getAttributeMatrix and
+        # dropped whenever the graph changes
+        self.attributeMatrix = None
+        # Fuzzy/synonym lookup over the base names and labels for suggesting fixes to lexical gaps, built on first use by
+        # getGapResolver and dropped whenever a name or label is added or goes away.  synonymTable replaces the
+        # default synonyms (see LexicalGapResolution.py) when set.
+        self.gapResolver = None
+        self.synonymTable = None
+        # QueryResultCache of answered queries, told about every change to the graph; None unless enableResultCache
+        # has been called
+        self.resultCache = None
+
+    # Build the index from a networkx graph (DiGraph or MultiDiGraph) as returned by networkx.read_graphml
+    @classmethod
+    def fromGraph(cls, sceneGraph, typeLabel='type'):
+        sceneGraphIndex = cls()
+        for currentNode, nodeType in sceneGraph.nodes(data=typeLabel):
+            sceneGraphIndex.addNode(currentNode, nodeType)
+        for source, target, edgeLabel in sceneGraph.edges(data=CONST_EDGE_LABEL_KEY):
+            sceneGraphIndex.addEdge(source, target, edgeLabel)
+        return sceneGraphIndex
+
+    def __len__(self):
+        return len(self.nodeTypes)
+
+    def __iter__(self):
+        return iter(self.nodeTypes)
+
+    def __contains__(self, nodeName):
+        return nodeName in self.nodeTypes
+
+    # Register a node and file it under its stripped names.  Adding a node that is already present only updates its type.
+    # Callers that already know the stripped names (the compiled cache stores them) can pass them in.
+    def addNode(self, nodeName, nodeType=None, baseName=None, attributeName=None):
+        if nodeName in self.nodeTypes:
+            if nodeType is not None and nodeType != self.nodeTypes[nodeName]:
+                self.nodeTypes[nodeName] = nodeType
+                self.attributeMatrix = None
+                if self.resultCache is not None:
+                    self.resultCache.nodeChanged(nodeName)
+            return
+        self.nodeTypes[nodeName] = nodeType
+        self.attributeMatrix = None
+        if baseName is None:
+            baseName = stripOffUnderscoreNumber(nodeName)
+        if attributeName is None:
+            attributeName = stripOffUnderscoreAttr(nodeName)
+        if baseName not in self.nodesByBaseName:
+            self._vocabularyChanged()
+        if self.resultCache is not None:
+            self.resultCache.nodeChanged(nodeName)
+        self.nodeBaseNames[nodeName] = baseName
+        self.nodeAttributeNames[nodeName] = attributeName
+        self.nodesByBaseName.setdefault(baseName, []).append(nodeName)
+        self.nodesByAttributeName.setdefault(attributeName, []).append(nodeName)
+        self.successors[nodeName] = {}
+        self.predecessors[nodeName] = {}
+        self.contextGaps.addNode(nodeName)
+
+    # Register a directed edge and file its triple under every combination of base names and label used by the handlers
+    def addEdge(self, source, target, edgeLabel):
+        if source not in self.nodeTypes:
+            self.addNode(source)
+        if target not in self.nodeTypes:
+            self.addNode(target)
+        self.attributeMatrix = None
+        self.successors[source].setdefault(target, []).append(edgeLabel)
+        self.predecessors[target].setdefault(source, []).append(edgeLabel)
+        self.contextGaps.addEdge(source, target)
+        self.successorsByLabel.setdefault(edgeLabel, {}).setdefault(source, []).append(target)
+        self.predecessorsByLabel.setdefault(edgeLabel, {}).setdefault(target, []).append(source)
+        if edgeLabel not in self.labelEdgeCounts:
+            self._vocabularyChanged()
+        if self.resultCache is not None:
+            self.resultCache.edgeChanged(source, edgeLabel, target)
+        self.labelEdgeCounts[edgeLabel] = self.labelEdgeCounts.get(edgeLabel, 0) + 1
+        self.edgeCount += 1
+        edgeTriple = (source, edgeLabel, target)
+        sourceName = self.nodeBaseNames[source]
+        targetName = self.nodeBaseNames[target]
+        self.triplesBySourceTarget.setdefault((sourceName, targetName), []).append(edgeTriple)
+        self.triplesBySourceLabel.setdefault((sourceName, edgeLabel), []).append(edgeTriple)
+        self.triplesByLabelTarget.setdefault((edgeLabel, targetName), []).append(edgeTriple)
+        self.triplesBySourceLabelTarget.setdefault((sourceName, edgeLabel, targetName), []).append(edgeTriple)
+
+    # Remove one directed edge (the one with the given label, or the oldest between the pair if no label is given) and
+    # drop its triple from the lookup tables
+    def removeEdge(self, source, target, edgeLabel=None):
+        edgeLabels = self.successors[source][target]
+        if edgeLabel is None:
+            edgeLabel = edgeLabels[0]
+        self.attributeMatrix = None
+        _removeFromTable(self.successors[source], target, edgeLabel)
+        _removeFromTable(self.predecessors[target], source, edgeLabel)
+        self.contextGaps.removeEdge(source, target)
+        _removeFromTable(self.successorsByLabel[edgeLabel], source, target)
+        _removeFromTable(self.predecessorsByLabel[edgeLabel], target, source)
+        self.labelEdgeCounts[edgeLabel] -= 1
+        if self.labelEdgeCounts[edgeLabel] == 0:
+            del self.successorsByLabel[edgeLabel]
+            del self.predecessorsByLabel[edgeLabel]
+            del self.labelEdgeCounts[edgeLabel]
+            self._vocabularyChanged()
+        if self.resultCache is not None:
+            self.resultCache.edgeChanged(source, edgeLabel, target)
+        self.edgeCount -= 1
+        edgeTriple = (source, edgeLabel, target)
+        sourceName = self.nodeBaseNames[source]
+        targetName = self.nodeBaseNames[target]
+        _removeFromTable(self.triplesBySourceTarget, (sourceName, targetName), edgeTriple)
+        _removeFromTable(self.triplesBySourceLabel, (sourceName, edgeLabel), edgeTriple)
+        _removeFromTable(self.triplesByLabelTarget, (edgeLabel, targetName), edgeTriple)
+        _removeFromTable(self.triplesBySourceLabelTarget, (sourceName, edgeLabel, targetName), edgeTriple)
+        return edgeLabel
+
+    # Remove a node together with every edge going in or out of it
+    def removeNode(self, nodeName):
+        for target, edgeLabels in list(self.successors[nodeName].items()):
+            for edgeLabel in list(edgeLabels):
+                self.removeEdge(nodeName, target, edgeLabel)
+        for source, edgeLabels in list(self.predecessors[nodeName].items()):
+            for edgeLabel in list(edgeLabels):
+                self.removeEdge(source, nodeName, edgeLabel)
+        del self.nodeTypes[nodeName]
+        self.attributeMatrix = None
+        baseName = self.nodeBaseNames.pop(nodeName)
+        _removeFromTable(self.nodesByBaseName, baseName, nodeName)
+        _removeFromTable(self.nodesByAttributeName, self.nodeAttributeNames.pop(nodeName), nodeName)
+        if baseName not in self.nodesByBaseName:
+            self._vocabularyChanged()
+        if self.resultCache is not None:
+            self.resultCache.nodeChanged(nodeName)
+        del self.successors[nodeName]
+        del self.predecessors[nodeName]
+        self.contextGaps.removeNode(nodeName)
+
+    # Add an object node, e.g. addObject('bat_2').  Adding an object that is already present does nothing.
+    def addObject(self, objectName):
+        if objectName not in self.nodeTypes:
+            self.addNode(objectName, CONST_OBJECT_TYPE)
+
+    # Remove an object node and all of its relations and attributes.  Attribute nodes no other object has are removed
+    # with it.
+    def removeObject(self, objectName):
+        self._checkNodes(objectName)
+        attributeNodes = [attributeNode for attributeNode, edgeLabels in self.successors[objectName].items()
+                          if CONST_HAS_ATTRIBUTE_EDGE in edgeLabels and attributeNode != objectName]
+        self.removeNode(objectName)
+        for attributeNode in attributeNodes:
+            self._removeIfUnused(attributeNode)
+
+    # Give an existing object an attribute, as a has_attribute edge to the "<attribute>_attr" node (added if the graph
+    # does not have it yet), e.g. addAttribute('red', 'shirt') for attribute(red,shirt).  Returns the attribute node.
+    def addAttribute(self, attributeName, objectName):
+        self._checkNodes(objectName)
+        attributeNode = attributeName + '_' + CONST_ATTRIBUTE_TYPE
+        self.addNode(attributeNode, CONST_ATTRIBUTE_TYPE)
+        if CONST_HAS_ATTRIBUTE_EDGE not in self.getEdgeLabels(objectName, attributeNode):
+            self.addEdge(objectName, attributeNode, CONST_HAS_ATTRIBUTE_EDGE)
+        return attributeNode
+
+    # Take an attribute off an object.  The attribute node goes too once no object has the attribute any more.
+    def removeAttribute(self, attributeName, objectName):
+        attributeNode = attributeName + '_' + CONST_ATTRIBUTE_TYPE
+        self.removeRelation(CONST_HAS_ATTRIBUTE_EDGE, objectName, attributeNode)
+        self._removeIfUnused(attributeNode)
+
+    # Add a relation between two existing nodes, e.g. addRelation('on', 'hat', 'man') for relation(on,hat,man)
+    def addRelation(self, edgeLabel, source, target):
+        self._checkNodes(source, target)
+        self.addEdge(source, target, edgeLabel)
+
+    # Remove one relation between two nodes.  Raises KeyError if the graph has no such edge.
+    def removeRelation(self, edgeLabel, source, target):
+        self._checkNodes(source, target)
+        if edgeLabel not in self.getEdgeLabels(source, target):
+            raise KeyError("No " + repr(edgeLabel) + " edge from " + repr(source) + " to " + repr(target))
+        self.removeEdge(source, target, edgeLabel)
+
+    def _checkNodes(self, *nodeNames):
+        for nodeName in nodeNames:
+            if nodeName not in self.nodeTypes:
+                raise KeyError("No node named " + repr(nodeName) + " in the scene graph")
+
+    # Remove an attribute node left with no edges
+    def _removeIfUnused(self, attributeNode):
+        if self.contextGaps.isContextGap(attributeNode):
+            self.removeNode(attributeNode)
+
+    # A base name or label appeared or went away, so the gap resolver no longer covers the graph's vocabulary
+    def _vocabularyChanged(self):
+        self.gapResolver = None
+        if self.resultCache is not None:
+            self.resultCache.vocabularyChanged()
+
+    # All nodes whose name, with the "_#" stripped off, matches the queried name
+    def nodesWithBaseName(self, baseName):
+        return self.nodesByBaseName.get(baseName, [])
+
+    # All nodes whose name, with the "_attr" stripped off, matches the queried attribute
+    def nodesWithAttributeName(self, attributeName):
+        return self.nodesByAttributeName.get(attributeName, [])
+
+    # The AttributeMatrix of the graph, or None when NumPy/SciPy are not installed (attributeCheckQueries then works
+    # from the lookup tables instead)
+    def getAttributeMatrix(self):
+        if self.attributeMatrix is None:
+            try:
+                from AttributeMatrix import AttributeMatrix
+            except ImportError:
+                return None
+            self.attributeMatrix = AttributeMatrix.fromIndex(self)
+        return self.attributeMatrix
+
+    # The LexicalGapResolver of the graph, for suggesting what a queried name or label that is not in it was meant to be
+    def getGapResolver(self):
+        if self.gapResolver is None:
+            from LexicalGapResolution import LexicalGapResolver
+            self.gapResolver = LexicalGapResolver.fromIndex(self, self.synonymTable)
+        return self.gapResolver
+
+    # Use a different synonym table for gap resolution (see LexicalGapResolution.readSynonymFile), or None for the
+    # default one
+    def setSynonymTable(self, synonymTable):
+        self.synonymTable = synonymTable
+        self._vocabularyChanged()
+
+    # Memoize query results on this index, keeping up to capacity of them, and return the QueryResultCache.
+    # answerQuery/answerQueryPlan then serve repeated queries from it until the graph changes under them.
+    def enableResultCache(self, capacity=None):
+        from QueryResultCache import QueryResultCache
+        self.resultCache = QueryResultCache() if capacity is None else QueryResultCache(capacity)
+        return self.resultCache
+
+    def disableResultCache(self):
+        self.resultCache = None
+
+    # Labels of every edge going from source to target (more than one if the graph is a multigraph)
+    def getEdgeLabels(self, source, target):
+        return self.successors[source].get(target, [])
+
+
+# Remove one entry from a list kept in a lookup table, dropping the key when nothing is left under it
+def _removeFromTable(lookupTable, tableKey, tableEntry):
+    tableEntries = lookupTable[tableKey]
+    tableEntries.remove(tableEntry)
+    if not tableEntries:
+        del lookupTable[tableKey]
+
+
+# Handlers accept either a prebuilt SceneGraphIndex or a networkx graph.  Passing the raw graph still works but builds a
+# throwaway index on every call, so anything answering more than one query should build the index once up front.
+def getSceneGraphIndex(sceneGraph):
+    if isinstance(sceneGraph, SceneGraphIndex):
+        return sceneGraph
+    return SceneGraphIndex.fromGraph(sceneGraph)
@@ -1,10 +1,17 @@
-import networkx
+import argparse
+import json
+import os
+import sys
 from QuestionHandling import *
+from SceneGraphCache import loadSceneGraphIndex
+from ContextGapTracking import ContextGapTracker
+import QueryInstrumentation
 
+# Default scene graph, used when none is named on the command line
 scene_graph_file = "2377804_with_attributes.graphml"
-existence_keyword = "exists"
-relation_keyword = "relation"
-attribute_keyword = "attribute"
+existence_keyword = CONST_EXISTENCE_KEYWORD
+relation_keyword = CONST_RELATION_KEYWORD
+attribute_keyword = CONST_ATTRIBUTE_KEYWORD
 
 ''' Note for Goonmeet: The way Lexical Gaps are identified here might not be ideal - should "this item isn't in the node"
  be treated as a gap or just a "nope, not present"?  We may need to put our heads together on that one; I think it
@@ -12,10 +19,19 @@ attribute_keyword = "attribute"
  doesn't exist opens up a lexical gap, even if it's an acceptable one?  Same goes for the target gap, at least 
  in the existence query'''
 
+# Command line use:
+#   python SceneGraphProcessing.py [graph.graphml]                      interactive prompt
+#   python SceneGraphProcessing.py graph.graphml "exists(bat)" ...      answer the queries given as arguments
+#   python SceneGraphProcessing.py graph.graphml -f queries.txt         answer one query per line of a file ("-" is stdin)
+#   cat queries.txt | python SceneGraphProcessing.py graph.graphml      queries piped in on stdin
+# --json prints one JSON line per query (the QueryResult fields, as from BatchQueryProcessing) instead of the messages.
+# The graph is loaded through its compiled .sgc cache (see SceneGraphCache.py), and nothing here imports networkx, so a
+# one-shot query against a compiled graph only pays for reading the cache.
+
 # Nodes are items (eventually attributes also), edges are positioning relationships (or eventually hasAttribute)
 
 # ASSUMPTIONS:
-# Users enter queries correct conforming to the format.
+# Users enter queries correct conforming to the format (anything else is rejected by the parser in QueryParsing.py).
 # When the user asks about, say "jersey", it's reasonable to look at jersey, jersey_1, and jersey_2; thus, the "_X"
 # will be ignored
 
@@ -24,56 +40,131 @@ attribute_keyword = "attribute"
 # attributes as such.  i.e. name: pants, type: object; name: orange, type: attribute
 
 # Check each node in the scene graph to see if it has edges connected to it.  If it has no edges connected to it, flag
-# a context gap on that node.
+# a context gap on that node.  Works on a networkx graph (one pass over its degree view) or on a SceneGraphIndex, whose
+# ContextGapTracker already knows the answer and keeps it current as the graph is edited.
 def contextGapCheck(sceneGraph):
+    queryRecorder = QueryInstrumentation.activeRecorder
+    if queryRecorder is not None:
+        startTime = QueryInstrumentation.clock()
+    if isinstance(sceneGraph, SceneGraphIndex):
+        contextGapTracker = sceneGraph.contextGaps
+    else:
+        contextGapTracker = ContextGapTracker.fromGraph(sceneGraph)
     # Making a list of all the nodes that have context gaps.  It's unused at this point, but it may be useful at some
     # point?
-    contextGappedNodes = []
-
-    # Maybe not the most efficient thing - proof of concept, optimization can come later
-    # Iterate through all the nodes of the graph, check their in/out edges and see if there's any that just don't have
-    # edges
-    for currentNode in sceneGraph.nodes:
-        # Grab all the edges coming in and out of the current node and see if there are none.
-        nodeOutEdges = sceneGraph.out_edges(currentNode)
-        nodeInEdges = sceneGraph.in_edges(currentNode)
-        allNodeEdges = list(nodeOutEdges) + list(nodeInEdges)
-        if allNodeEdges == []:
-            # If no edges connected to the node, a context gap may be in order.
-            print("WARNING: Potential context gap identified!  Node " + currentNode + " has no edges connected to it!")
-            contextGappedNodes.append(currentNode)
+    contextGappedNodes = contextGapTracker.contextGappedNodes()
+    for currentNode in contextGappedNodes:
+        # If no edges connected to the node, a context gap may be in order.
+        print("WARNING: Potential context gap identified!  Node " + currentNode + " has no edges connected to it!")
+    if queryRecorder is not None:
+        queryRecorder.recordStage('contextGapCheck', QueryInstrumentation.clock() - startTime)
+        # The tracker of an index hands over its gapped nodes without looking at the rest; a networkx graph is scanned
+        checkedNodeCount = len(contextGappedNodes) if isinstance(sceneGraph, SceneGraphIndex) else len(sceneGraph)
+        queryRecorder.recordWork('contextGapCheck', checkedNodeCount, None)
     return contextGappedNodes
 
 
-def main():
-    # Load in the scene graph
-    sceneGraph = networkx.read_graphml(scene_graph_file)
-    # Prior to any querying, check for context gaps on certain items
-    # Returns a list of nodes which have context gaps.  Currently unused but maybe eventually useful?
-    contextGappedNodes = contextGapCheck(sceneGraph)
+# Answer a list of queries without prompting.  Returns False if any query could not be parsed.
+def answerQueries(queries, sceneGraphIndex, outputJson=False):
+    allParsed = True
+    for userQuery in queries:
+        try:
+            queryResult = answerQuery(userQuery, sceneGraphIndex, not outputJson)
+        except QuerySyntaxError as syntaxError:
+            allParsed = False
+            if outputJson:
+                print(json.dumps({'query': userQuery, 'error': str(syntaxError)}))
+            else:
+                print("ERROR: Could not understand the query - " + str(syntaxError))
+            continue
+        if outputJson:
+            queryRecord = {'query': userQuery}
+            queryRecord.update(queryResult.toDict())
+            print(json.dumps(queryRecord))
+    return allParsed
+
+
+def interactiveLoop(sceneGraphIndex):
     # Get user query.  Eventually need to add attribute handling when attributes are available.
     userQuery = input("Please enter a query in the format KEYWORD(arguments), with the following options: \n " +
           existence_keyword + "(object) \n" + relation_keyword + "(relationString,object1,object2) \n"
                       + attribute_keyword + "(attribute,object) \n")
-    while userQuery != 'q' and userQuery != 'exit' and userQuery != 'quit':
-        # Break query up into relevant parts
-        queryType = userQuery.split('(', 1)[0]
-        queryContents = userQuery.split('(', 1)[1]
-        # Handle the exists(object) case
-        if queryType == existence_keyword:
-            itemExistenceQuery(queryContents, sceneGraph)
-            pass
-        # Handle the relation(object1,object2) case
-        if queryType == relation_keyword:
-            relationQueryHandler(queryContents, sceneGraph)
-            pass
-        # Handle the attribute case - NOT PRESENT
-        if queryType == attribute_keyword:
-            # ATTRIBUTE CASE
-            attributeQueryHandler(queryContents, sceneGraph)
+    while userQuery not in CONST_QUIT_COMMANDS:
+        # Parse the query and hand it to the matching handler.  A malformed query is reported and the user asked again.
+        try:
+            answerQuery(userQuery, sceneGraphIndex)
+        except QuerySyntaxError as syntaxError:
+            print("ERROR: Could not understand the query - " + str(syntaxError))
         userQuery = input("Please enter a query in the format KEYWORD(arguments), with the following options: \n " +
                           existence_keyword + "(object) \n" + relation_keyword + "(relationString,object1,object2) \n"
                           + attribute_keyword + "(attribute,object) \n")
 
 
-main()
\ No newline at end of file
+def _isQuery(commandArgument):
+    try:
+        parseQuery(commandArgument)
+    except QuerySyntaxError:
+        return False
+    return True
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Answer queries about a scene graph.')
+    argumentParser.add_argument('graph', nargs='?', default=scene_graph_file,
+                                help='GraphML file to query (default: ' + scene_graph_file + ')')
+    argumentParser.add_argument('queries', nargs='*', help='queries to answer, e.g. "exists(bat)"')
+    argumentParser.add_argument('-f', '--query-file', help='file with one query per line ("-" reads stdin)')
+    argumentParser.add_argument('--json', action='store_true',
+                                help='print one JSON result per query instead of messages (no context gap warnings)')
+    argumentParser.add_argument('--synonyms', help='synonym file for lexical gap suggestions, one comma-separated group '
+                                                   'per line (see LexicalGapResolution.py)')
+    argumentParser.add_argument('--metrics', metavar='FILE',
+                                help='record stage timings and write them to FILE (Prometheus text if it ends in '
+                                     '.prom, JSON otherwise)')
+    argumentParser.add_argument('--no-context-gaps', action='store_true', help='skip the context gap warnings')
+    argumentParser.add_argument('--no-write-cache', action='store_true',
+                                help='do not write a compiled .sgc cache if the graph has none')
+    # Intermixed, so options may come after the queries as well as before them
+    arguments = argumentParser.parse_intermixed_args()
+
+    # The graph is an optional positional, so a query given without a graph lands in its place
+    if not os.path.exists(arguments.graph) and _isQuery(arguments.graph):
+        argumentParser.error(repr(arguments.graph) + ' is a query, not a scene graph file; name the graph first, e.g. ' +
+                             scene_graph_file + ' ' + repr(arguments.graph))
+    queries = list(arguments.queries)
+    if arguments.query_file == '-':
+        queries += readQueries(sys.stdin)
+    elif arguments.query_file is not None:
+        with open(arguments.query_file, encoding='utf-8') as queryStream:
+            queries += readQueries(queryStream)
+    elif not queries and not sys.stdin.isatty():
+        queries = readQueries(sys.stdin)
+    queryRecorder = QueryInstrumentation.enableInstrumentation() if arguments.metrics is not None else None
+    interactive = not queries and arguments.query_file is None and sys.stdin.isatty()
+
+    # Load the query index, from the compiled cache if there is an up to date one.  The index answers every query from
+    # its name/label lookup tables instead of a full scan.
+    try:
+        sceneGraphIndex = loadSceneGraphIndex(arguments.graph, not arguments.no_write_cache)
+    except OSError as loadError:
+        argumentParser.error('could not load scene graph: ' + str(loadError))
+    if arguments.synonyms is not None:
+        from LexicalGapResolution import readSynonymFile
+        sceneGraphIndex.setSynonymTable(readSynonymFile(arguments.synonyms))
+    # Prior to any querying, check for context gaps on certain items
+    # Returns a list of nodes which have context gaps.  Currently unused but maybe eventually useful?
+    if not arguments.no_context_gaps and not arguments.json:
+        contextGappedNodes = contextGapCheck(sceneGraphIndex)
+    if interactive:
+        interactiveLoop(sceneGraphIndex)
+        allParsed = True
+    else:
+        allParsed = answerQueries(queries, sceneGraphIndex, arguments.json)
+    if queryRecorder is not None:
+        queryRecorder.writeTo(arguments.metrics)
+    if not allParsed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import xml.etree.ElementTree as ElementTree
+from SceneGraphIndex import SceneGraphIndex
+
+# Streaming loader for scene graph GraphML files too large for networkx.read_graphml, which builds a whole DOM and then
+# a dict-of-dicts graph before the index can be built from it.  This reads the file with iterparse, handling each node
+# and edge as soon as its closing tag is read and discarding the element straight after, and feeds them into a
+# SceneGraphIndex directly, so the only thing kept in memory is the index itself.
+#
+# Only the schema used in this project is understood: a "type" data key on nodes ("obj" or "attr"; the "id" data is not
+# needed by the index and is skipped) and a "label" data key on edges.  Filters can be applied while loading:
+#   nodeTypes   keep only nodes whose type is in this set (None in the set keeps nodes with no type)
+#   edgeLabels  keep only edges whose label is in this set
+# Edges touching a node that was filtered out are dropped with it.  A caller that does want the "id" data (the compiled
+# cache writer, see SceneGraphCache.py) passes a nodeIds dict, which is filled with the id of every kept node.
+#
+# Usage: python StreamingGraphLoader.py 2377804_with_attributes.graphml --node-types obj --labels on wearing
+
+CONST_NODE_TYPE_KEY = 'type'
+CONST_NODE_ID_KEY = 'id'
+CONST_EDGE_LABEL_KEY = 'label'
+
+
+# Element tag without the GraphML namespace
+def _localName(elementTag):
+    return elementTag.rpartition('}')[2]
+
+
+# Build a SceneGraphIndex from a GraphML file (path or binary file object) in a single streaming pass
+def streamSceneGraphIndex(graphmlFile, nodeTypes=None, edgeLabels=None, typeLabel=CONST_NODE_TYPE_KEY, nodeIds=None):
+    sceneGraphIndex = SceneGraphIndex()
+    # GraphML data key id (d0, d1, ...) -> attribute name, from the <key> declarations
+    dataKeyNames = {}
+    # Nodes that were read and dropped by the node filter, so their edges can be dropped too
+    droppedNodes = set()
+    # With a node filter, an edge can only be kept once both its ends are known to pass it.  Edges naming a node that
+    # has not been declared yet are held here until the end of the file.
+    pendingEdges = []
+    graphElement = None
+
+    for parseEvent, currentElement in ElementTree.iterparse(graphmlFile, events=('start', 'end')):
+        elementName = _localName(currentElement.tag)
+        if parseEvent == 'start':
+            if elementName == 'graph':
+                graphElement = currentElement
+            continue
+
+        if elementName == 'node':
+            nodeName = currentElement.get('id')
+            nodeType = _dataValue(currentElement, dataKeyNames, typeLabel)
+            if nodeTypes is None or nodeType in nodeTypes:
+                sceneGraphIndex.addNode(nodeName, nodeType)
+                if nodeIds is not None:
+                    nodeIds[nodeName] = _dataValue(currentElement, dataKeyNames, CONST_NODE_ID_KEY)
+            else:
+                droppedNodes.add(nodeName)
+        elif elementName == 'edge':
+            edgeLabel = _dataValue(currentElement, dataKeyNames, CONST_EDGE_LABEL_KEY)
+            if edgeLabels is None or edgeLabel in edgeLabels:
+                source = currentElement.get('source')
+                target = currentElement.get('target')
+                if nodeTypes is None:
+                    sceneGraphIndex.addEdge(source, target, edgeLabel)
+                elif source in droppedNodes or target in droppedNodes:
+                    pass
+                elif source in sceneGraphIndex and target in sceneGraphIndex:
+                    sceneGraphIndex.addEdge(source, target, edgeLabel)
+                else:
+                    pendingEdges.append((source, target, edgeLabel))
+        elif elementName == 'key':
+            dataKeyNames[currentElement.get('id')] = currentElement.get('attr.name')
+        else:
+            # <data> elements are read with their node or edge; anything else is left to its parent
+            continue
+        # Done with this element: drop it from the tree so the parsed file never accumulates in memory
+        if graphElement is not None:
+            graphElement.clear()
+        else:
+            currentElement.clear()
+
+    for source, target, edgeLabel in pendingEdges:
+        # A node that was never declared has no type, so it only passes a filter that keeps untyped nodes
+        if source not in droppedNodes and target not in droppedNodes and \
+                (source in sceneGraphIndex or None in nodeTypes) and (target in sceneGraphIndex or None in nodeTypes):
+            sceneGraphIndex.addEdge(source, target, edgeLabel)
+    return sceneGraphIndex
+
+
+# Value of the <data> child of a node or edge element carrying the named attribute, or None
+def _dataValue(graphElement, dataKeyNames, attributeName):
+    for dataElement in graphElement:
+        if dataKeyNames.get(dataElement.get('key')) == attributeName:
+            return dataElement.text
+    return None
+
+
+def main():
+    argumentParser = argparse.ArgumentParser(description='Load a large scene graph by streaming its GraphML.')
+    argumentParser.add_argument('graphml', help='GraphML file to load')
+    argumentParser.add_argument('--node-types', nargs='+', help='keep only nodes of these types, e.g. obj')
+    argumentParser.add_argument('--labels', nargs='+', help='keep only edges with these relation labels')
+    arguments = argumentParser.parse_args()
+    sceneGraphIndex = streamSceneGraphIndex(arguments.graphml,
+                                            set(arguments.node_types) if arguments.node_types else None,
+                                            set(arguments.labels) if arguments.labels else None)
+    print("Loaded " + str(len(sceneGraphIndex)) + " nodes and " + str(sceneGraphIndex.edgeCount) + " edges, " +
+          str(len(sceneGraphIndex.contextGaps)) + " of the nodes with no edges connected to them.")
+
+
+if __name__ == '__main__':
+    main()